@@ -0,0 +1,65 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    PostModel = apps.get_model('posts', 'PostModel')
+    RoadMapModel = apps.get_model('roadmaps', 'RoadMapModel')
+    Follow = Profile.followers.through
+    PostLike = PostModel.liked.through
+
+    def count(queryset, field, outer='pk'):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef(outer)}).order_by().values(field)
+            .annotate(count=Count('pk')).values('count')
+        ), 0)
+
+    Profile.objects.update(
+        count_follower=count(Follow.objects.all(), 'profile_id'),
+        count_following=count(Follow.objects.all(), 'user_id', 'user'),
+        count_posts=count(PostModel.objects.all(), 'posted_by', 'user'),
+        count_roadmaps=count(RoadMapModel.objects.all(), 'challenger', 'user'),
+        count_likes_received=count(PostLike.objects.all(), 'postmodel__posted_by', 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_username'),
+        ('posts', '0010_commentmodel_post_index'),
+        ('roadmaps', '0002_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='count_follower',
+            field=models.IntegerField(default=0, verbose_name='フォロワー数'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='count_following',
+            field=models.IntegerField(default=0, verbose_name='フォロー数'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='count_likes_received',
+            field=models.IntegerField(default=0, verbose_name='いいねされた数'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='count_posts',
+            field=models.IntegerField(default=0, verbose_name='投稿数'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='count_roadmaps',
+            field=models.IntegerField(default=0, verbose_name='ロードマップ数'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
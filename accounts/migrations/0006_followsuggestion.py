@@ -0,0 +1,41 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_profile_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='is_suggestion_stale',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.CreateModel(
+            name='FollowSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count_mutual', models.IntegerField(verbose_name='共通のフォロー数')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follow_suggestions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-count_mutual'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='followsuggestion',
+            index=models.Index(fields=['user', '-count_mutual'], name='accounts_fo_user_id_b3d19f_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='followsuggestion',
+            constraint=models.UniqueConstraint(fields=('user', 'suggested'), name='unique_follow_suggestion'),
+        ),
+    ]
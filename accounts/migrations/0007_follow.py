@@ -0,0 +1,52 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_followsuggestion'),
+    ]
+
+    operations = [
+        # Profile.followersが作ったテーブルを、そのままFollowモデルとして使う
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Follow',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.profile')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'accounts_profile_followers',
+                        'unique_together': {('profile', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='profile',
+                    name='followers',
+                    field=models.ManyToManyField(blank=True, related_name='following', through='accounts.Follow', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='フォローした日時'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['profile', '-created_at', '-id'], name='accounts_pr_profile_9a8f72_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='accounts_pr_user_id_9292ad_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_follow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='is_avatar_processed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:07
+
+import hashlib
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+BATCH_SIZE = 1000
+
+
+def hash_tokens(apps, schema_editor):
+    UserToken = apps.get_model('accounts', 'UserToken')
+    # 行が多いので、主キーの順にBATCH_SIZE件ずつ読んで書き込む
+    tokens = UserToken.objects.order_by('pk').only('pk', 'token')
+    last_id = None
+    while True:
+        batch = list((tokens.filter(pk__gt=last_id) if last_id else tokens)[:BATCH_SIZE])
+        if not batch:
+            break
+        for token in batch:
+            token.token = hashlib.sha256(token.token.encode('utf-8')).hexdigest()
+            # 既存のトークンは、それぞれ別のfamilyにする
+            token.family_id = token.id
+        UserToken.objects.bulk_update(batch, ['token', 'family_id'], batch_size=BATCH_SIZE)
+        last_id = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_profile_is_avatar_processed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertoken',
+            name='family_id',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(hash_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='usertoken',
+            name='family_id',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4),
+        ),
+        migrations.RenameField(
+            model_name='usertoken',
+            old_name='token',
+            new_name='token_hash',
+        ),
+        migrations.AlterField(
+            model_name='usertoken',
+            name='token_hash',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddField(
+            model_name='usertoken',
+            name='rotated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='usertoken',
+            name='expired_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='usertoken',
+            index=models.Index(fields=['token_hash', 'user_id', 'expired_at'], name='accounts_us_token_h_d99723_idx'),
+        ),
+        migrations.AddField(
+            model_name='reset',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
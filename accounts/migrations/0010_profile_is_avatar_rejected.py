@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_hash_refresh_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='is_avatar_rejected',
+            field=models.BooleanField(default=False),
+        ),
+    ]
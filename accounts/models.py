@@ -4,13 +4,28 @@ from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.dispatch import Signal
 from django.utils import timezone
 # from rest_framework_simplejwt.tokens import RefreshToken
+import hashlib
 import uuid
 import os
 
 
-class UserManager(BaseUserManager):
+# QuerySet.update()ではpost_saveが送られないので、更新したユーザーのidをまとめて通知する
+users_updated = Signal()
+
+
+class UserQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        users_updated.send(sender=self.model, user_ids=user_ids)
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
 
     def create_user(self, username, email, password=None):
         """
@@ -65,36 +80,43 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 
 class UserToken(models.Model):
+    """
+    発行したリフレッシュトークン。トークンそのものは保存せず、SHA-256のハッシュで引く。
+    リフレッシュするたびに同じfamily_idの新しいトークンに交換し、
+    交換済みのトークンが再び使われたら、そのfamilyをまとめて無効にする。
+    """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.UUIDField()
-    token = models.CharField(max_length=255)
+    token_hash = models.CharField(max_length=64)
+    family_id = models.UUIDField(default=uuid.uuid4, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    expired_at = models.DateTimeField()
+    expired_at = models.DateTimeField(db_index=True)
+    rotated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # リフレッシュ時の検索を索引だけで済ませる
+        indexes = [
+            models.Index(fields=['token_hash', 'user_id', 'expired_at']),
+        ]
 
 
 class Reset(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = models.CharField(max_length=255)
     token = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
 
 def upload_avatar_path(instance, filename):
-
-    profile_avarar_name_0 = 'avatars/profile_{0}_0.jpg'.format(
-        str(instance.id))
-    profile_avarar_name_1 = 'avatars/profile_{0}_1.jpg'.format(
-        str(instance.id))
-    full_path_0 = os.path.join(settings.MEDIA_ROOT, profile_avarar_name_0)
-    full_path_1 = os.path.join(settings.MEDIA_ROOT, profile_avarar_name_1)
-
-    if os.path.exists(full_path_0):
-        os.remove(full_path_0)
-        return profile_avarar_name_1
-    elif os.path.exists(full_path_1):
-        os.remove(full_path_1)
-        return profile_avarar_name_0
-    else:
-        return profile_avarar_name_0
+    """
+    画像の内容のハッシュをファイル名にする。内容が変われば名前も変わるので、
+    URLを長期間キャッシュでき、古いファイルを消したり名前を切り替えたりする必要がない。
+    """
+    sha256 = hashlib.sha256()
+    for chunk in instance.img.chunks():
+        sha256.update(chunk)
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    return f'avatars/{sha256.hexdigest()}{ext}'
 
 
 class Profile(models.Model):
@@ -106,8 +128,61 @@ class Profile(models.Model):
     img = models.ImageField(blank=True, null=True,
                             upload_to=upload_avatar_path)
     followers = models.ManyToManyField(
-        get_user_model(), related_name="following", blank=True)
+        get_user_model(), related_name="following", blank=True, through='Follow')
     bio = models.TextField(default="", blank=True, null=True)
+    # 集計済みの件数（reconcile_profile_countersで再集計できる）
+    count_follower = models.IntegerField('フォロワー数', default=0)
+    count_following = models.IntegerField('フォロー数', default=0)
+    count_posts = models.IntegerField('投稿数', default=0)
+    count_roadmaps = models.IntegerField('ロードマップ数', default=0)
+    count_likes_received = models.IntegerField('いいねされた数', default=0)
+    # 画像のサムネイルを作成済みか（process_avatarsで作成する）
+    is_avatar_processed = models.BooleanField(default=False, db_index=True)
+    # 画素数が大きすぎるなど、サムネイルを作成できない画像か。表示せず、作り直しもしない
+    is_avatar_rejected = models.BooleanField(default=False)
+    # フォローが変わり、おすすめユーザーの再計算が必要か
+    is_suggestion_stale = models.BooleanField(default=True, db_index=True)
 
     def __str__(self):
         return self.nick_name
+
+
+class Follow(models.Model):
+    """Profile.followersの中間テーブル。userがprofileをフォローしている"""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField('フォローした日時', auto_now_add=True)
+
+    class Meta:
+        # ManyToManyFieldが作ったテーブルをそのまま使う
+        db_table = 'accounts_profile_followers'
+        unique_together = [('profile', 'user')]
+        # フォロワー・フォロー一覧のカーソルページング用
+        indexes = [
+            models.Index(fields=['profile', '-created_at', '-id']),
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """
+    userへのおすすめユーザー（フォローしている人がフォローしている人）。
+    refresh_follow_suggestionsで計算する。
+    """
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='+')
+    # userがフォローしている人のうち、suggestedをフォローしている人の数
+    count_mutual = models.IntegerField('共通のフォロー数')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-count_mutual']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'suggested'], name='unique_follow_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-count_mutual']),
+        ]
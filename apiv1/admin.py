@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import EmailOutboxModel
+
+
+@admin.register(EmailOutboxModel)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
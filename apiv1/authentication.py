@@ -1,11 +1,123 @@
 import jwt
 import datetime
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
 from rest_framework import exceptions
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from .caching import get_cache_timeout
 # from accounts.models import User
 from django.contrib.auth import get_user_model
 
+# 認証でキャッシュするユーザーの列。パスワードなどはアクセスされたときに読む
+CACHED_USER_FIELDS = (
+    'id', 'email', 'username', 'is_verified', 'is_active', 'is_staff',
+    'is_superuser', 'date_joined', 'last_login',
+)
+
+
+class TokenCache:
+    """
+    デコード済みのアクセストークンを保持する、件数の上限と有効期限のあるLRUキャッシュ。
+    トークンの有効期限を過ぎたものは返さない。
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return user_id
+
+    def set(self, token, user_id, exp):
+        with self.lock:
+            self.entries[token] = (user_id, min(exp, time.time() + self.ttl))
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def get_user_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def get_user_version_key(user_id):
+    return f'auth-user-version:{user_id}'
+
+
+def get_cached_user(user_id):
+    """
+    認証したユーザーを返す。CACHED_USER_FIELDSの値をキャッシュから作り、
+    それ以外の列は遅延読み込みにするので、キャッシュにあればクエリは発生しない。
+    キャッシュはユーザーのバージョンと一緒に保存し、変更されたら使わない。
+    キャッシュがworker間で共有されない場合は、他のworkerでの無効化が届かないので、
+    アクセストークンの有効期限より長くは保存しない。
+    """
+    User = get_user_model()
+    # from_dbには、モデルの列の順に値を渡す
+    field_names = [
+        f.attname for f in User._meta.concrete_fields if f.attname in CACHED_USER_FIELDS
+    ]
+    key, version_key = get_user_key(user_id), get_user_version_key(user_id)
+    cached = cache.get_many([key, version_key])
+    version = cached.get(version_key, 0)
+
+    entry = cached.get(key)
+    if entry is not None and entry[0] == version:
+        values = entry[1]
+    else:
+        values = User.objects.filter(pk=user_id).values_list(*field_names).first()
+        if values is None:
+            raise exceptions.AuthenticationFailed('unauthenticated')
+        cache.set(key, (version, values), get_cache_timeout(
+            cache, settings.AUTH_USER_CACHE_TIMEOUT, settings.AUTH_USER_LOCAL_CACHE_TIMEOUT))
+
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, values)
+
+
+def invalidate_cached_user(user_id):
+    """
+    ユーザーの変更・無効化・削除で、キャッシュしたユーザーを使わないようにする。
+    トランザクションの中で呼ばれたら、コミットしてからバージョンを上げる
+    （コミット前の古い行を読んだリクエストが、新しいバージョンで保存しないように）。
+    """
+    def bump():
+        key = get_user_version_key(user_id)
+        cache.add(key, 0, None)
+        cache.incr(key)
+    transaction.on_commit(bump)
+
+
+def get_token_user_id(token):
+    user_id = token_cache.get(token)
+    if user_id is None:
+        payload = decode_access_token_payload(token)
+        user_id = payload['user_id']
+        token_cache.set(token, user_id, payload['exp'])
+    return user_id
+
 
 class JWTAuthentication(BaseAuthentication):
     def authenticate(self, request):
@@ -13,40 +125,47 @@ class JWTAuthentication(BaseAuthentication):
 
         if auth and len(auth) == 2:
             token = auth[1].decode('utf-8')
-            id = decode_access_token(token)
-
-            user = get_user_model().objects.get(pk=id)
+            user = get_cached_user(get_token_user_id(token))
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed('unauthenticated')
 
             return (user, None)
 
         raise exceptions.AuthenticationFailed('unauthenticated')
 
 
-def create_access_token(id, exp=30):
+def create_access_token(id, exp=30, now=None):
+    now = now or datetime.datetime.utcnow()
     return jwt.encode({
         'user_id': id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=exp),
-        'iat': datetime.datetime.utcnow()
+        'exp': now + datetime.timedelta(seconds=exp),
+        'iat': now
         # }, 'access_secret', algorithm='HS256')
     }, settings.SECRET_KEY, algorithm='HS256')
 
 
 def decode_access_token(token):
+    return decode_access_token_payload(token)['user_id']
+
+
+def decode_access_token_payload(token):
     # print(token)
     try:
         # payload = jwt.decode(token, 'access_secret', algorithms='HS256')
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms='HS256')
-
-        return payload['user_id']
+        return jwt.decode(token, settings.SECRET_KEY, algorithms='HS256',
+                          options={'require': ['exp', 'user_id']})
     except:
         raise exceptions.AuthenticationFailed('unauthenticated')
 
 
-def create_refresh_token(id):
+def create_refresh_token(id, now=None):
+    now = now or datetime.datetime.utcnow()
     return jwt.encode({
         'user_id': id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7),
-        'iat': datetime.datetime.utcnow()
+        'exp': now + settings.REFRESH_TOKEN_LIFETIME,
+        'iat': now,
+        # 同じ秒に発行しても、トークンごとに異なる値にする
+        'jti': uuid.uuid4().hex,
     }, 'refresh_secret', algorithm='HS256')
 
 
@@ -0,0 +1,69 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from accounts.models import Profile
+from .fragments import invalidate_author_fragments
+
+
+def media_url(name):
+    return f'{settings.MEDIA_BASE_URL}{settings.MEDIA_URL}{name}'
+
+
+def get_thumbnail_name(name, size):
+    return f'{os.path.splitext(name)[0]}_{size}.jpg'
+
+
+def avatar_url(profile, size='small'):
+    """
+    プロフィール画像のURL。サムネイルがあればsizeのサムネイルを、
+    まだ作成していなければ元の画像を返す。
+    """
+    if not profile.img or profile.is_avatar_rejected:
+        return None
+    if profile.is_avatar_processed:
+        return media_url(get_thumbnail_name(profile.img.name, size))
+    return media_url(profile.img.name)
+
+
+def avatar_urls(profile):
+    return {size: avatar_url(profile, size) for size in settings.AVATAR_SIZES}
+
+
+def process_avatar(profile):
+    """
+    元の画像からAVATAR_SIZESのサムネイルを作成する。
+    向きを補正して正方形に切り抜き、JPEGで保存し直すので、大きすぎる画像や位置情報などのメタデータは残らない。
+    """
+    with default_storage.open(profile.img.name) as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image = image.convert('RGB')
+
+    for size, pixels in settings.AVATAR_SIZES.items():
+        name = get_thumbnail_name(profile.img.name, size)
+        # ファイル名は内容から決まるので、作成済みであれば作り直さない
+        if default_storage.exists(name):
+            continue
+        thumbnail = ImageOps.fit(image, (pixels, pixels), Image.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=85, optimize=True)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    # 処理中に画像が変更されていなければ、作成済みにする
+    updated = Profile.objects.filter(pk=profile.pk, img=profile.img.name).update(
+        is_avatar_processed=True)
+    if updated:
+        invalidate_author_fragments(profile.user_id)
+    return bool(updated)
+
+
+def reject_avatar(profile):
+    """サムネイルを作成できない画像を、表示せず作り直しもしないようにする"""
+    updated = Profile.objects.filter(pk=profile.pk, img=profile.img.name).update(
+        is_avatar_rejected=True)
+    if updated:
+        invalidate_author_fragments(profile.user_id)
@@ -0,0 +1,22 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.connection import ConnectionProxy
+
+
+def is_shared_cache(cache):
+    """キャッシュがworker間で共有されるか。locmemとdummyはプロセスごとに別になる"""
+    if isinstance(cache, ConnectionProxy):
+        # django.core.cache.cacheはプロキシなので、実際のバックエンドで判定する
+        cache = caches[cache._alias]
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def get_cache_timeout(cache, timeout, local_timeout):
+    """
+    共有されないキャッシュでは、無効化が他のworkerに届かないので、
+    保存する時間をlocal_timeoutまでにして古い値を使う時間を抑える。
+    """
+    if is_shared_cache(cache):
+        return timeout
+    return min(timeout, local_timeout)
@@ -0,0 +1,105 @@
+import hashlib
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .fragments import get_author_versions
+
+
+def get_etag(request, parts):
+    """
+    閲覧者・URL・レスポンスの元になる値（更新日時やカウンターなど）からETagを計算する。
+    シリアライズ前の値から計算するので、変わっていなければシリアライズを省ける。
+    """
+    source = repr((request.user.id, request.get_full_path(), parts))
+    return '"%s"' % hashlib.md5(source.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # 弱いETagとしても比較する
+    etags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in etags or 'W/' + etag in etags
+
+
+def conditional_response(request, etag, get_data):
+    """ETagが一致すれば304を、しなければget_data()でシリアライズした結果を返す"""
+    if is_not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response = get_data()
+    response['ETag'] = etag
+    return response
+
+
+def get_post_etag_parts(posts):
+    """投稿のETagの元。いいね・コメント・シェアはカウンター、プロフィールは投稿者のバージョンで検出する"""
+    user_ids = set()
+    for post in posts:
+        user_ids.add(post.posted_by_id)
+        user_ids.add(getattr(post, 'shared_by_id', None))
+    return [
+        (post.id, post.updated_at, post.count_likes, post.count_comments, post.count_shares,
+         post.parent_id, getattr(post, 'shared_by_id', None), getattr(post, 'feed_at', None))
+        for post in posts
+    ], sorted(get_author_versions(user_ids - {None}).items(), key=str)
+
+
+def get_roadmap_etag_parts(roadmaps):
+    """ロードマップのETagの元。プロフィールは作成者のバージョンで検出する"""
+    return [
+        (roadmap.id, roadmap.updated_at) for roadmap in roadmaps
+    ], sorted(get_author_versions(roadmap.challenger_id for roadmap in roadmaps).items(), key=str)
+
+
+def get_step_etag_parts(steps):
+    # 並べ替えはbulk_updateでupdated_atが変わらないので、rankも含める。
+    # 1件の取得では、他のステップの移動で変わる位置も含める
+    return [
+        (step.id, step.rank, getattr(step, 'order', None), step.is_completed, step.updated_at)
+        for step in steps
+    ]
+
+
+class BaseConditionalMixin:
+    """ETagの元になる値を返す。更新日時を持たないモデルや、カウンターなどを含める場合はオーバーライドする"""
+
+    def get_etag_parts(self, instances):
+        return [(instance.pk, instance.updated_at) for instance in instances]
+
+
+class ConditionalListMixin(BaseConditionalMixin):
+    """
+    listのレスポンスにETagを付け、If-None-Matchが一致すれば
+    シリアライズせずに304 Not Modifiedを返す。
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        instances = list(queryset) if page is None else page
+        etag = get_etag(request, self.get_etag_parts(instances))
+
+        def get_data():
+            serializer = self.get_serializer(instances, many=True)
+            if page is None:
+                return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
+        return conditional_response(request, etag, get_data)
+
+
+class ConditionalRetrieveMixin(BaseConditionalMixin):
+    """retrieveのレスポンスにETagを付け、If-None-Matchが一致すれば304を返す"""
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = get_etag(request, self.get_etag_parts([instance]))
+        return conditional_response(
+            request, etag, lambda: Response(self.get_serializer(instance).data))
+
+
+class ConditionalGetMixin(ConditionalListMixin, ConditionalRetrieveMixin):
+    pass
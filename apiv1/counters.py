@@ -0,0 +1,18 @@
+from django.db.models import F
+
+from accounts.models import Profile
+
+
+def update_profile_counters(user_id, **deltas):
+    """
+    user_idのプロフィールのカウンターにdeltasを足す（count_posts=1など）。
+    F()で加算するので、同時に更新されても失われない。
+    """
+    Profile.objects.filter(user=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()})
+
+
+def update_author_likes_received(post_id, delta):
+    """投稿者のいいねされた数にdeltaを足す"""
+    Profile.objects.filter(user__posted_by=post_id).update(
+        count_likes_received=F('count_likes_received') + delta)
@@ -0,0 +1,73 @@
+import io
+import json
+import zipfile
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from posts.models import CommentModel, PostModel
+from roadmaps.models import LookBackModel, RoadMapModel, StepModel
+
+
+def get_export_querysets(user):
+    """(種類, userのデータのqueryset)。モデルのインスタンスを作らないようvalues()で読む"""
+    return [
+        ('post', PostModel.objects.filter(posted_by=user).values(
+            'id', 'post', 'parent', 'created_at', 'updated_at',
+            'count_likes', 'count_comments', 'count_shares')),
+        ('comment', CommentModel.objects.filter(commented_by=user).values(
+            'id', 'comment', 'post', 'commented_at')),
+        ('roadmap', RoadMapModel.objects.filter(challenger=user).values(
+            'id', 'title', 'overview', 'is_public', 'created_at', 'updated_at')),
+        ('step', StepModel.objects.filter(roadmap__challenger=user).values(
+            'id', 'roadmap', 'to_learn', 'is_completed', 'rank', 'created_at', 'updated_at')),
+        ('lookback', LookBackModel.objects.filter(step__roadmap__challenger=user).values(
+            'id', 'step', 'learned', 'created_at', 'updated_at')),
+    ]
+
+
+def iter_ndjson(user):
+    """
+    userのデータを1行1レコードのJSON（NDJSON）として順に返す。
+    iterator()でEXPORT_CHUNK_SIZE件ずつ読むので、件数によらずメモリの使用量は一定。
+    """
+    for kind, queryset in get_export_querysets(user):
+        # 並べ替えは不要なので、Meta.orderingによるソートを外す
+        for row in queryset.order_by().iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            row['type'] = kind
+            yield (json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class ZipStream(io.RawIOBase):
+    """zipfileの書き込み先。書き込まれたバイト列を溜めておき、popで取り出す"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(user, filename='export.ndjson'):
+    """
+    iter_ndjsonをzipに圧縮しながら順に返す。
+    書き込み先がシークできないので、zipfileはサイズなどをデータの後ろに書く。
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(filename, 'w', force_zip64=True) as f:
+            for line in iter_ndjson(user):
+                f.write(line)
+                data = stream.pop()
+                if data:
+                    yield data
+    yield stream.pop()
@@ -0,0 +1,68 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from accounts.models import Follow, Profile
+from .counters import update_profile_counters
+from .suggestions import mark_suggestions_stale
+
+
+def is_following(user_id, followee_id):
+    return Follow.objects.filter(profile__user=followee_id, user=user_id).exists()
+
+
+def add_follow(user_id, followee_id):
+    """
+    フォローする。すでにフォローしていれば何もしない。
+    新しくフォローした場合はTrueを返し、相手のプロフィールがなければProfile.DoesNotExistを送出する。
+    """
+    try:
+        with transaction.atomic():
+            profile_id = Profile.objects.filter(user=followee_id).values_list(
+                'id', flat=True).first()
+            if profile_id is None:
+                raise Profile.DoesNotExist
+            # (profile, user)のunique制約の索引で確認する
+            if Follow.objects.filter(profile=profile_id, user=user_id).exists():
+                return False
+            Follow.objects.create(profile_id=profile_id, user_id=user_id)
+            update_profile_counters(followee_id, count_follower=1)
+            update_profile_counters(user_id, count_following=1)
+            mark_suggestions_stale(user_id)
+    except IntegrityError:
+        # 同時にフォローされた場合は、unique制約で片方だけが残る
+        return False
+    return True
+
+
+def remove_follow(user_id, followee_id):
+    """フォローを外す。外した場合はTrueを返す"""
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(
+            profile__user=followee_id, user=user_id).delete()
+        if deleted:
+            update_profile_counters(followee_id, count_follower=-1)
+            update_profile_counters(user_id, count_following=-1)
+            mark_suggestions_stale(user_id)
+    return bool(deleted)
+
+
+def add_follows(user_id, followee_ids):
+    """
+    followee_idsのユーザーをまとめてフォローする。自分・プロフィールのない人・フォロー済みの人は飛ばす。
+    1つのトランザクションでbulk_createし、新しくフォローしたユーザーのidのリストを返す。
+    """
+    with transaction.atomic():
+        profiles = dict(Profile.objects.filter(user__in=followee_ids).exclude(
+            user=user_id).values_list('id', 'user_id'))
+        existing = set(Follow.objects.filter(
+            profile__in=profiles, user=user_id).values_list('profile_id', flat=True))
+        follows = Follow.objects.bulk_create([
+            Follow(profile_id=profile_id, user_id=user_id)
+            for profile_id in profiles if profile_id not in existing
+        ])
+        if follows:
+            Profile.objects.filter(id__in=[f.profile_id for f in follows]).update(
+                count_follower=F('count_follower') + 1)
+            update_profile_counters(user_id, count_following=len(follows))
+            mark_suggestions_stale(user_id)
+    return [profiles[f.profile_id] for f in follows]
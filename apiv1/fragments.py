@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from posts.models import PostModel
+from .caching import get_cache_timeout
+
+
+def get_fragment_key(post_id):
+    # 断片と一緒に保存するバージョンの形式を変えたら、キーも変える
+    return f'post-fragment:v2:{post_id}'
+
+
+def get_author_version_key(user_id):
+    return f'author-version:{user_id}'
+
+
+def get_author_versions(user_ids):
+    """{ユーザーのid: バージョン}。プロフィールを変更するたびに上がる"""
+    keys = {user_id: get_author_version_key(user_id) for user_id in set(user_ids)}
+    versions = cache.get_many(keys.values())
+    return {user_id: versions.get(key, 0) for user_id, key in keys.items()}
+
+
+def get_post_fragments(posts):
+    """
+    投稿の、閲覧者によらない表示内容（断片）をキャッシュから{投稿のid: 断片}で返す。
+    断片は、表示しているプロフィール（投稿者と、引用元の投稿者）のバージョンと一緒に保存し、
+    プロフィールの変更でバージョンが上がったものは使わない。
+    """
+    keys = {post.id: get_fragment_key(post.id) for post in posts}
+    cached = cache.get_many(keys.values())
+    entries = {
+        post.id: cached[keys[post.id]] for post in posts if keys[post.id] in cached
+    }
+    versions = get_author_versions(
+        user_id for author_versions, _ in entries.values() for user_id in author_versions)
+
+    return {
+        post_id: fragment for post_id, (author_versions, fragment) in entries.items()
+        if all(versions[user_id] == version for user_id, version in author_versions.items())
+    }
+
+
+def set_post_fragments(fragments):
+    """{with_details()で取得した投稿: 断片}をキャッシュに保存する"""
+    author_ids = {
+        post: [post.posted_by_id] + ([post.parent.posted_by_id] if post.parent_id else [])
+        for post in fragments
+    }
+    versions = get_author_versions(
+        user_id for user_ids in author_ids.values() for user_id in user_ids)
+    cache.set_many({
+        get_fragment_key(post.id): (
+            {user_id: versions[user_id] for user_id in author_ids[post]}, fragment)
+        for post, fragment in fragments.items()
+    }, get_cache_timeout(
+        cache, settings.POST_FRAGMENT_CACHE_TIMEOUT, settings.POST_FRAGMENT_LOCAL_CACHE_TIMEOUT))
+
+
+def invalidate_post_fragments(*post_ids):
+    """
+    投稿の編集・いいね・コメント・シェアで、その投稿と、それを引用元として表示している投稿の断片を捨てる。
+    トランザクションの中で呼ばれたら、コミットしてから捨てる（コミット前の値を読んだ一覧が
+    断片を保存し直しても残らないように）。
+    """
+    def delete():
+        child_ids = PostModel.objects.filter(parent__in=post_ids).values_list('id', flat=True)
+        cache.delete_many([
+            get_fragment_key(post_id) for post_id in [*post_ids, *child_ids]
+        ])
+    transaction.on_commit(delete)
+
+
+def invalidate_author_fragments(user_id):
+    """プロフィールの変更で、そのユーザーの投稿の断片をまとめて無効にする"""
+    def bump():
+        key = get_author_version_key(user_id)
+        cache.add(key, 0, None)
+        cache.incr(key)
+    transaction.on_commit(bump)
@@ -0,0 +1,32 @@
+import re
+
+from posts.models import TagModel
+
+# 「#」「＃」から、句読点や空白の手前までをハッシュタグとする。
+# 日本語の文中では直前に空白がないことが多いため、直前が英数字の場合（URLのフラグメントなど）のみ除く
+HASHTAG_RE = re.compile(r'(?<![0-9A-Za-z_])[#＃](\w+)')
+
+
+def extract_hashtags(text):
+    """本文からハッシュタグ名を出現順に重複なく取り出す"""
+    return list(dict.fromkeys(HASHTAG_RE.findall(text or '')))
+
+
+def get_or_create_tags(names):
+    """
+    ハッシュタグ名に対応するTagModelを返す。
+    タグの数によらず、取得・一括作成・再取得の最大3クエリで済む。
+    """
+    if not names:
+        return []
+
+    tags = {tag.name: tag for tag in TagModel.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        # 同時に同じタグが作られてもunique制約で重複しない
+        TagModel.objects.bulk_create(
+            [TagModel(name=name) for name in missing], ignore_conflicts=True)
+        tags.update(
+            (tag.name, tag) for tag in TagModel.objects.filter(name__in=missing))
+
+    return [tags[name] for name in names]
@@ -0,0 +1,53 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from posts.models import PostModel
+from .counters import update_author_likes_received
+from .fragments import invalidate_post_fragments
+
+PostLike = PostModel.liked.through
+
+
+def is_liked(post_id, user_id):
+    return PostLike.objects.filter(postmodel_id=post_id, user_id=user_id).exists()
+
+
+def get_liked_post_ids(user_id, post_ids):
+    """post_idsのうち、userがいいねしている投稿のidを1クエリで返す"""
+    return set(PostLike.objects.filter(
+        postmodel_id__in=post_ids, user_id=user_id
+    ).values_list('postmodel_id', flat=True))
+
+
+def add_like(post_id, user_id):
+    """
+    いいねする。すでにいいねしていれば何もしない。
+    新しくいいねした場合はTrueを返し、投稿が存在しなければPostModel.DoesNotExistを送出する。
+    """
+    try:
+        with transaction.atomic():
+            if is_liked(post_id, user_id):
+                return False
+            if not PostModel.objects.filter(id=post_id).update(count_likes=F('count_likes') + 1):
+                raise PostModel.DoesNotExist
+            PostLike.objects.create(postmodel_id=post_id, user_id=user_id)
+            update_author_likes_received(post_id, 1)
+    except IntegrityError:
+        # 同時にいいねされた場合は、unique制約で片方だけが残る
+        return False
+    invalidate_post_fragments(post_id)
+    return True
+
+
+def remove_like(post_id, user_id):
+    """いいねを外す。外した場合はTrueを返す"""
+    with transaction.atomic():
+        deleted, _ = PostLike.objects.filter(
+            postmodel_id=post_id, user_id=user_id).delete()
+        if deleted:
+            PostModel.objects.filter(id=post_id).update(
+                count_likes=F('count_likes') - 1)
+            update_author_likes_received(post_id, -1)
+    if deleted:
+        invalidate_post_fragments(post_id)
+    return bool(deleted)
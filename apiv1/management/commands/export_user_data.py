@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import iter_ndjson, iter_zip
+
+
+class Command(BaseCommand):
+    help = 'ユーザーのデータをNDJSON（--zipならzip）で書き出す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', '-o', required=True)
+        parser.add_argument('--zip', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist')
+
+        chunks = iter_zip(user) if options['zip'] else iter_ndjson(user)
+        size = 0
+        with open(options['output'], 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+
+        self.stdout.write(f'{size} bytes written to {options["output"]}')
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from PIL import Image
+
+from accounts.models import Profile
+from ...avatars import process_avatar, reject_avatar
+
+
+class Command(BaseCommand):
+    help = 'プロフィール画像のサムネイルを作成する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=None,
+                            help='指定した秒数ごとに処理を繰り返す（workerとして動かす場合）')
+
+    def handle(self, *args, **options):
+        while True:
+            total = self.process(options['batch_size'])
+            self.stdout.write(f'{total} avatars processed')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def process(self, batch_size):
+        profiles = Profile.objects.filter(
+            is_avatar_processed=False, is_avatar_rejected=False).exclude(
+            img='').exclude(img__isnull=True).order_by('pk').only('pk', 'user', 'img')
+
+        total = 0
+        last_id = None
+        while True:
+            batch = list((profiles.filter(pk__gt=last_id) if last_id else profiles)[:batch_size])
+            if not batch:
+                return total
+            for profile in batch:
+                try:
+                    total += process_avatar(profile)
+                except Image.DecompressionBombError as e:
+                    # 何度試しても読めないので、次回からは処理しない
+                    reject_avatar(profile)
+                    self.stderr.write(f'{profile.pk}: {e}')
+                except (OSError, ValueError) as e:
+                    # 画像として読めないファイルは元の画像のまま表示し、次回また試す
+                    self.stderr.write(f'{profile.pk}: {e}')
+            last_id = batch[-1].pk
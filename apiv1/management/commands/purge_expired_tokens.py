@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...refresh_tokens import purge_expired_tokens
+from ...throttling import purge_full_buckets
+
+
+class Command(BaseCommand):
+    help = '期限切れのリフレッシュトークンとパスワードリセットのトークン、満タンに戻ったレート制限のバケットを削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='1回のDELETEで削除する件数')
+
+    def handle(self, *args, **options):
+        tokens, resets = purge_expired_tokens(options['batch_size'])
+        self.stdout.write(f'{tokens} refresh tokens and {resets} reset tokens purged')
+        self.stdout.write(f'{purge_full_buckets()} throttle buckets purged')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import PostModel, SearchTermModel
+from ...search import tokenize
+
+
+class Command(BaseCommand):
+    help = '投稿の全文検索インデックスを作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = PostModel.objects.order_by('pk').only('pk', 'post', 'created_at')
+
+        total = 0
+        last_id = None
+        while True:
+            batch = list((posts.filter(pk__gt=last_id) if last_id else posts)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                SearchTermModel.objects.filter(post__in=batch).delete()
+                SearchTermModel.objects.bulk_create([
+                    SearchTermModel(term=term, post=post, created_at=post.created_at)
+                    for post in batch
+                    for term in tokenize(post.post)
+                ], batch_size=batch_size)
+            total += len(batch)
+            last_id = batch[-1].pk
+
+        self.stdout.write(f'{total} posts indexed')
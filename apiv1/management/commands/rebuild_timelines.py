@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import TimelineModel
+from ...timeline import backfill_timelines
+
+
+class Command(BaseCommand):
+    help = 'フォロー関係からホームタイムラインを作り直す'
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk').only('pk')
+        total = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                TimelineModel.objects.filter(owner=user).delete()
+                # フォローしている全員分を1回で追加し、切り詰めも1回にする
+                followee_ids = list(get_user_model().objects.filter(
+                    profile__followers=user).values_list('pk', flat=True))
+                backfill_timelines(user, followee_ids)
+            total += 1
+
+        self.stdout.write(f'{total} timelines rebuilt')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import PostModel, CommentModel, ShareModel
+
+
+def count_subquery(queryset, field, outer='pk'):
+    """queryset[field]がOuterRef(outer)と一致する行数を返すサブクエリ"""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef(outer)}).order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'PostModelのいいね・コメント・シェア数を実データから再集計する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = PostModel.objects.order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        last_id = None
+        while True:
+            batch = posts.filter(pk__gt=last_id) if last_id else posts
+            post_ids = list(batch[:batch_size])
+            if not post_ids:
+                break
+            total += self.reconcile(post_ids)
+            last_id = post_ids[-1]
+
+        self.stdout.write(f'{total} posts reconciled')
+
+    def reconcile(self, post_ids):
+        # 1バッチを1つのUPDATE文で再計算する
+        with transaction.atomic():
+            return PostModel.objects.filter(pk__in=post_ids).update(
+                count_likes=count_subquery(
+                    PostModel.liked.through.objects.all(), 'postmodel_id'),
+                count_comments=count_subquery(
+                    CommentModel.objects.all(), 'post_id'),
+                count_shares=count_subquery(
+                    ShareModel.objects.all(), 'post_id'),
+            )
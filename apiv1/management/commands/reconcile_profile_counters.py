@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Follow, Profile
+from posts.models import PostModel
+from roadmaps.models import RoadMapModel
+from .reconcile_post_counters import count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Profileのフォロワー・フォロー・投稿・ロードマップ・いいねされた数を実データから再集計する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        profiles = Profile.objects.order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        last_id = None
+        while True:
+            batch = profiles.filter(pk__gt=last_id) if last_id else profiles
+            profile_ids = list(batch[:batch_size])
+            if not profile_ids:
+                break
+            total += self.reconcile(profile_ids)
+            last_id = profile_ids[-1]
+
+        self.stdout.write(f'{total} profiles reconciled')
+
+    def reconcile(self, profile_ids):
+        follow = Follow.objects.all()
+        # 1バッチを1つのUPDATE文で再計算する
+        with transaction.atomic():
+            return Profile.objects.filter(pk__in=profile_ids).update(
+                count_follower=count_subquery(follow, 'profile_id'),
+                count_following=count_subquery(follow, 'user_id', 'user'),
+                count_posts=count_subquery(
+                    PostModel.objects.all(), 'posted_by', 'user'),
+                count_roadmaps=count_subquery(
+                    RoadMapModel.objects.all(), 'challenger', 'user'),
+                count_likes_received=count_subquery(
+                    PostModel.liked.through.objects.all(), 'postmodel__posted_by', 'user'),
+            )
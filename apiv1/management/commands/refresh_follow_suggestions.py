@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ...suggestions import refresh_follow_suggestions
+
+
+class Command(BaseCommand):
+    help = 'フォローの関係から、おすすめユーザーを計算し直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-only', action='store_true',
+                            help='フォローが変わったユーザーだけを計算する')
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = refresh_follow_suggestions(
+            stale_only=options['stale_only'], limit=options['limit'],
+            batch_size=options['batch_size'])
+        self.stdout.write(f'{total} users refreshed')
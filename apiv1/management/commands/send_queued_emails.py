@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = '送信待ちのメールをまとめて送信する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='1つのSMTP接続で送信する件数')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='指定した秒数ごとに処理を繰り返す（workerとして動かす場合）')
+
+    def handle(self, *args, **options):
+        while True:
+            total = send_queued_emails(options['batch_size'])
+            self.stdout.write(f'{total} emails sent')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
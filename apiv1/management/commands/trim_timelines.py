@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.models import TimelineModel
+from ...timeline import trim_timeline
+
+
+class Command(BaseCommand):
+    help = 'ホームタイムラインをTIMELINE_MAX_LENGTH件に切り詰める'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='指定した秒数ごとに処理を繰り返す（workerとして動かす場合）')
+
+    def handle(self, *args, **options):
+        while True:
+            total = self.trim()
+            self.stdout.write(f'{total} timelines trimmed')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def trim(self):
+        owner_ids = TimelineModel.objects.order_by().values_list(
+            'owner', flat=True).distinct()
+        total = 0
+        for owner_id in owner_ids.iterator():
+            trim_timeline(owner_id)
+            total += 1
+        return total
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutboxModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_email', models.EmailField(max_length=255, verbose_name='宛先')),
+                ('subject', models.CharField(max_length=255, verbose_name='件名')),
+                ('body', models.TextField(verbose_name='本文')),
+                ('status', models.CharField(choices=[('pending', '送信待ち'), ('sent', '送信済み'), ('failed', '送信失敗')], default='pending', max_length=20, verbose_name='状態')),
+                ('attempts', models.IntegerField(default=0, verbose_name='送信を試みた回数')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='次に送信する日時')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最後のエラー')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='送信日時')),
+            ],
+            options={
+                'ordering': ['next_attempt_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='emailoutboxmodel',
+            index=models.Index(fields=['status', 'next_attempt_at', 'id'], name='apiv1_email_status_1ad1ea_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiv1', '0001_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleBucketModel',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='バケット')),
+                ('tokens', models.FloatField(verbose_name='残りのトークン')),
+                ('updated_at', models.FloatField(db_index=True, verbose_name='最後に補充した時刻（UNIX時間）')),
+            ],
+        ),
+    ]
@@ -1,3 +1,43 @@
 from django.db import models
 
-# Create your models here.
+STATUS = (('pending', '送信待ち'), ('sent', '送信済み'), ('failed', '送信失敗'))
+
+
+class EmailOutboxModel(models.Model):
+    """
+    送信待ちのメール。リクエストの中ではここに保存するだけにして、
+    send_queued_emailsがまとめて送信する。
+    """
+    to_email = models.EmailField('宛先', max_length=255)
+    subject = models.CharField('件名', max_length=255)
+    body = models.TextField('本文')
+    status = models.CharField(
+        '状態', max_length=20, choices=STATUS, default='pending')
+    attempts = models.IntegerField('送信を試みた回数', default=0)
+    next_attempt_at = models.DateTimeField('次に送信する日時')
+    last_error = models.TextField('最後のエラー', blank=True, default='')
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+    sent_at = models.DateTimeField('送信日時', null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        # 送信待ちのメールを古い順に取り出す
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.to_email}: {self.subject}'
+
+
+class ThrottleBucketModel(models.Model):
+    """
+    レート制限のトークンバケット（DatabaseBucketStoreが使う）。
+    満タンに戻ったバケットは、行がないのと同じなのでpurge_expired_tokensで削除する。
+    """
+    key = models.CharField('バケット', max_length=255, primary_key=True)
+    tokens = models.FloatField('残りのトークン')
+    updated_at = models.FloatField('最後に補充した時刻（UNIX時間）', db_index=True)
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,86 @@
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutboxModel
+
+
+def enqueue_email(to_email, subject, body):
+    """メールを送信待ちにする。EMAIL_OUTBOX_EAGERなら、その場で送信する"""
+    email = EmailOutboxModel.objects.create(
+        to_email=to_email, subject=subject, body=body, next_attempt_at=timezone.now())
+    if settings.EMAIL_OUTBOX_EAGER:
+        transaction.on_commit(send_queued_emails)
+    return email
+
+
+def get_retry_delay(attempts):
+    """attempts回目の失敗の後、次に送信するまでの時間（指数バックオフ）"""
+    seconds = settings.EMAIL_OUTBOX_RETRY_DELAY.total_seconds() * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY.total_seconds()))
+
+
+def send_queued_emails(batch_size=None):
+    """
+    送信する日時になったメールをbatch_size件ずつ、1つのSMTP接続で送信する。
+    失敗したメールは間隔を空けて再送し、EMAIL_OUTBOX_MAX_ATTEMPTS回失敗したらfailedにする。
+    送信したメールの件数を返す。
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    sent = 0
+    while True:
+        with transaction.atomic():
+            # 複数のworkerで同じメールを送らないよう、ロック中の行は飛ばす
+            emails = list(EmailOutboxModel.objects.select_for_update(skip_locked=True).filter(
+                status='pending', next_attempt_at__lte=timezone.now())[:batch_size])
+            if not emails:
+                return sent
+            sent += send_batch(emails)
+        if len(emails) < batch_size:
+            return sent
+
+
+def send_batch(emails):
+    """1つのSMTP接続でemailsを送信し、結果をまとめて保存する"""
+    now = timezone.now()
+    sent = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # 接続できなければ、まとめて後で送り直す
+        for email in emails:
+            record_failure(email, e, now)
+    else:
+        try:
+            for email in emails:
+                message = EmailMessage(
+                    subject=email.subject, body=email.body, to=[email.to_email],
+                    connection=connection)
+                try:
+                    message.send()
+                except Exception as e:
+                    record_failure(email, e, now)
+                    continue
+                email.status = 'sent'
+                email.sent_at = now
+                email.attempts += 1
+                sent += 1
+        finally:
+            connection.close()
+
+    EmailOutboxModel.objects.bulk_update(
+        emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    return sent
+
+
+def record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = repr(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + get_retry_delay(email.attempts)
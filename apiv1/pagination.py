@@ -0,0 +1,163 @@
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    (created_at, id)などの並び順の値をカーソルにしてページングする。
+    OFFSETとCOUNT(*)を使わないので、深いページでも先頭のページと同じコストで取得できる。
+    カーソルは最後に返した行の値をbase64でエンコードしたもので、
+    途中で新しい行が追加されてもページがずれない。
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # 最後の要素は一意な列にする
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request, queryset)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(cursor))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_cursor_filter(self, values):
+        # (a, b) < (x, y) を a < x OR (a = x AND b < y) に展開する
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            lookup = field.lstrip('-') + ('__lt' if field.startswith('-') else '__gt')
+            equals = {
+                prev.lstrip('-'): value for prev, value in zip(self.ordering[:i], values)
+            }
+            conditions.append(Q(**equals, **{lookup: values[i]}))
+        return reduce(or_, conditions)
+
+    def encode_cursor(self, instance):
+        values = [
+            self.to_json(getattr(instance, field.lstrip('-'))) for field in self.ordering
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.to_python(queryset, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, UnicodeEncodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def to_json(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return value
+
+    @staticmethod
+    def to_python(queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # annotateした値は、その出力の型に合わせる
+            field = queryset.query.annotations[name].output_field
+        return field.to_python(value)
+
+
+def get_feed_cursor_filter(date_field, id_field, cursor):
+    """(日時, id)がカーソルより後（古い）の行"""
+    feed_at, post_id = cursor
+    return Q(**{f'{date_field}__lt': feed_at}) | Q(
+        **{date_field: feed_at, f'{id_field}__lt': post_id})
+
+
+class FeedPagination(KeysetPagination):
+    """
+    複数の表から合わせて作るフィード（ホームタイムラインなど）用のカーソルページング。
+    並び順は(feed_at, id)で、1ページ分の取得はget_page(cursor, limit)に任せる。
+    get_pageが途中で打ち切った場合は、返した値のresume_atの位置から続きを読む。
+    """
+    ordering = ('-feed_at', '-id')
+    field_types = {'feed_at': models.DateTimeField(), 'id': models.UUIDField()}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_feed(view.get_feed_page, request)
+
+    def paginate_feed(self, get_page, request):
+        self.request = request
+        cursor = self.decode_cursor(request, None)
+        results = get_page(cursor, self.page_size + 1)
+        resume_at = getattr(results, 'resume_at', None)
+
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size or resume_at is not None
+        if len(results) > self.page_size or resume_at is None:
+            self.last = self.page[-1] if self.page else None
+        else:
+            self.last = SimpleNamespace(feed_at=resume_at[0], id=resume_at[1])
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def to_python(self, queryset, name, value):
+        return self.field_types[name].to_python(value)
@@ -0,0 +1,179 @@
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from roadmaps.models import StepModel
+
+# 並び順のキーは36進数の小数（0.xxx）の小数部分を表す文字列で、辞書順がそのまま数の順になる。
+# 末尾に'0'を付けないので、どの2つのキーの間にも必ず別のキーを作れる
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def rank_between(before, after):
+    """
+    beforeとafterの間のキーを返す。Noneは先頭・末尾を表す。
+    1つのステップを挿入・移動しても、他の行のキーは変えずに済む。
+    """
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f'{before!r} must be less than {after!r}')
+    if after is None and before:
+        return rank_after(before)
+    return midpoint(before or '', after)
+
+
+def rank_after(before):
+    """
+    beforeの次のキー。左から最初の'z'でない桁を1つ増やすので、
+    末尾への追加を繰り返してもキーはほとんど長くならない。
+    """
+    for i, digit in enumerate(before):
+        if digit != DIGITS[-1]:
+            return before[:i] + DIGITS[DIGITS.index(digit) + 1]
+    return before + midpoint('', None)
+
+
+def midpoint(a, b):
+    # aとbの共通の先頭部分は、そのまま使う
+    if b is not None:
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else '0') == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else len(DIGITS)
+    if digit_b - digit_a > 1:
+        return DIGITS[round((digit_a + digit_b) / 2)]
+    # 隣り合う桁なら、次の桁で間を取る
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + midpoint(a[1:], None)
+
+
+def spread_ranks(count):
+    """
+    count個のキーを、前半に等間隔で並べて返す。後半は末尾への追加のために空けておく。
+    """
+    width = 1
+    while len(DIGITS) ** width < 4 * (count + 1):
+        width += 1
+    gap = len(DIGITS) ** width // (2 * (count + 1))
+
+    ranks = []
+    for i in range(1, count + 1):
+        value = i * gap
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, len(DIGITS))
+            digits.append(DIGITS[digit])
+        ranks.append(''.join(reversed(digits)).rstrip('0'))
+    return ranks
+
+
+def ranks_between(before, after, count):
+    """beforeとafterの間にcount個のキーを、二分しながら作る。キーの長さはlog(count)程度で済む"""
+    if count == 0:
+        return []
+    half = count // 2
+    mid = rank_between(before, after)
+    return ranks_between(before, mid, half) + [mid] + ranks_between(mid, after, count - half - 1)
+
+
+def get_kept_indices(ranks):
+    """
+    ranksの最長の狭義単調増加部分列の位置。これらのキーはそのままで新しい順序に収まるので、
+    並べ替えでは残りの行のキーだけを書き換えればよい。
+    """
+    tails = []
+    tail_indices = []
+    previous = [None] * len(ranks)
+    for i, rank in enumerate(ranks):
+        j = bisect_left(tails, rank)
+        if j == len(tails):
+            tails.append(rank)
+            tail_indices.append(i)
+        else:
+            tails[j] = rank
+            tail_indices[j] = i
+        previous[i] = tail_indices[j - 1] if j else None
+
+    kept = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        kept.add(i)
+        i = previous[i]
+    return kept
+
+
+def reorder_ranks(steps):
+    """
+    stepsをこの順に並ぶようにキーを付け直し、キーが変わったステップを返す。
+    変わらないステップが最も多くなるようにし、キーが長くなりすぎたら全体を振り直す。
+    """
+    original = [step.rank for step in steps]
+    kept = get_kept_indices(original)
+
+    i = 0
+    while i < len(steps):
+        if i in kept:
+            i += 1
+            continue
+        j = i
+        while j < len(steps) and j not in kept:
+            j += 1
+        # 前後の変えないステップのキーの間に、間のステップを並べる
+        before = steps[i - 1].rank if i else None
+        after = steps[j].rank if j < len(steps) else None
+        for step, rank in zip(steps[i:j], ranks_between(before, after, j - i)):
+            step.rank = rank
+        i = j
+
+    if any(is_rank_too_long(step.rank) for step in steps):
+        for step, rank in zip(steps, spread_ranks(len(steps))):
+            step.rank = rank
+    return [step for step, rank in zip(steps, original) if step.rank != rank]
+
+
+def next_step_rank(roadmap_id):
+    """ロードマップの末尾のキー。(roadmap, rank)の索引から最後の1件だけを読む"""
+    last = StepModel.objects.filter(roadmap=roadmap_id).order_by(
+        '-rank').values_list('rank', flat=True).first()
+    return rank_between(last, None)
+
+
+def get_earlier_steps(roadmap_id, rank, step_id):
+    return StepModel.objects.filter(roadmap=roadmap_id).filter(
+        Q(rank__lt=rank) | Q(rank=rank, id__lt=step_id))
+
+
+def get_step_order(step):
+    """ロードマップの中でのステップの位置（0から）。(roadmap, rank, id)の索引で前のステップを数える"""
+    return get_earlier_steps(step.roadmap_id, step.rank, step.id).count()
+
+
+def with_step_order(steps):
+    """ステップの位置をorderとして付ける"""
+    earlier = get_earlier_steps(OuterRef('roadmap'), OuterRef('rank'), OuterRef('id'))
+    return steps.annotate(order=Coalesce(Subquery(
+        earlier.order_by().values('roadmap').annotate(count=Count('id')).values('count')
+    ), 0))
+
+
+def is_rank_too_long(rank):
+    return len(rank) > settings.STEP_RANK_MAX_LENGTH
+
+
+def rebalance_step_ranks(roadmap_id):
+    """
+    ロードマップのステップのキーを振り直す。同じ場所への挿入を繰り返して
+    キーがSTEP_RANK_MAX_LENGTHより長くなったときだけ行う。
+    """
+    steps = list(StepModel.objects.filter(roadmap=roadmap_id).order_by(
+        'rank', 'id').only('id', 'rank'))
+    for step, rank in zip(steps, spread_ranks(len(steps))):
+        step.rank = rank
+    StepModel.objects.bulk_update(steps, ['rank'])
+    return steps
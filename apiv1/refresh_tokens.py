@@ -0,0 +1,124 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import exceptions
+
+from accounts.models import Reset, UserToken
+from .authentication import (
+    TokenCache,
+    create_access_token,
+    create_refresh_token,
+    decode_refresh_token,
+)
+
+# 無効にしたリフレッシュトークンのハッシュと、そのfamily_id。
+# ここにあるトークンはDBを見ずに拒否する。他のプロセスでは、DBの内容で同じ判定になる
+revoked_tokens = TokenCache(
+    settings.REFRESH_REVOCATION_CACHE_SIZE,
+    settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_tokens(user_id):
+    """
+    ログイン時のアクセストークンとリフレッシュトークンを、同じ時刻で発行する。
+    リフレッシュトークンのハッシュは1つのトランザクションで保存する。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        refresh_token = store_refresh_token(user_id, now=now)
+    return {
+        'access_token': create_access_token(str(user_id), now=now),
+        'refresh_token': refresh_token,
+    }
+
+
+def store_refresh_token(user_id, family_id=None, now=None):
+    """リフレッシュトークンを発行してハッシュを保存し、トークンを返す"""
+    now = now or timezone.now()
+    token = create_refresh_token(str(user_id), now=now)
+    UserToken.objects.create(
+        user_id=user_id,
+        token_hash=hash_token(token),
+        family_id=family_id or uuid.uuid4(),
+        expired_at=now + settings.REFRESH_TOKEN_LIFETIME,
+    )
+    return token
+
+
+def rotate_refresh_token(token):
+    """
+    リフレッシュトークンを同じfamilyの新しいトークンに交換し、(user_id, 新しいトークン)を返す。
+    交換済みのトークンが使われた場合は盗まれたものとみなし、familyごと無効にする。
+    """
+    user_id = decode_refresh_token(str(token))
+    token_hash = hash_token(token)
+    family_id = revoked_tokens.get(token_hash)
+    if family_id is not None:
+        revoke_family(family_id)
+        raise exceptions.AuthenticationFailed('unauthenticated')
+
+    now = timezone.now()
+    with transaction.atomic():
+        user_token = UserToken.objects.filter(
+            token_hash=token_hash, user_id=user_id, expired_at__gt=now
+        ).only('family_id', 'rotated_at', 'expired_at').first()
+        if user_token is None:
+            raise exceptions.AuthenticationFailed('unauthenticated')
+        # 同時に交換された場合も、交換できるのは1回だけ
+        if user_token.rotated_at is not None or not UserToken.objects.filter(
+                pk=user_token.pk, rotated_at__isnull=True).update(rotated_at=now):
+            rotated = False
+        else:
+            rotated = True
+            new_token = store_refresh_token(user_id, user_token.family_id, now)
+
+    revoked_tokens.set(token_hash, user_token.family_id, user_token.expired_at.timestamp())
+    if not rotated:
+        revoke_family(user_token.family_id)
+        raise exceptions.AuthenticationFailed('unauthenticated')
+    return user_id, new_token
+
+
+def revoke_family(family_id):
+    UserToken.objects.filter(family_id=family_id).delete()
+
+
+def revoke_refresh_token(token):
+    """ログアウト。トークンと同じfamilyのトークンをすべて無効にする"""
+    token_hash = hash_token(token)
+    user_token = UserToken.objects.filter(token_hash=token_hash).only(
+        'family_id', 'expired_at').first()
+    if user_token is None:
+        return
+    revoke_family(user_token.family_id)
+    revoked_tokens.set(token_hash, user_token.family_id, user_token.expired_at.timestamp())
+
+
+def purge_expired_tokens(batch_size=1000):
+    """
+    期限切れのリフレッシュトークンとパスワードリセットのトークンを、batch_size件ずつ削除する。
+    削除した件数を(UserToken, Reset)で返す。
+    """
+    now = timezone.now()
+    return (
+        delete_in_batches(UserToken.objects.filter(expired_at__lte=now), batch_size),
+        delete_in_batches(Reset.objects.filter(
+            created_at__lte=now - settings.RESET_TOKEN_LIFETIME), batch_size),
+    )
+
+
+def delete_in_batches(queryset, batch_size):
+    # 1回のDELETEでロックする行を少なくする
+    total = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        total += queryset.model.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,123 @@
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Count, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import PostModel, SearchTermModel
+from .pagination import get_feed_cursor_filter
+
+
+def normalize(text):
+    # 全角英数字を半角に、大文字を小文字にそろえる
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """
+    本文を1文字と2文字（bigram）の語に分ける。
+    日本語は空白で単語を区切れないため、文字単位で区切る。
+    """
+    terms = set()
+    for word in normalize(text).split():
+        terms.update(word)
+        terms.update(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def query_terms(query):
+    """検索語を、インデックスを引くための語に分ける"""
+    terms = set()
+    for word in normalize(query).split():
+        if len(word) == 1:
+            terms.add(word)
+        else:
+            terms.update(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def index_post(post):
+    """投稿の検索インデックスを作り直す"""
+    SearchTermModel.objects.filter(post=post).delete()
+    SearchTermModel.objects.bulk_create([
+        SearchTermModel(term=term, post=post, created_at=post.created_at)
+        for term in tokenize(post.post)
+    ], batch_size=1000)
+
+
+class SearchResults(list):
+    """検索結果の1ページ。走査を途中で打ち切った場合は、続きの(日時, id)をresume_atに持つ"""
+    resume_at = None
+
+
+def get_rarest_term(terms):
+    """
+    含む投稿が最も少ない語。語ごとの件数はSEARCH_MAX_SCANNED件までしか数えず、
+    検索語がいくつあっても1回のクエリで数える。どれかの語を含む投稿がなければNone。
+    """
+    terms = sorted(terms)
+    counts = {
+        f'count_{i}': Coalesce(Subquery(
+            SearchTermModel.objects.filter(
+                pk__in=SearchTermModel.objects.filter(
+                    term=term).values('pk')[:settings.SEARCH_MAX_SCANNED]
+            ).order_by().values('term').annotate(count=Count('pk')).values('count')
+        ), 0)
+        for i, term in enumerate(terms)
+    }
+    # どれかの語の索引の1行に、語ごとの件数を付けて読む
+    rows = list(SearchTermModel.objects.filter(term__in=terms).order_by().annotate(
+        **counts).values_list(*counts)[:1])
+    if not rows or 0 in rows[0]:
+        return None
+    count, term = min(zip(rows[0], terms))
+    return term
+
+
+def search_posts(query, cursor=None, limit=10):
+    """
+    検索語を含む投稿を新しい順にlimit件返す。
+    最も少ない投稿にしか出てこない語の索引を(term, -created_at)の順にカーソルから読み、
+    候補の本文に検索語がそのまま含まれるかを確かめる（2文字の語の並びも確かめる）。
+    1ページで読む索引はSEARCH_MAX_SCANNED件までにし、それを超えたら続きの位置を返す。
+    """
+    words = normalize(query).split()
+    terms = query_terms(query)
+    results = SearchResults()
+    if not terms:
+        return results
+
+    term = get_rarest_term(terms)
+    if term is None:
+        return results
+
+    entries = SearchTermModel.objects.filter(term=term).order_by('-created_at', '-post')
+    position = cursor
+    scanned = 0
+    while len(results) < limit:
+        if scanned >= settings.SEARCH_MAX_SCANNED:
+            results.resume_at = position
+            break
+        batch = entries
+        if position is not None:
+            batch = batch.filter(get_feed_cursor_filter('created_at', 'post', position))
+        batch = list(batch.values_list('created_at', 'post')[:settings.SEARCH_SCAN_BATCH_SIZE])
+        if not batch:
+            break
+        scanned += len(batch)
+
+        texts = dict(PostModel.objects.filter(
+            id__in=[post_id for _, post_id in batch]).values_list('id', 'post'))
+        for created_at, post_id in batch:
+            position = (created_at, post_id)
+            text = normalize(texts.get(post_id))
+            if all(word in text for word in words):
+                results.append(post_id)
+                if len(results) == limit:
+                    break
+
+    posts = PostModel.objects.for_feed().in_bulk(results)
+    results[:] = [posts[post_id] for post_id in results if post_id in posts]
+    for post in results:
+        post.feed_at = post.created_at
+    return results
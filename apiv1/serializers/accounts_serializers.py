@@ -1,16 +1,12 @@
-from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib import auth
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import serializers
 from rest_framework.fields import ReadOnlyField, CurrentUserDefault
 from rest_framework.serializers import SerializerMethodField
-from ..authentication import (
-    create_access_token,
-    create_refresh_token,
-)
+from ..avatars import avatar_url, avatar_urls
+from ..refresh_tokens import issue_tokens
 
-from accounts.models import Profile
+from accounts.models import FollowSuggestion, Profile
 # from roadmap.models import RoadMapModel, StepModel, LookBackModel
 
 
@@ -45,12 +41,8 @@ class LoginSerializer(serializers.ModelSerializer):
     tokens = serializers.SerializerMethodField()
 
     def get_tokens(self, obj):
-        user = get_user_model().objects.get(email=obj['email'])
-
-        return {
-            'access_token': create_access_token(str(user.id)),
-            'refresh_token': create_refresh_token(str(user.id))
-        }
+        # validateで取得したユーザーに発行し、もう一度ユーザーを読まない
+        return issue_tokens(obj['user'].id)
 
     class Meta:
         model = get_user_model()
@@ -60,9 +52,18 @@ class LoginSerializer(serializers.ModelSerializer):
         email = attrs.get('email', '')
         password = attrs.get('password', '')
 
-        # if the given credentials are valid, return a User object.
-        # if the given credentials are not valid, return None.
-        user = auth.authenticate(email=email, password=password)
+        # ユーザーを1回だけ読み、パスワードを確認する。
+        # check_passwordは、ハッシュのアルゴリズムや反復回数の設定が変わっていれば再ハッシュして保存する
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(email)
+        except User.DoesNotExist:
+            # 存在しないユーザーでも同じだけ時間をかけ、応答時間から登録済みかを推測されないようにする
+            User().set_password(password)
+            user = None
+        else:
+            if not user.check_password(password):
+                user = None
 
         if user is None:
             raise AuthenticationFailed('Invalid Credentials, try again')
@@ -73,15 +74,14 @@ class LoginSerializer(serializers.ModelSerializer):
 
         # 返り値は、serializer.validated_dataで確認できる？
         return {
-            'email': user.email,
+            'user': user,
         }
 
 
 class ProfileSerializer(serializers.ModelSerializer):
     # following = SerializerMethodField()
-    count_following = SerializerMethodField()
-    count_follower = SerializerMethodField()
     is_followed = SerializerMethodField()
+    img_urls = SerializerMethodField()
 
     created_at = serializers.DateTimeField(format="%Y-%m-%d", read_only=True)
     user = GetUserSerializer(read_only=True)
@@ -89,7 +89,9 @@ class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
         fields = ('id', 'nick_name', 'user', 'created_at', 'img',
-                  'bio', 'is_followed', 'count_follower', 'count_following')
+                  'bio', 'is_followed', 'count_follower', 'count_following', 'img_urls')
+        # 件数は集計済みの値を読む
+        read_only_fields = ('count_follower', 'count_following')
         extra_kwargs = {'user': {'read_only': True}}
 
     # def get_following(self, instance):
@@ -108,13 +110,22 @@ class ProfileSerializer(serializers.ModelSerializer):
         # return None
         return instance.followers.filter(id=self.context['request'].user.id).exists()
 
-    def get_count_following(self, instance):
-        count_following = Profile.objects.filter(
-            followers=instance.user).count()
-        return count_following
+    def get_img_urls(self, instance):
+        """サムネイルの大きさごとのURL"""
+        return avatar_urls(instance)
 
-    def get_count_follower(self, instance):
-        return instance.followers.count()
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        update_fields = list(validated_data)
+        if 'img' in validated_data:
+            # サムネイルはprocess_avatarsで作り直す
+            instance.is_avatar_processed = False
+            instance.is_avatar_rejected = False
+            update_fields += ['is_avatar_processed', 'is_avatar_rejected']
+        # 件数を読み込んだ時点の値で上書きしないよう、変更した列だけを保存する
+        instance.save(update_fields=update_fields)
+        return instance
 
 
 class ProfilesSerializer(serializers.ModelSerializer):
@@ -132,11 +143,22 @@ class ProfilesSerializer(serializers.ModelSerializer):
     #     return instance.followers.count()
 
     def get_img(self, instance):
-        img = instance.img
+        # 大きさはcontextのavatar_sizeで選べる
+        return avatar_url(instance, self.context.get('avatar_size', 'small'))
 
-        if img:
-            img_url = f"http://127.0.0.1:8000{settings.MEDIA_URL}{str(img)}"
-        else:
-            img_url = None
 
-        return img_url
+class FollowProfileSerializer(ProfilesSerializer):
+    """フォロワー・フォロー一覧の1件。is_followedは閲覧者がフォローしているか（annotate済み）"""
+    is_followed = serializers.BooleanField(read_only=True)
+
+    class Meta(ProfilesSerializer.Meta):
+        fields = ProfilesSerializer.Meta.fields + ('is_followed',)
+
+
+class FollowSuggestionSerializer(serializers.ModelSerializer):
+    user = GetUserSerializer(source='suggested', read_only=True)
+    profile = ProfilesSerializer(source='suggested.profile', read_only=True)
+
+    class Meta:
+        model = FollowSuggestion
+        fields = ('user', 'profile', 'count_mutual')
@@ -1,14 +1,18 @@
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib import auth
+from django.db import models
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import serializers
 from rest_framework.fields import ReadOnlyField
 from rest_framework.serializers import SerializerMethodField
 
-from accounts.models import Profile
-from posts.models import PostModel, TagModel, CommentModel
+from posts.models import PostModel, TagModel, CommentModel, TagTrendModel
 from .accounts_serializers import GetUserSerializer
+from ..avatars import avatar_url
+from ..fragments import get_post_fragments, set_post_fragments
+from ..hashtags import extract_hashtags, get_or_create_tags
+from ..likes import get_liked_post_ids, is_liked
+from ..trending import record_tag_usage
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -17,6 +21,16 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
+class TrendingTagSerializer(serializers.ModelSerializer):
+    id = ReadOnlyField(source='tag.id')
+    name = ReadOnlyField(source='tag.name')
+    score = ReadOnlyField(source='current_score')
+
+    class Meta:
+        model = TagTrendModel
+        fields = ['id', 'name', 'score', 'last_used_at']
+
+
 class CreateUpdateDeletePostSerializer(serializers.ModelSerializer):
     class Meta:
         model = PostModel
@@ -24,105 +38,170 @@ class CreateUpdateDeletePostSerializer(serializers.ModelSerializer):
         extra_kwargs = {'posted_by': {'read_only': True}}
 
     def create(self, validated_data):
-        tags = []
-        # if validated_data.get('tags', None):
-        #     validated_data.pop('tags')
-        for word in validated_data['post'].split():
-            if (word[0] == '#'):
-                tag = TagModel.objects.filter(name=word[1:]).first()
-                if tag:
-                    tags.append(tag.pk)
-
-                else:
-                    tag = TagModel(name=word[1:])
-                    tag.save()
-                    tags.append(tag.pk)
+        # タグは本文から抽出する
+        validated_data.pop('tags', None)
         post = super().create(validated_data)
-        post.tags.set(tags)
+        tags = get_or_create_tags(extract_hashtags(post.post))
+        post.tags.add(*tags)
+        record_tag_usage(tags, now=post.created_at)
+        return post
+
+    def update(self, instance, validated_data):
+        validated_data.pop('tags', None)
+        post = super().update(instance, validated_data)
+        if 'post' in validated_data:
+            # 差分だけを追加・削除する
+            post.tags.set(get_or_create_tags(extract_hashtags(post.post)))
         return post
 
 
-class GetParentPostSerializser(serializers.ModelSerializer):
+def profile_summary(user):
+    """投稿者のプロフィール（ニックネームと画像URL）を返す"""
+    # select_related済みであれば追加のクエリは発生しない
+    profile = getattr(user, 'profile', None)
+    if profile is None:
+        return None
+
+    return {
+        'nick_name': str(profile.nick_name),
+        # 一覧ではサムネイルを使う
+        'img': avatar_url(profile, 'small')
+    }
+
+
+def shared_by_summary(user):
+    """タイムラインで投稿をシェアした人"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'profile': profile_summary(user)
+    }
+
+
+class PostListSerializer(serializers.ListSerializer):
+    """
+    投稿一覧をまとめてシリアライズする。
+    閲覧者によらない部分は投稿ごとの断片としてキャッシュし、キャッシュにない投稿だけを
+    with_details()でまとめて取得して組み立てる。
+    閲覧者のいいね状態と、タイムラインでシェアした人はページ全体に対して1回ずつのクエリで取得し、
+    断片に上書きする。
+    """
+
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.Manager) else data)
+
+        fragments = get_post_fragments(posts)
+        missing = [post for post in posts if post.id not in fragments]
+        if missing:
+            fragments.update(self.render_fragments(missing))
+
+        post_ids = set()
+        for post in posts:
+            post_ids.add(post.id)
+            if post.parent_id is not None:
+                post_ids.add(post.parent_id)
+
+        request = self.context.get('request')
+        user_id = request.user.id if request is not None else None
+        liked_post_ids = get_liked_post_ids(user_id, post_ids)
+
+        # タイムラインでシェアした人
+        shared_by_ids = {getattr(post, 'shared_by_id', None) for post in posts} - {None}
+        shared_by_users = get_user_model().objects.select_related(
+            'profile').in_bulk(shared_by_ids) if shared_by_ids else {}
+
+        results = []
+        for post in posts:
+            # 削除された直後の投稿は断片を作れないので飛ばす
+            if post.id not in fragments:
+                continue
+            item = dict(fragments[post.id])
+            item['is_liked'] = post.id in liked_post_ids
+            if item['parent'] is not None:
+                item['parent'] = dict(item['parent'])
+                item['parent']['is_liked'] = post.parent_id in liked_post_ids
+
+            user = shared_by_users.get(getattr(post, 'shared_by_id', None))
+            if user is not None:
+                item['is_shared'] = True
+                item['shared_by'] = shared_by_summary(user)
+            results.append(item)
+        return results
+
+    def render_fragments(self, posts):
+        """キャッシュにない投稿を、閲覧者によらない形でシリアライズしてキャッシュに保存する"""
+        detailed = PostModel.objects.with_details().in_bulk([post.id for post in posts])
+
+        # いいね状態とシェアした人は上書きするので、ここでは空にしておく
+        self.child.context['liked_post_ids'] = set()
+        rendered = {
+            detailed[post.id]: self.child.to_representation(detailed[post.id])
+            for post in posts if post.id in detailed
+        }
+        del self.child.context['liked_post_ids']
+
+        set_post_fragments(rendered)
+        return {post.id: fragment for post, fragment in rendered.items()}
+
+
+class PostFieldsMixin:
+    """
+    GetPostSerializerとGetParentPostSerializserで共通のフィールド。
+    PostListSerializerが用意したいいね状態があればそれを使い、なければ1件ずつ取得する。
+    """
+
+    def get_profile(self, instance):
+        if instance.posted_by is None:
+            return None
+        return profile_summary(instance.posted_by)
+
+    def get_is_liked(self, instance):
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return instance.id in liked_post_ids
+        return is_liked(instance.id, self.context.get('request').user.id)
+
+
+class GetParentPostSerializser(PostFieldsMixin, serializers.ModelSerializer):
     # post = SerializerMethodField(read_only=True)
     created_at = serializers.DateTimeField(
         format="%Y-%m-%d %H:%M", read_only=True)
     profile = SerializerMethodField()
     posted_by = GetUserSerializer(read_only=True)
     is_liked = SerializerMethodField()
-    count_likes = SerializerMethodField()
-    count_comments = SerializerMethodField()
     tags = TagSerializer(many=True)
 
     class Meta:
         model = PostModel
         fields = ['id', 'post', 'posted_by', 'profile', 'created_at', 'is_shared',
-                  'is_liked', 'count_likes', 'count_comments', 'tags']
+                  'is_liked', 'count_likes', 'count_comments', 'count_shares', 'tags']
+        read_only_fields = ['count_likes', 'count_comments', 'count_shares']
         extra_kwargs = {'posted_by': {'read_only': True}}
 
-    def get_profile(self, instance):
-        if instance.posted_by is None:
-            return None
-
-        profile = Profile.objects.get(user=instance.posted_by)
 
-        img = profile.img
-        if img:
-            img_url = f"http://127.0.0.1:8000{settings.MEDIA_URL}{str(img)}"
-        else:
-            img_url = None
-
-        return {
-            'nick_name': str(profile.nick_name),
-            'img': img_url
-        }
-
-    def get_is_liked(self, instance):
-        # return None
-        return instance.liked.filter(id=self.context.get('request').user.id).exists()
-
-    def get_count_likes(self, instance):
-        return instance.liked.count()
-
-    def get_count_comments(self, instance):
-        return instance.comment.count()
-
-
-class GetPostSerializer(serializers.ModelSerializer):
+class GetPostSerializer(PostFieldsMixin, serializers.ModelSerializer):
     post = SerializerMethodField(read_only=True)
     created_at = serializers.DateTimeField(
         format="%Y-%m-%d %H:%M", read_only=True)
     profile = SerializerMethodField()
     posted_by = GetUserSerializer(read_only=True)
     is_liked = SerializerMethodField()
-    count_likes = SerializerMethodField()
-    count_comments = SerializerMethodField()
 
     tags = TagSerializer(many=True)
+    is_shared = SerializerMethodField()
+    shared_by = SerializerMethodField()
 
     parent = GetParentPostSerializser(read_only=True)
 
     class Meta:
         model = PostModel
         fields = ['id', 'post', 'posted_by', 'profile', 'created_at', 'is_shared',
-                  'is_liked', 'count_likes', 'count_comments', 'tags', 'parent']
+                  'is_liked', 'count_likes', 'count_comments', 'count_shares', 'tags',
+                  'shared_by', 'parent']
+        read_only_fields = ['count_likes', 'count_comments', 'count_shares']
         extra_kwargs = {'posted_by': {'read_only': True}}
-
-    def get_profile(self, instance):
-        if instance.posted_by is None:
-            return None
-
-        profile = Profile.objects.get(user=instance.posted_by)
-
-        img = profile.img
-        if img:
-            img_url = f"http://127.0.0.1:8000{settings.MEDIA_URL}{str(img)}"
-        else:
-            img_url = None
-
-        return {
-            'nick_name': str(profile.nick_name),
-            'img': img_url
-        }
+        # 一覧ではページ単位でまとめて集計する
+        list_serializer_class = PostListSerializer
 
     def get_post(self, instance):
         post = instance.post
@@ -130,15 +209,17 @@ class GetPostSerializer(serializers.ModelSerializer):
             post = instance.parent.post
         return post
 
-    def get_is_liked(self, instance):
-        # return None
-        return instance.liked.filter(id=self.context.get('request').user.id).exists()
+    def get_is_shared(self, instance):
+        return instance.is_shared or getattr(instance, 'shared_by_id', None) is not None
 
-    def get_count_likes(self, instance):
-        return instance.liked.count()
+    def get_shared_by(self, instance):
+        shared_by_id = getattr(instance, 'shared_by_id', None)
+        if shared_by_id is None:
+            return None
 
-    def get_count_comments(self, instance):
-        return instance.comment.count()
+        user = get_user_model().objects.select_related(
+            'profile').get(id=shared_by_id)
+        return shared_by_summary(user)
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -156,16 +237,4 @@ class CommentSerializer(serializers.ModelSerializer):
     def get_profile(self, instance):
         if instance.commented_by is None:
             return None
-
-        profile = Profile.objects.get(user=instance.commented_by)
-
-        img = profile.img
-        if img:
-            img_url = f"http://127.0.0.1:8000{settings.MEDIA_URL}{str(img)}"
-        else:
-            img_url = None
-
-        return {
-            'nick_name': str(profile.nick_name),
-            'img': img_url
-        }
+        return profile_summary(instance.commented_by)
@@ -1,4 +1,3 @@
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib import auth
 from rest_framework.exceptions import AuthenticationFailed
@@ -13,6 +12,8 @@ from roadmaps.models import (
     LookBackModel
 )
 from .accounts_serializers import GetUserSerializer
+from ..avatars import avatar_url
+from ..ranks import get_step_order
 
 
 class RoadMapSerializer(serializers.ModelSerializer):
@@ -36,15 +37,9 @@ class RoadMapSerializer(serializers.ModelSerializer):
 
         profile = Profile.objects.get(user=instance.challenger)
 
-        img = profile.img
-        if img:
-            img_url = f"http://127.0.0.1:8000{settings.MEDIA_URL}{str(img)}"
-        else:
-            img_url = None
-
         return {
             'nick_name': str(profile.nick_name),
-            'img': img_url
+            'img': avatar_url(profile, 'small')
         }
 
 
@@ -55,13 +50,22 @@ class StepSerializer(serializers.ModelSerializer):
         format="%Y-%m-%d %H:%M", read_only=True)
     # roadmap = RoadMapSerializer(many=True)
     challenger = ReadOnlyField(source='roadmap.challenger.id')
+    # ロードマップの中での位置（0から）。並び順のキーはrank
+    order = SerializerMethodField()
 
     class Meta:
         model = StepModel
         fields = ['id', 'roadmap', 'challenger', 'to_learn', 'is_completed',
-                  'order', 'created_at', 'updated_at']
+                  'order', 'rank', 'created_at', 'updated_at']
         extra_kwargs = {'roadmap':  {'read_only': True},
-                        'order':  {'read_only': True}}
+                        'rank':  {'read_only': True}}
+
+    def get_order(self, instance):
+        # 一覧では、with_step_orderやビューで付けた位置を使う
+        order = getattr(instance, 'order', None)
+        if order is None:
+            order = get_step_order(instance)
+        return order
 
 
 class LookBackSerializer(serializers.ModelSerializer):
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import users_updated
+from .authentication import invalidate_cached_user
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user(sender, instance, **kwargs):
+    # 無効化・パスワードの再設定・削除などを、次のリクエストの認証から反映する
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(users_updated, sender=get_user_model())
+def invalidate_users(sender, user_ids, **kwargs):
+    # 管理画面などからQuerySet.update()でまとめて無効にした場合
+    for user_id in user_ids:
+        invalidate_cached_user(user_id)
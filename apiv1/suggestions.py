@@ -0,0 +1,104 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.models import Follow, FollowSuggestion, Profile
+
+
+def mark_suggestions_stale(user_id):
+    """
+    user_idがフォロー・フォロー解除したとき、user_idと、user_idをフォローしている人の
+    おすすめユーザーを再計算の対象にする
+    """
+    Profile.objects.filter(
+        Q(user=user_id) | Q(user__in=Follow.objects.filter(
+            profile__user=user_id).values('user_id'))
+    ).update(is_suggestion_stale=True)
+
+
+def load_follow_graph():
+    """
+    フォローの関係を、ユーザーを0からの整数で表したCSR形式の隣接リストとして読み込む。
+    followees[indptr[i]:indptr[i + 1]] がユーザーiのフォローしている人。
+    モデルのインスタンスは作らず、values_listで2列だけを読む。
+    """
+    index = {}
+    user_ids = []
+    src, dst = [], []
+
+    def to_index(user_id):
+        i = index.get(user_id)
+        if i is None:
+            i = index[user_id] = len(user_ids)
+            user_ids.append(user_id)
+        return i
+
+    edges = Follow.objects.order_by().values_list(
+        'user_id', 'profile__user_id')
+    for follower_id, followee_id in edges.iterator(chunk_size=10000):
+        src.append(to_index(follower_id))
+        dst.append(to_index(followee_id))
+
+    src = np.array(src, dtype=np.int32)
+    dst = np.array(dst, dtype=np.int32)
+    order = np.argsort(src, kind='stable')
+    followees = dst[order]
+    indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(user_ids)), out=indptr[1:])
+    return user_ids, index, indptr, followees
+
+
+def suggest(i, indptr, followees, limit):
+    """
+    ユーザーiのフォローしている人がフォローしている人を、共通のフォロー数の多い順にlimit人返す。
+    (おすすめのユーザーの番号の配列, 共通のフォロー数の配列)
+    """
+    following = followees[indptr[i]:indptr[i + 1]]
+    if len(following) == 0:
+        return following, following
+
+    # フォローしている人ごとのフォロー先の範囲を、1つの添字の配列にまとめて取り出す
+    starts = indptr[following]
+    lengths = indptr[following + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    candidates = followees[offsets + np.arange(lengths.sum())]
+
+    # 自分と、すでにフォローしている人は除く
+    candidates = candidates[(candidates != i) & ~np.isin(candidates, following)]
+    candidates, counts = np.unique(candidates, return_counts=True)
+    top = np.lexsort((candidates, -counts))[:limit]
+    return candidates[top], counts[top]
+
+
+def refresh_follow_suggestions(stale_only=False, limit=None, batch_size=1000):
+    """
+    おすすめユーザーを計算して保存する。stale_onlyなら、フォローが変わったユーザーだけを計算する。
+    計算したユーザー数を返す。
+    """
+    limit = limit or settings.FOLLOW_SUGGESTIONS_LIMIT
+    user_ids, index, indptr, followees = load_follow_graph()
+
+    if stale_only:
+        targets = list(Profile.objects.filter(
+            is_suggestion_stale=True).values_list('user_id', flat=True))
+    else:
+        targets = list(Profile.objects.values_list('user_id', flat=True))
+
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        suggestions = []
+        for user_id in batch:
+            i = index.get(user_id)
+            if i is None:
+                continue
+            candidates, counts = suggest(i, indptr, followees, limit)
+            suggestions += [
+                FollowSuggestion(user_id=user_id, suggested_id=user_ids[c], count_mutual=int(n))
+                for c, n in zip(candidates, counts)
+            ]
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user__in=batch).delete()
+            FollowSuggestion.objects.bulk_create(suggestions, batch_size=batch_size)
+            Profile.objects.filter(user__in=batch).update(is_suggestion_stale=False)
+    return len(targets)
@@ -0,0 +1,286 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from accounts.models import FollowSuggestion, Profile, Reset, UserToken
+from posts.models import PostModel, CommentModel, ShareModel, TimelineModel
+from roadmaps.models import RoadMapModel, StepModel, LookBackModel
+from ..avatars import avatar_url
+from ..models import EmailOutboxModel, ThrottleBucketModel
+from ..outbox import enqueue_email
+from ..refresh_tokens import store_refresh_token
+from ..search import search_posts
+
+
+class TestReconcilePostCounters(TestCase):
+
+    def test_counters_are_recomputed(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        post = PostModel.objects.create(post='test', posted_by=user)
+        post.liked.add(user)
+        CommentModel.objects.create(
+            comment='comment', commented_by=user, post=post)
+        ShareModel.objects.create(shared_by=user, post=post)
+        PostModel.objects.filter(id=post.id).update(
+            count_likes=5, count_comments=5, count_shares=5)
+
+        call_command('reconcile_post_counters', batch_size=1, stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.count_likes, 1)
+        self.assertEqual(post.count_comments, 1)
+        self.assertEqual(post.count_shares, 1)
+
+
+class TestReconcileProfileCounters(TestCase):
+
+    def test_counters_are_recomputed(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        other = get_user_model().objects.create_user(
+            username="other",
+            email="other@test.test",
+            password="testpassword"
+        )
+        profile = Profile.objects.create(user=user, nick_name='nanashi')
+        Profile.objects.create(user=other, nick_name='other')
+        profile.followers.add(other)
+        post = PostModel.objects.create(post='test', posted_by=user)
+        post.liked.add(other)
+        RoadMapModel.objects.create(title='title', challenger=user)
+        Profile.objects.update(count_follower=5, count_following=5, count_posts=5,
+                               count_roadmaps=5, count_likes_received=5)
+
+        call_command('reconcile_profile_counters', batch_size=1, stdout=StringIO())
+
+        profile.refresh_from_db()
+        self.assertEqual(
+            (profile.count_follower, profile.count_following, profile.count_posts,
+             profile.count_roadmaps, profile.count_likes_received),
+            (1, 0, 1, 1, 1))
+        self.assertEqual(Profile.objects.get(user=other).count_following, 1)
+
+
+class TestRefreshFollowSuggestions(TestCase):
+
+    def test_friends_of_friends(self):
+        users = {}
+        for name in 'abcde':
+            users[name] = get_user_model().objects.create_user(
+                username=name, email=f'{name}@test.test', password="testpassword")
+            Profile.objects.create(user=users[name], nick_name=name)
+
+        def follow(follower, followee):
+            users[followee].profile.followers.add(users[follower])
+        follow('a', 'b')
+        follow('a', 'e')
+        follow('b', 'c')
+        follow('b', 'd')
+        follow('e', 'c')
+        follow('e', 'a')
+
+        call_command('refresh_follow_suggestions', stdout=StringIO())
+
+        suggestions = FollowSuggestion.objects.filter(user=users['a'])
+        self.assertEqual([(s.suggested.username, s.count_mutual) for s in suggestions],
+                         [('c', 2), ('d', 1)])
+        self.assertFalse(Profile.objects.filter(is_suggestion_stale=True).exists())
+
+        # フォローが変わったユーザーだけを計算し直す
+        follow('d', 'e')
+        Profile.objects.filter(user=users['d']).update(is_suggestion_stale=True)
+        call_command('refresh_follow_suggestions', stale_only=True, stdout=StringIO())
+        self.assertEqual(
+            sorted(FollowSuggestion.objects.filter(user=users['d']).values_list(
+                'suggested__username', flat=True)), ['a', 'c'])
+        self.assertEqual(FollowSuggestion.objects.filter(user=users['a']).count(), 2)
+
+
+class TestRebuildSearchIndex(TestCase):
+
+    def test_posts_are_indexed(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        post = PostModel.objects.create(post='今日は雨', posted_by=user)
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(list(search_posts('雨')), [post])
+        self.assertEqual(list(search_posts('今日は')), [post])
+
+
+class TestRebuildTimelines(TestCase):
+
+    def test_timelines_are_rebuilt(self):
+        users = [
+            get_user_model().objects.create_user(
+                username=f"user{i}", email=f"user{i}@test.test", password="testpassword")
+            for i in range(3)
+        ]
+        profiles = [Profile.objects.create(user=user, nick_name=user.username) for user in users]
+        for profile in profiles[1:]:
+            profile.followers.add(users[0])
+        posts = [PostModel.objects.create(post='test', posted_by=user) for user in users[1:]]
+
+        call_command('rebuild_timelines', stdout=StringIO())
+
+        self.assertEqual(
+            set(TimelineModel.objects.filter(owner=users[0]).values_list('post', flat=True)),
+            {post.id for post in posts})
+
+
+class TestExportUserData(TestCase):
+
+    def test_export_zip(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        post = PostModel.objects.create(post='テスト', posted_by=user)
+        CommentModel.objects.create(comment='comment', commented_by=user, post=post)
+        roadmap = RoadMapModel.objects.create(title='title', challenger=user)
+        step = StepModel.objects.create(roadmap=roadmap, to_learn='step', rank='i')
+        LookBackModel.objects.create(step=step, learned='learned')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'export.zip')
+            call_command('export_user_data', 'username', output=path, zip=True, stdout=StringIO())
+            with zipfile.ZipFile(path) as archive:
+                lines = archive.read('export.ndjson').decode('utf-8').splitlines()
+
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['type'] for row in rows],
+                         ['post', 'comment', 'roadmap', 'step', 'lookback'])
+        self.assertEqual(rows[0]['post'], 'テスト')
+        self.assertEqual(rows[3]['roadmap'], str(roadmap.id))
+
+
+class TestProcessAvatars(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+
+    def test_thumbnails(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, format='PNG')
+        with override_settings(MEDIA_ROOT=self.media_root.name, MEDIA_BASE_URL='https://cdn.test'):
+            profile = Profile.objects.create(
+                user=user, nick_name='nanashi',
+                img=SimpleUploadedFile('avatar.PNG', buffer.getvalue()))
+            digest = hashlib.sha256(buffer.getvalue()).hexdigest()
+            self.assertEqual(profile.img.name, f'avatars/{digest}.png')
+            self.assertEqual(avatar_url(profile), f'https://cdn.test/media/avatars/{digest}.png')
+
+            call_command('process_avatars', stdout=StringIO())
+
+            profile.refresh_from_db()
+            self.assertTrue(profile.is_avatar_processed)
+            self.assertEqual(avatar_url(profile, 'medium'),
+                             f'https://cdn.test/media/avatars/{digest}_medium.jpg')
+            with Image.open(os.path.join(self.media_root.name, f'avatars/{digest}_small.jpg')) as image:
+                self.assertEqual(image.size, (64, 64))
+
+    def test_decompression_bomb_is_rejected(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, format='PNG')
+        with override_settings(MEDIA_ROOT=self.media_root.name), \
+                mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            profile = Profile.objects.create(
+                user=user, nick_name='nanashi',
+                img=SimpleUploadedFile('avatar.png', buffer.getvalue()))
+
+            call_command('process_avatars', stdout=StringIO(), stderr=StringIO())
+
+            profile.refresh_from_db()
+            self.assertFalse(profile.is_avatar_processed)
+            self.assertTrue(profile.is_avatar_rejected)
+            self.assertIsNone(avatar_url(profile))
+
+
+class TestSendQueuedEmails(TestCase):
+
+    def test_send(self):
+        for i in range(3):
+            enqueue_email(f'user{i}@test.test', 'subject', 'body')
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_queued_emails', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(EmailOutboxModel.objects.filter(status='sent').count(), 3)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                       EMAIL_HOST='127.0.0.1', EMAIL_PORT=1, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        email = enqueue_email('user@test.test', 'subject', 'body')
+
+        call_command('send_queued_emails', stdout=StringIO())
+        email.refresh_from_db()
+        # 失敗したメールは間隔を空けて再送する
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        EmailOutboxModel.objects.update(next_attempt_at=timezone.now())
+        call_command('send_queued_emails', stdout=StringIO())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+
+
+class TestPurgeExpiredTokens(TestCase):
+
+    def test_purge(self):
+        user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        now = timezone.now()
+        for _ in range(3):
+            store_refresh_token(user.id, now=now - timedelta(days=8))
+        store_refresh_token(user.id)
+        Reset.objects.create(email=user.email, token='old', created_at=now - timedelta(days=2))
+        Reset.objects.create(email=user.email, token='new')
+        # 'register'の1時間が最も長いので、それより前のバケットは満タンに戻っている
+        ThrottleBucketModel.objects.create(key='old', tokens=0, updated_at=time.time() - 3601)
+        ThrottleBucketModel.objects.create(key='new', tokens=0, updated_at=time.time())
+
+        call_command('purge_expired_tokens', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(UserToken.objects.count(), 1)
+        self.assertEqual(list(Reset.objects.values_list('token', flat=True)), ['new'])
+        self.assertEqual(list(ThrottleBucketModel.objects.values_list('key', flat=True)), ['new'])
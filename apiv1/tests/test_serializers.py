@@ -88,3 +88,28 @@ class TestCreateUpdateDeletePostSerializer(TestCase):
         serializer = CreateUpdateDeletePostSerializer(instance=post)
         self.assertEqual(serializer.data['id'], str(post.id))
         self.assertEqual(serializer.data['post'], post.post)
+
+    def test_hashtags_are_extracted(self):
+        serializer = CreateUpdateDeletePostSerializer(
+            data={'post': '#雨 今日は＃天気。#雨 a#b (#paren)'})
+        serializer.is_valid()
+        post = serializer.save(posted_by=self.user)
+        self.assertCountEqual(
+            post.tags.values_list('name', flat=True), ['雨', '天気', 'paren'])
+
+        serializer = CreateUpdateDeletePostSerializer(
+            instance=post, data={'post': '#天気 #晴れ'}, partial=True)
+        serializer.is_valid()
+        post = serializer.save()
+        self.assertCountEqual(
+            post.tags.values_list('name', flat=True), ['天気', '晴れ'])
+        self.assertEqual(TagModel.objects.count(), 4)
+
+    def test_tag_queries_are_constant(self):
+        serializer = CreateUpdateDeletePostSerializer(
+            data={'post': ' '.join('#tag%d' % i for i in range(20))})
+        serializer.is_valid()
+        # 投稿の作成 + タグの取得・作成・再取得 + タグの関連付け + トレンドの取得・作成
+        with self.assertNumQueries(7):
+            post = serializer.save(posted_by=self.user)
+        self.assertEqual(post.tags.count(), 20)
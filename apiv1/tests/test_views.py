@@ -1,24 +1,47 @@
 import json
+from io import StringIO
+from datetime import timedelta
+from unittest import mock
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.timezone import localtime
 from rest_framework import response
 from rest_framework.test import APITestCase
-from posts.models import PostModel, TagModel
+from posts.models import PostModel, TagModel, TimelineModel, ShareModel
 from roadmaps.models import RoadMapModel, StepModel, LookBackModel
-from accounts.models import Profile
+from accounts.models import Follow, Profile, UserToken
 # from rest_framework_simplejwt.tokens import RefreshToken
 from django.urls import reverse
 from ..authentication import (
     create_access_token,
     decode_access_token,
     decode_refresh_token,
+    get_user_key,
+    get_user_version_key,
     JWTAuthentication
 )
+from ..models import EmailOutboxModel
+from ..throttling import (
+    CacheBucketStore,
+    DatabaseBucketStore,
+    LocalBucketStore,
+    get_bucket_store
+)
+from ..trending import record_tag_usage
 
 
 class TestRegisterLogin(APITestCase):
     REGISTER_URL = "/api/v1/register/"
     LOGIN_URL = "/api/v1/login/"
+    REFRESH_URL = "/api/v1/refresh/"
+    LOGOUT_URL = "/api/v1/logout/"
 
     data = {
         "username": "username",
@@ -32,6 +55,88 @@ class TestRegisterLogin(APITestCase):
             self.REGISTER_URL, self.data, format="json")
         self.assertEqual(response.status_code, 201)
 
+    def setUp(self):
+        # レート制限のバケットを空にする
+        cache.clear()
+
+    def login(self):
+        user = get_user_model().objects.create_user(
+            username="username", email="demo@demo.demo", password="registration")
+        user.is_verified = True
+        user.save()
+        return self.client.post(self.LOGIN_URL, self.data, format="json").data['tokens']
+
+    def test_login_fetches_user_once(self):
+        user = get_user_model().objects.create_user(
+            username="username", email="demo@demo.demo", password="registration")
+        user.is_verified = True
+        user.save()
+
+        # ユーザーの取得と、トランザクション（テストではSAVEPOINT）内でのリフレッシュトークンの保存だけ
+        # （レート制限のバケットはデータベースに置かないようにして数えない）
+        with self.assertNumQueries(4), \
+                override_settings(THROTTLE_STORE='apiv1.throttling.LocalBucketStore'):
+            response = self.client.post(self.LOGIN_URL, self.data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            decode_access_token(response.data['tokens']['access_token']), str(user.id))
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_login_upgrades_password_hash(self):
+        user = get_user_model().objects.create_user(
+            username="username", email="demo@demo.demo", password="registration")
+        user.is_verified = True
+        user.password = make_password("registration", hasher='md5')
+        user.save()
+
+        response = self.client.post(self.LOGIN_URL, self.data, format="json")
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+    def test_refresh_rotates_token(self):
+        refresh_token = self.login()['refresh_token']
+        # トークンそのものは保存しない
+        self.assertFalse(UserToken.objects.filter(token_hash=refresh_token).exists())
+
+        response = self.client.post(self.REFRESH_URL, {"refresh": refresh_token}, format="json")
+        self.assertEqual(response.status_code, 200)
+        new_refresh_token = response.data['refresh']
+        self.assertNotEqual(new_refresh_token, refresh_token)
+
+        response = self.client.post(
+            self.REFRESH_URL, {"refresh": new_refresh_token}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_reused_refresh_token_revokes_family(self):
+        refresh_token = self.login()['refresh_token']
+        new_refresh_token = self.client.post(
+            self.REFRESH_URL, {"refresh": refresh_token}, format="json").data['refresh']
+
+        # 交換済みのトークンが使われたら、交換後のトークンも無効にする
+        response = self.client.post(self.REFRESH_URL, {"refresh": refresh_token}, format="json")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            self.REFRESH_URL, {"refresh": new_refresh_token}, format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(UserToken.objects.exists())
+
+    def test_logout_revokes_refresh_token(self):
+        refresh_token = self.login()['refresh_token']
+        self.client.post(self.LOGOUT_URL, {"refresh": refresh_token}, format="json")
+
+        response = self.client.post(self.REFRESH_URL, {"refresh": refresh_token}, format="json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_registration_queues_email(self):
+        self.client.post(self.REGISTER_URL, self.data, format="json")
+        # リクエストの中では送信せず、送信待ちにする
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutboxModel.objects.get().to_email, "demo@demo.demo")
+
     def test_user_cannot_login_with_unverified(self):
         self.client.post(self.REGISTER_URL, self.data, format="json")
         response = self.client.post(self.LOGIN_URL, self.data, format="json")
@@ -48,6 +153,85 @@ class TestRegisterLogin(APITestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestThrottling(APITestCase):
+    LOGIN_URL = "/api/v1/login/"
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(THROTTLE_RATES={'login': {'ip': '10/min', 'account': '2/min'}})
+    def test_login_throttled_by_account(self):
+        data = {"email": "demo@demo.demo", "password": "wrongpassword"}
+        for _ in range(2):
+            response = self.client.post(self.LOGIN_URL, data, format="json")
+            self.assertNotEqual(response.status_code, 429)
+
+        response = self.client.post(self.LOGIN_URL, data, format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # 別のアカウントはIPの残りで受け付ける
+        response = self.client.post(
+            self.LOGIN_URL, {**data, "email": "other@demo.demo"}, format="json")
+        self.assertNotEqual(response.status_code, 429)
+
+    @override_settings(THROTTLE_RATES={'login': {'ip': '2/min', 'account': '10/min'}})
+    def test_forwarded_for_cannot_be_spoofed(self):
+        # クライアントが送った値の後に、ルーターが接続元のIPアドレスを追加する
+        for i in range(3):
+            response = self.client.post(
+                self.LOGIN_URL, {"email": f"user{i}@demo.demo", "password": "wrongpassword"},
+                format="json", HTTP_X_FORWARDED_FOR=f"10.0.0.{i}, 203.0.113.1")
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(THROTTLE_RATES={'login': {'ip': '3/min', 'account': '1/min'}})
+    def test_rejected_request_does_not_use_ip_token(self):
+        data = {"email": "demo@demo.demo", "password": "wrongpassword"}
+        for _ in range(2):
+            response = self.client.post(self.LOGIN_URL, data, format="json")
+        self.assertEqual(response.status_code, 429)
+
+        # アカウントで拒否した分は、IPアドレスのトークンを使っていない
+        for i in range(2):
+            response = self.client.post(
+                self.LOGIN_URL, {**data, "email": f"user{i}@demo.demo"}, format="json")
+            self.assertNotEqual(response.status_code, 429)
+
+    @override_settings(THROTTLE_STORE=None)
+    def test_default_store_follows_cache(self):
+        # テストのキャッシュはlocmemなので、worker間で共有できるデータベースに置く
+        self.assertIsInstance(get_bucket_store(), DatabaseBucketStore)
+        with mock.patch('apiv1.throttling.is_shared_cache', return_value=True):
+            self.assertIsInstance(get_bucket_store(), CacheBucketStore)
+
+    def test_local_bucket_refill(self):
+        store = LocalBucketStore()
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        self.assertEqual(store.take('key', 2, 1.0, 100.5), 0.5)
+        self.assertEqual(store.take('key', 2, 1.0, 101.0), 0)
+
+    def test_database_bucket_refill(self):
+        store = DatabaseBucketStore()
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        self.assertEqual(store.take('key', 2, 1.0, 100.5), 0.5)
+        self.assertEqual(store.take('key', 2, 1.0, 101.0), 0)
+        store.put_back('key', 2, 1.0, 101.0)
+        self.assertEqual(store.take('key', 2, 1.0, 101.0), 0)
+
+    def test_cache_bucket_window(self):
+        store = CacheBucketStore()
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        self.assertEqual(store.take('key', 2, 1.0, 100.0), 0)
+        # 期間（満タンに戻るまでの2秒）の終わりまで待つ
+        self.assertEqual(store.take('key', 2, 1.0, 100.5), 1.5)
+        store.put_back('key', 2, 1.0, 100.5)
+        self.assertEqual(store.take('key', 2, 1.0, 100.5), 0)
+        # 次の期間では、直前の期間の回数を経過した割合だけ減らす
+        self.assertEqual(store.take('key', 2, 1.0, 102.5), 0.5)
+        self.assertEqual(store.take('key', 2, 1.0, 103.0), 0)
+
+
 class TestProfileViewSet(APITestCase):
     PROFILE_URL = "/api/v1/profile/"
 
@@ -169,6 +353,157 @@ class TestFollowUser(APITestCase):
         content = json.loads(response.content)
         self.assertEqual(content["result"], 'You can not follow yourself')
 
+    def test_idempotent_follow(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        url = "/api/v1/user/" + str(self.followedUser.id) + "/follow/"
+
+        for i in range(2):
+            response = self.client.put(url)
+            self.assertEqual(json.loads(response.content)["isFollowed"], True)
+        self.followedUserProfile.refresh_from_db()
+        self.assertEqual(self.followedUserProfile.count_follower, 1)
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+
+        for i in range(2):
+            response = self.client.delete(url)
+            self.assertEqual(json.loads(response.content)["isFollowed"], False)
+        self.followedUserProfile.refresh_from_db()
+        self.assertEqual(self.followedUserProfile.count_follower, 0)
+
+        response = self.client.put("/api/v1/user/" + str(self.user.id) + "/follow/")
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_follow(self):
+        other = get_user_model().objects.create_user(
+            username="other", email="other@test.test", password="testpassword")
+        Profile.objects.create(user=other, nick_name='other')
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.put("/api/v1/user/" + str(other.id) + "/follow/")
+
+        ids = [str(self.followedUser.id), str(other.id), str(self.user.id)]
+        response = self.client.post("/api/v1/follow/bulk/", {"ids": ids}, format='json')
+        self.assertEqual(json.loads(response.content)["followed"], [str(self.followedUser.id)])
+        self.userProfile.refresh_from_db()
+        self.assertEqual(self.userProfile.count_following, 2)
+
+        response = self.client.post("/api/v1/follow/bulk/", {"ids": ["invalid"]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_profile_counters(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.put(
+            self.TARGET_URL + str(self.followedUser.id) + "/", {}, format='json')
+        token = create_access_token(str(self.followedUser.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.post(
+            "/api/v1/create_update_delete_post/", {'post': 'test'}, format='json')
+        post_id = json.loads(response.content)["id"]
+        self.client.post("/api/v1/roadmap/", {
+            'title': 'title', 'overview': 'overview', 'is_public': 'public'}, format='json')
+        self.client.put("/api/v1/post/" + post_id + "/like/")
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                "/api/v1/profile/" + str(self.followedUser.id) + "/stats/")
+        self.assertEqual(len(context), 1)
+        self.assertEqual(json.loads(response.content), {
+            "countFollower": 1, "countFollowing": 0, "countPosts": 1,
+            "countRoadmaps": 1, "countLikesReceived": 1})
+
+        self.client.delete("/api/v1/create_update_delete_post/" + post_id + "/")
+        response = self.client.get("/api/v1/profile/" + str(self.user.id) + "/")
+        self.assertEqual(json.loads(response.content)["countFollowing"], 1)
+        self.followedUserProfile.refresh_from_db()
+        self.assertEqual(self.followedUserProfile.count_posts, 0)
+        self.assertEqual(self.followedUserProfile.count_likes_received, 0)
+
+
+class TestFollowList(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.users = [
+            get_user_model().objects.create_user(
+                username=f"user{i}", email=f"user{i}@test.test", password="testpassword")
+            for i in range(13)
+        ]
+        for user in cls.users:
+            Profile.objects.create(user=user, nick_name=user.username)
+
+    def test_followers_are_paginated(self):
+        viewer, target = self.users[0], self.users[1]
+        token = create_access_token(str(viewer.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.put("/api/v1/follow/" + str(self.users[12].id) + "/")
+        for user in self.users[2:]:
+            self.login_and_follow(user, target)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        url = "/api/v1/followers/" + str(target.profile.id) + "/"
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        # フォロワー1ページとフォロワー数
+        self.assertEqual(len(context), 2)
+        content = json.loads(response.content)
+        self.assertEqual(content["total"], 11)
+        self.assertEqual(len(content["results"]), 10)
+        # 新しくフォローした順
+        self.assertEqual(content["results"][0]["user"]["username"], 'user12')
+        self.assertEqual(content["results"][0]["isFollowed"], True)
+        self.assertEqual(content["results"][1]["isFollowed"], False)
+
+        response = self.client.get(content["next"])
+        content = json.loads(response.content)
+        self.assertEqual([p["nickName"] for p in content["results"]], ['user2'])
+        self.assertIsNone(content["next"])
+
+        response = self.client.get("/api/v1/following/" + str(self.users[2].id) + "/")
+        content = json.loads(response.content)
+        self.assertEqual(content["total"], 1)
+        self.assertEqual(content["results"][0]["user"]["username"], 'user1')
+
+    def login_and_follow(self, user, target):
+        token = create_access_token(str(user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.put("/api/v1/follow/" + str(target.id) + "/")
+
+
+class TestFollowSuggestions(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.users = [
+            get_user_model().objects.create_user(
+                username=f"user{i}", email=f"user{i}@test.test", password="testpassword")
+            for i in range(3)
+        ]
+        for user in cls.users:
+            Profile.objects.create(user=user, nick_name=user.username)
+
+    def test_suggestions(self):
+        token = create_access_token(str(self.users[0].id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.put("/api/v1/follow/" + str(self.users[1].id) + "/")
+        self.assertTrue(Profile.objects.get(user=self.users[0]).is_suggestion_stale)
+        self.users[2].profile.followers.add(self.users[1])
+        call_command('refresh_follow_suggestions', stale_only=True, stdout=StringIO())
+
+        response = self.client.get("/api/v1/follow/suggestions/")
+        content = json.loads(response.content)
+        self.assertEqual(content[0]["user"]["username"], 'user2')
+        self.assertEqual(content[0]["profile"]["nickName"], 'user2')
+        self.assertEqual(content[0]["countMutual"], 1)
+
+        # フォローした人は表示しない
+        self.client.put("/api/v1/follow/" + str(self.users[2].id) + "/")
+        response = self.client.get("/api/v1/follow/suggestions/")
+        self.assertEqual(json.loads(response.content), [])
+
 
 class TestCreateUpdateDeletePostView(APITestCase):
     TARGET_URL = "/api/v1/create_update_delete_post/"
@@ -264,3 +599,899 @@ class TestRoadMapViewSet(APITestCase):
         response = self.client.post(self.ROADMAP_URL, params, format='json')
         self.assertEqual(PostModel.objects.count(), 0)
         self.assertEqual(response.status_code, 400)
+
+
+class TestGetPostListView(APITestCase):
+    TARGET_URL = "/api/v1/post/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        Profile.objects.create(user=cls.user, nick_name='nanashi')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_posts(self, count):
+        tag, _ = TagModel.objects.get_or_create(name='test')
+        for i in range(count):
+            post = PostModel.objects.create(
+                post='test #test', posted_by=self.user, count_likes=1)
+            post.tags.add(tag)
+            post.liked.add(self.user)
+            ShareModel.objects.create(shared_by=self.user, post=post)
+
+    def count_queries(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.TARGET_URL)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_posts(1)
+        num_queries = self.count_queries()
+        self.create_posts(5)
+        cache.clear()
+        self.assertEqual(self.count_queries(), num_queries)
+
+    def test_list_content(self):
+        self.create_posts(1)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.get(self.TARGET_URL)
+        content = json.loads(response.content)
+        post = content["results"][0]
+        self.assertEqual(post["isLiked"], True)
+        self.assertEqual(post["countLikes"], 1)
+        self.assertEqual(post["countComments"], 0)
+        self.assertEqual(post["profile"]["nickName"], 'nanashi')
+        self.assertEqual(post["tags"][0]["name"], 'test')
+
+    def get_first_post(self):
+        response = self.client.get(self.TARGET_URL)
+        return json.loads(response.content)["results"][0]
+
+    def test_fragments_are_cached(self):
+        self.create_posts(3)
+        num_queries = self.count_queries()
+        # 2回目は認証したユーザーと、投稿の詳細・タグを取得しない
+        self.assertEqual(self.count_queries(), num_queries - 3)
+
+    def test_fragments_are_invalidated(self):
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.assertEqual(self.get_first_post()["countLikes"], 0)
+
+        # 無効化はコミットしてから行う
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put("/api/v1/post/" + str(post.id) + "/like/")
+        self.assertEqual(self.get_first_post()["countLikes"], 1)
+        self.assertEqual(self.get_first_post()["isLiked"], True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch("/api/v1/profile/" + str(self.user.id) + "/",
+                              {"nick_name": "renamed"})
+        self.assertEqual(self.get_first_post()["profile"]["nickName"], 'renamed')
+
+        # いいね状態は閲覧者ごとに上書きする
+        other = get_user_model().objects.create_user(
+            username="other", email="other@test.test", password="testpassword")
+        token = create_access_token(str(other.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.assertEqual(self.get_first_post()["isLiked"], False)
+
+    def test_parent_fragments_are_invalidated(self):
+        parent = PostModel.objects.create(post='parent', posted_by=self.user)
+        child = PostModel.objects.create(post='child', posted_by=self.user, parent=parent)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+        def get_child():
+            # 引用している投稿は、ユーザーの投稿一覧に表示される
+            response = self.client.get("/api/v1/post/user/" + str(self.user.id) + "/")
+            results = json.loads(response.content)["results"]
+            return next(post for post in results if post["id"] == str(child.id))
+        self.assertEqual(get_child()["parent"]["countLikes"], 0)
+
+        # 引用元へのいいねで、引用している投稿の断片も捨てる
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put("/api/v1/post/" + str(parent.id) + "/like/")
+        self.assertEqual(get_child()["parent"]["countLikes"], 1)
+
+
+class TestLikePost(APITestCase):
+    TARGET_URL = "/api/v1/post/like/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def test_like_and_unlike_update_counter(self):
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+        response = self.client.post(self.TARGET_URL + str(post.id) + '/')
+        self.assertEqual(json.loads(response.content)["result"], 'like')
+        post.refresh_from_db()
+        self.assertEqual(post.count_likes, 1)
+
+        response = self.client.post(self.TARGET_URL + str(post.id) + '/')
+        self.assertEqual(json.loads(response.content)["result"], 'unlike')
+        post.refresh_from_db()
+        self.assertEqual(post.count_likes, 0)
+
+    def test_idempotent_like(self):
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        url = "/api/v1/post/" + str(post.id) + "/like/"
+
+        for i in range(2):
+            response = self.client.put(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content)["isLiked"], True)
+        post.refresh_from_db()
+        self.assertEqual(post.count_likes, 1)
+
+        for i in range(2):
+            response = self.client.delete(url)
+            self.assertEqual(json.loads(response.content)["isLiked"], False)
+        post.refresh_from_db()
+        self.assertEqual(post.count_likes, 0)
+
+        response = self.client.put("/api/v1/post/" + str(self.user.id) + "/like/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_like_state(self):
+        liked = PostModel.objects.create(post='liked', posted_by=self.user)
+        other = PostModel.objects.create(post='other', posted_by=self.user)
+        liked.liked.add(self.user)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+        response = self.client.get(
+            "/api/v1/post/like/state/?ids=%s,%s" % (liked.id, other.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["likedPostIds"], [str(liked.id)])
+
+        response = self.client.get("/api/v1/post/like/state/?ids=invalid")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestGetFollowUserPost(APITestCase):
+    TARGET_URL = "/api/v1/followuser/post/"
+    FOLLOW_URL = "/api/v1/follow/"
+    POST_URL = "/api/v1/create_update_delete_post/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        cls.followedUser = get_user_model().objects.create_user(
+            username="followedUser",
+            email="followed@followed.followed",
+            password="testpassword"
+        )
+        Profile.objects.create(user=cls.user, nick_name='nanashi')
+        Profile.objects.create(user=cls.followedUser, nick_name='followed')
+
+    def login(self, user):
+        token = create_access_token(str(user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+    def get_timeline(self):
+        self.login(self.user)
+        response = self.client.get(self.TARGET_URL)
+        self.assertEqual(response.status_code, 200)
+        return [post["post"] for post in json.loads(response.content)["results"]]
+
+    def test_fan_out_and_backfill(self):
+        PostModel.objects.create(post='before', posted_by=self.followedUser)
+        self.login(self.user)
+        self.client.put(
+            self.FOLLOW_URL + str(self.followedUser.id) + "/", {}, format='json')
+        self.assertEqual(self.get_timeline(), ['before'])
+
+        self.login(self.followedUser)
+        self.client.post(self.POST_URL, {'post': 'after'}, format='json')
+        self.assertEqual(self.get_timeline(), ['after', 'before'])
+
+        # フォローを外すとタイムラインから消える
+        self.client.put(
+            self.FOLLOW_URL + str(self.followedUser.id) + "/", {}, format='json')
+        self.assertEqual(self.get_timeline(), [])
+
+    def test_shares_are_merged(self):
+        author = get_user_model().objects.create_user(
+            username="author",
+            email="author@author.author",
+            password="testpassword"
+        )
+        other = get_user_model().objects.create_user(
+            username="other",
+            email="other@other.other",
+            password="testpassword"
+        )
+        Profile.objects.create(user=author, nick_name='author')
+        Profile.objects.create(user=other, nick_name='other')
+        post = PostModel.objects.create(post='shared', posted_by=author)
+        PostModel.objects.create(post='not shared', posted_by=author)
+
+        self.login(self.user)
+        self.client.put(
+            self.FOLLOW_URL + str(self.followedUser.id) + "/", {}, format='json')
+        self.client.put(self.FOLLOW_URL + str(other.id) + "/", {}, format='json')
+
+        # 2人にシェアされても1件にまとまり、後からシェアした人が表示される
+        for user in (self.followedUser, other):
+            self.login(user)
+            response = self.client.post("/api/v1/post/share/" + str(post.id) + "/")
+            self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertEqual(post.count_shares, 2)
+
+        self.login(self.user)
+        response = self.client.get(self.TARGET_URL)
+        results = json.loads(response.content)["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["id"], str(post.id))
+        self.assertEqual(results[0]["isShared"], True)
+        self.assertEqual(results[0]["sharedBy"]["username"], 'other')
+
+        self.login(other)
+        response = self.client.post("/api/v1/post/unshare/" + str(post.id) + "/")
+        self.assertEqual(json.loads(response.content)["result"], 'unshare')
+        post.refresh_from_db()
+        self.assertEqual(post.count_shares, 1)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_follower_user_is_read_on_demand(self):
+        self.login(self.user)
+        self.client.put(
+            self.FOLLOW_URL + str(self.followedUser.id) + "/", {}, format='json')
+        self.login(self.followedUser)
+        self.client.post(self.POST_URL, {'post': 'popular'}, format='json')
+
+        self.assertEqual(TimelineModel.objects.count(), 0)
+        self.assertEqual(self.get_timeline(), ['popular'])
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_follower_shares_are_read_on_demand(self):
+        other = get_user_model().objects.create_user(
+            username="other",
+            email="other@other.other",
+            password="testpassword"
+        )
+        Profile.objects.create(user=other, nick_name='other')
+        post = PostModel.objects.create(post='shared', posted_by=other)
+        self.login(self.user)
+        for user in (self.followedUser, other):
+            self.client.put(self.FOLLOW_URL + str(user.id) + "/", {}, format='json')
+
+        self.login(self.followedUser)
+        response = self.client.post("/api/v1/post/share/" + str(post.id) + "/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TimelineModel.objects.count(), 0)
+
+        # 元の投稿とシェアは、シェアした日時の1件にまとまる
+        self.login(self.user)
+        response = self.client.get(self.TARGET_URL)
+        results = json.loads(response.content)["results"]
+        self.assertEqual([result["id"] for result in results], [str(post.id)])
+        self.assertEqual(results[0]["sharedBy"]["username"], 'followedUser')
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_follower_users_are_read_in_one_query(self):
+        def count_queries():
+            self.login(self.user)
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(self.TARGET_URL)
+            return len(context)
+
+        self.login(self.user)
+        self.client.put(self.FOLLOW_URL + str(self.followedUser.id) + "/", {}, format='json')
+        num_queries = count_queries()
+        for i in range(3):
+            author = get_user_model().objects.create_user(
+                username=f"author{i}", email=f"author{i}@author.author", password="testpassword")
+            Profile.objects.create(user=author, nick_name='author')
+            self.login(self.user)
+            self.client.put(self.FOLLOW_URL + str(author.id) + "/", {}, format='json')
+        self.assertEqual(count_queries(), num_queries)
+
+    def test_timeline_pages_merge_high_follower_posts(self):
+        author = get_user_model().objects.create_user(
+            username="author",
+            email="author@author.author",
+            password="testpassword"
+        )
+        Profile.objects.create(user=author, nick_name='author', count_follower=10)
+        self.login(self.user)
+        for user in (self.followedUser, author):
+            self.client.put(self.FOLLOW_URL + str(user.id) + "/", {}, format='json')
+
+        expected = []
+        with override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=5):
+            for i in range(8):
+                for user in (self.followedUser, author):
+                    self.login(user)
+                    self.client.post(self.POST_URL, {'post': f'{user.username}{i}'}, format='json')
+                    expected.insert(0, f'{user.username}{i}')
+            # 展開済みの投稿と、読み込み時に取得する投稿を日時の順に合わせる
+            self.assertEqual(TimelineModel.objects.filter(owner=self.user).count(), 8)
+
+            self.login(self.user)
+            response = self.client.get(self.TARGET_URL)
+            content = json.loads(response.content)
+            next_content = json.loads(self.client.get(content["next"]).content)
+        self.assertIsNone(next_content["next"])
+        self.assertEqual(
+            [post["post"] for post in content["results"] + next_content["results"]], expected)
+
+
+class TestPostUser(APITestCase):
+    TARGET_URL = "/api/v1/post/user/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def test_cursor_pagination(self):
+        created_at = PostModel.objects.create(
+            post='test', posted_by=self.user).created_at
+        for i in range(14):
+            PostModel.objects.create(post='test', posted_by=self.user)
+        # created_atが同じでもidで順序が決まる
+        PostModel.objects.update(created_at=created_at)
+
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.get(self.TARGET_URL + str(self.user.id) + '/')
+        content = json.loads(response.content)
+        self.assertEqual(len(content["results"]), 10)
+        self.assertNotIn("count", content)
+
+        # 次のページを取る前に新しい投稿が追加されても、ずれない
+        PostModel.objects.create(post='new', posted_by=self.user)
+
+        response = self.client.get(content["next"])
+        next_content = json.loads(response.content)
+        self.assertEqual(len(next_content["results"]), 5)
+        self.assertIsNone(next_content["next"])
+
+        ids = [post["id"] for post in content["results"] + next_content["results"]]
+        self.assertEqual(len(set(ids)), 15)
+
+    def test_shares_are_listed(self):
+        author = get_user_model().objects.create_user(
+            username="author",
+            email="author@author.author",
+            password="testpassword"
+        )
+        shared = PostModel.objects.create(post='shared', posted_by=author)
+        PostModel.objects.create(post='own', posted_by=self.user)
+        ShareModel.objects.create(shared_by=self.user, post=shared)
+
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.get(self.TARGET_URL + str(self.user.id) + '/')
+        results = json.loads(response.content)["results"]
+        # シェアはシェアした日時で並ぶ
+        self.assertEqual([post["post"] for post in results], ['shared', 'own'])
+        self.assertEqual(results[0]["sharedBy"]["username"], 'username')
+        self.assertIsNone(results[1]["sharedBy"])
+
+    def test_invalid_cursor(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.get(
+            self.TARGET_URL + str(self.user.id) + '/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestPostSearch(APITestCase):
+    TARGET_URL = "/api/v1/post/search/"
+    POST_URL = "/api/v1/create_update_delete_post/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def search(self, query):
+        response = self.client.get(self.TARGET_URL + query + '/')
+        self.assertEqual(response.status_code, 200)
+        return [post["post"] for post in json.loads(response.content)["results"]]
+
+    def test_search_japanese(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.post(self.POST_URL, {'post': '天気が良い。天気最高'}, format='json')
+        self.client.post(self.POST_URL, {'post': '今日は良い天気です'}, format='json')
+        self.client.post(self.POST_URL, {'post': '明日は雨'}, format='json')
+
+        # 新しい投稿が先
+        self.assertEqual(self.search('天気'), ['今日は良い天気です', '天気が良い。天気最高'])
+        self.assertEqual(self.search('は'), ['明日は雨', '今日は良い天気です'])
+        self.assertEqual(self.search('晴れ'), [])
+
+    def test_bigrams_must_be_adjacent(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.post(self.POST_URL, {'post': '京都と東京'}, format='json')
+        self.client.post(self.POST_URL, {'post': '東京都に住む'}, format='json')
+
+        # 「東京」「京都」の両方を含んでも、「東京都」と並んでいなければ一致しない
+        self.assertEqual(self.search('東京都'), ['東京都に住む'])
+
+    def test_query_count_does_not_depend_on_query_length(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.post(self.POST_URL, {'post': '今日は良い天気です'}, format='json')
+
+        def count_queries(query):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.search(query), ['今日は良い天気です'])
+            return len(context)
+        # 認証したユーザーと投稿の表示内容をキャッシュしてから数える
+        count_queries('天気')
+        # 語ごとの件数は1回のクエリでまとめて数える
+        self.assertEqual(count_queries('今日は良い天気です'), count_queries('天気'))
+
+    def test_index_is_updated(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        response = self.client.post(self.POST_URL, {'post': 'ＡＢＣ'}, format='json')
+        post_id = json.loads(response.content)["id"]
+        self.assertEqual(len(self.search('abc')), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.POST_URL + post_id + '/', {'post': 'xyz'}, format='json')
+        self.assertEqual(self.search('abc'), [])
+        self.assertEqual(self.search('xyz'), ['xyz'])
+
+    def test_search_cursor(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        for i in range(12):
+            self.client.post(self.POST_URL, {'post': '雨' * (i % 3 + 1)}, format='json')
+
+        response = self.client.get(self.TARGET_URL + '雨/')
+        content = json.loads(response.content)
+        response = self.client.get(content["next"])
+        next_content = json.loads(response.content)
+
+        posts = [post["post"] for post in content["results"] + next_content["results"]]
+        self.assertEqual(posts, ['雨' * (i % 3 + 1) for i in reversed(range(12))])
+
+    @override_settings(SEARCH_MAX_SCANNED=4, SEARCH_SCAN_BATCH_SIZE=2)
+    def test_search_resumes_after_scan_limit(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.post(self.POST_URL, {'post': '東京都'}, format='json')
+        for i in range(6):
+            self.client.post(self.POST_URL, {'post': '京都と東京'}, format='json')
+
+        # 読む索引の件数を超えたら、見つかった分だけを返して続きを次のページで読む
+        content = json.loads(self.client.get(self.TARGET_URL + '東京都/').content)
+        self.assertEqual(content["results"], [])
+        content = json.loads(self.client.get(content["next"]).content)
+        self.assertEqual([post["post"] for post in content["results"]], ['東京都'])
+        self.assertIsNone(content["next"])
+
+
+class TestTrendingTags(APITestCase):
+    TARGET_URL = "/api/v1/tag/trending/"
+    POST_URL = "/api/v1/create_update_delete_post/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def test_trending_tags(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        self.client.post(self.POST_URL, {'post': '#雨 #天気'}, format='json')
+        self.client.post(self.POST_URL, {'post': '#天気'}, format='json')
+        # 2日前に何度も使われたタグは、減衰して下位になる
+        old_tag = TagModel.objects.create(name='昔')
+        for i in range(5):
+            record_tag_usage([old_tag], now=timezone.now() - timedelta(days=2))
+
+        response = self.client.get(self.TARGET_URL + '?limit=2')
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual([tag["name"] for tag in content], ['天気', '雨'])
+        self.assertAlmostEqual(content[0]["score"], 2, places=2)
+
+
+class TestComments(APITestCase):
+    TARGET_URL = "/api/v1/post/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        Profile.objects.create(user=cls.user, nick_name='nanashi')
+
+    def test_comments_are_paginated(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        for i in range(12):
+            self.client.post("/api/v1/comment/", {
+                'comment': str(i), 'post': str(post.id)}, format='json')
+        url = self.TARGET_URL + str(post.id) + '/comment/'
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        content = json.loads(response.content)
+        self.assertEqual(len(content["results"]), 10)
+        self.assertEqual(content["results"][0]["comment"], '11')
+        self.assertEqual(content["results"][0]["profile"]["nickName"], 'nanashi')
+        # コメント1ページのみ（認証したユーザーはキャッシュ済み）
+        self.assertEqual(len(context), 1)
+
+        response = self.client.get(content["next"])
+        self.assertEqual(len(json.loads(response.content)["results"]), 2)
+
+    def test_comments_preview(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        for i in range(5):
+            self.client.post("/api/v1/comment/", {
+                'comment': str(i), 'post': str(post.id)}, format='json')
+
+        response = self.client.get(
+            self.TARGET_URL + str(post.id) + '/comment/?preview=2')
+        content = json.loads(response.content)
+        self.assertEqual(content["count"], 5)
+        self.assertEqual([c["comment"] for c in content["results"]], ['4', '3'])
+
+
+class TestJWTAuthentication(APITestCase):
+    TARGET_URL = "/api/v1/user/"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def setUp(self):
+        # データベースはテストごとに戻るが、キャッシュは残る
+        cache.clear()
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+    def test_user_is_cached(self):
+        response = self.client.get(self.TARGET_URL)
+        self.assertEqual(json.loads(response.content)["username"], 'username')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.TARGET_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context), 0)
+
+    def test_cache_is_invalidated(self):
+        self.client.get(self.TARGET_URL)
+        user = get_user_model().objects.get(id=self.user.id)
+
+        # 無効化はコミットしてから行う
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = 'renamed'
+            user.save()
+        response = self.client.get(self.TARGET_URL)
+        self.assertEqual(json.loads(response.content)["username"], 'renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_active = False
+            user.save()
+        self.assertEqual(self.client.get(self.TARGET_URL).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(self.client.get(self.TARGET_URL).status_code, 403)
+
+    def test_cache_is_invalidated_by_queryset_update(self):
+        self.client.get(self.TARGET_URL)
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.client.get(self.TARGET_URL).status_code, 403)
+
+    def test_cache_is_invalidated_after_commit(self):
+        self.client.get(self.TARGET_URL)
+        key = get_user_key(self.user.id)
+        _, values = cache.get(key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                get_user_model().objects.filter(id=self.user.id).update(is_active=False)
+                # 同時に来たリクエストが、コミット前の（有効な）行を今のバージョンで保存しても
+                version = cache.get(get_user_version_key(self.user.id), 0)
+                cache.set(key, (version, values))
+        self.assertEqual(self.client.get(self.TARGET_URL).status_code, 403)
+
+
+class TestExportData(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+
+    def test_export_ndjson(self):
+        other = get_user_model().objects.create_user(
+            username="other", email="other@test.test", password="testpassword")
+        PostModel.objects.create(post='mine', posted_by=self.user)
+        PostModel.objects.create(post='other', posted_by=other)
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+        response = self.client.get("/api/v1/export/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["post"], 'mine')
+
+        response = self.client.get("/api/v1/export/?archive=zip")
+        self.assertEqual(response["Content-Type"], 'application/zip')
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+
+
+class TestConditionalGet(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create_user(
+            username="username",
+            email="test@test.test",
+            password="testpassword"
+        )
+        Profile.objects.create(user=cls.user, nick_name='nanashi')
+
+    def setUp(self):
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION="Beaer " + token)
+
+    def test_post_not_modified(self):
+        post = PostModel.objects.create(post='test', posted_by=self.user)
+        url = "/api/v1/post/" + str(post.id) + "/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # いいねするとカウンターが変わる
+        self.client.put("/api/v1/post/" + str(post.id) + "/like/")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_list_not_modified_without_serialization(self):
+        PostModel.objects.create(post='test', posted_by=self.user)
+        response = self.client.get("/api/v1/post/")
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/v1/post/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # ページの取得のみ（認証したユーザーはキャッシュ済み）
+        self.assertEqual(len(context), 1)
+
+        PostModel.objects.create(post='new', posted_by=self.user)
+        response = self.client.get("/api/v1/post/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_steps_not_modified(self):
+        roadmap = RoadMapModel.objects.create(
+            title='title', overview='overview', challenger=self.user, is_public='public')
+        step = StepModel.objects.create(roadmap=roadmap, to_learn='step', rank='i')
+        url = "/api/v1/step/roadmap/" + str(roadmap.id) + "/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        step.rank = 'j'
+        StepModel.objects.bulk_update([step], fields=["rank"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class TestStepRank(APITestCase):
+    STEP_URL = "/api/v1/step/"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="username", email="demo@demo.demo", password="registration")
+        self.roadmap = RoadMapModel.objects.create(
+            title='title', overview='overview', challenger=self.user, is_public='public')
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+
+    def create_steps(self, count):
+        for i in range(count):
+            response = self.client.post(self.STEP_URL, {
+                "roadmap": str(self.roadmap.id), "to_learn": str(i),
+                "is_completed": "left_untouched"}, format="json")
+            self.assertEqual(response.status_code, 201)
+        return list(StepModel.objects.filter(roadmap=self.roadmap))
+
+    def test_create_appends(self):
+        steps = self.create_steps(3)
+        self.assertEqual([step.to_learn for step in steps], ['0', '1', '2'])
+
+    def test_order_is_position(self):
+        steps = self.create_steps(3)
+        self.client.post(
+            self.STEP_URL + str(steps[2].id) + "/move/", {"after": None}, format="json")
+
+        response = self.client.get("/api/v1/step/roadmap/" + str(self.roadmap.id) + "/")
+        self.assertEqual(
+            [(step["to_learn"], step["order"]) for step in response.data],
+            [('2', 0), ('0', 1), ('1', 2)])
+        response = self.client.get(self.STEP_URL + str(steps[1].id) + "/")
+        self.assertEqual(response.data["order"], 2)
+
+    def test_move_updates_one_row(self):
+        steps = self.create_steps(3)
+        ranks = {step.id: step.rank for step in steps}
+
+        response = self.client.post(
+            self.STEP_URL + str(steps[2].id) + "/move/", {"after": str(steps[0].id)},
+            format="json")
+        self.assertEqual(response.status_code, 200)
+        moved = list(StepModel.objects.filter(roadmap=self.roadmap))
+        self.assertEqual([step.to_learn for step in moved], ['0', '2', '1'])
+        # 移動したステップのキーだけが変わる
+        self.assertEqual(
+            [step.id for step in moved if step.rank != ranks[step.id]], [steps[2].id])
+
+        response = self.client.post(
+            self.STEP_URL + str(steps[1].id) + "/move/", {"after": None}, format="json")
+        self.assertEqual(
+            [step.to_learn for step in StepModel.objects.filter(roadmap=self.roadmap)],
+            ['1', '0', '2'])
+
+    @override_settings(STEP_RANK_MAX_LENGTH=2)
+    def test_rebalance(self):
+        steps = self.create_steps(3)
+        # 同じ場所への挿入を繰り返すとキーが長くなるので、振り直す
+        for _ in range(4):
+            response = self.client.post(
+                self.STEP_URL + str(steps[2].id) + "/move/", {"after": str(steps[0].id)},
+                format="json")
+            self.assertEqual(response.status_code, 200)
+            steps[1], steps[2] = steps[2], steps[1]
+        moved = list(StepModel.objects.filter(roadmap=self.roadmap))
+        self.assertEqual([step.id for step in moved], [step.id for step in steps])
+        self.assertTrue(all(len(step.rank) <= 2 for step in moved))
+
+
+class TestChangeStepOrder(APITestCase):
+    URL = "/api/v1/step/change-order"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="username", email="demo@demo.demo", password="registration")
+        self.roadmap = RoadMapModel.objects.create(
+            title='title', overview='overview', challenger=self.user, is_public='public')
+        self.steps = [
+            StepModel.objects.create(roadmap=self.roadmap, to_learn=str(i), rank=rank)
+            for i, rank in enumerate(['a', 'b', 'c', 'd', 'e'])
+        ]
+        token = create_access_token(str(self.user.id))
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+
+    def get_order(self):
+        return [step.to_learn for step in StepModel.objects.filter(roadmap=self.roadmap)]
+
+    def test_full_order(self):
+        order = [self.steps[i].id for i in [0, 4, 1, 2, 3]]
+        # キーが変わった1行だけを、1回のUPDATEで書き込む
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.URL, {
+                "roadmap": str(self.roadmap.id), "order": [str(id) for id in order]},
+                format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([step['to_learn'] for step in response.data], ['0', '4', '1', '2', '3'])
+        self.assertEqual(self.get_order(), ['0', '4', '1', '2', '3'])
+        updates = [q for q in context.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(StepModel.objects.exclude(rank__in=['a', 'b', 'c', 'd', 'e'])
+                 .values_list('to_learn', flat=True)), ['4'])
+
+    def test_moves(self):
+        response = self.client.post(self.URL, {
+            "roadmap": str(self.roadmap.id),
+            "moves": [
+                {"step": str(self.steps[0].id), "after": str(self.steps[2].id)},
+                {"step": str(self.steps[4].id), "after": None},
+            ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_order(), ['4', '1', '2', '0', '3'])
+        self.assertEqual([step['order'] for step in response.data], [0, 1, 2, 3, 4])
+
+    def test_moves_to_end(self):
+        response = self.client.post(self.URL, {
+            "roadmap": str(self.roadmap.id),
+            "moves": [
+                {"step": str(self.steps[1].id), "after": str(self.steps[4].id)},
+                {"step": str(self.steps[4].id), "after": str(self.steps[1].id)},
+                {"step": str(self.steps[1].id), "after": None},
+            ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_order(), ['1', '0', '2', '3', '4'])
+
+    def test_legacy_payload(self):
+        data = [
+            {"id": str(step.id), "roadmap": str(self.roadmap.id), "order": -i}
+            for i, step in enumerate(self.steps)
+        ]
+        response = self.client.post(self.URL, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_order(), ['4', '3', '2', '1', '0'])
+
+    def test_invalid_order(self):
+        response = self.client.post(self.URL, {
+            "roadmap": str(self.roadmap.id), "order": [str(self.steps[0].id)]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_user(self):
+        other = get_user_model().objects.create_user(
+            username="other", email="other@demo.demo", password="registration")
+        self.client.credentials(
+            HTTP_AUTHORIZATION='JWT ' + create_access_token(str(other.id)))
+        response = self.client.post(self.URL, {
+            "roadmap": str(self.roadmap.id),
+            "order": [str(step.id) for step in reversed(self.steps)]}, format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.get_order(), ['0', '1', '2', '3', '4'])
@@ -0,0 +1,218 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from .caching import is_shared_cache
+from .models import ThrottleBucketModel
+
+
+class LocalBucketStore:
+    """
+    プロセスのメモリに置くトークンバケット。件数が上限を超えたら古いものから捨てる
+    （捨てたバケットは満タンとして扱われる）。workerごとに別々に数える。
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate, now):
+        with self.lock:
+            tokens, wait = refill(self.buckets.get(key), capacity, refill_rate, now)
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def put_back(self, key, capacity, refill_rate, now):
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated_at = self.buckets[key]
+                self.buckets[key] = (min(capacity, tokens + 1), updated_at)
+
+
+class DatabaseBucketStore:
+    """
+    データベースに置くトークンバケット。worker間で同じバケットを使う。
+    補充と取り出しを1つの条件付きUPDATEで行うので、同時に来たリクエストも多めに通さない。
+    """
+
+    def take(self, key, capacity, refill_rate, now):
+        buckets = ThrottleBucketModel.objects.filter(key=key)
+        tokens = Least(
+            Value(float(capacity)),
+            F('tokens') + (Value(now) - F('updated_at')) * Value(refill_rate))
+        while True:
+            if buckets.filter(GreaterThanOrEqual(tokens, 1)).update(
+                    tokens=tokens - 1, updated_at=now):
+                return 0
+            bucket = buckets.values_list('tokens', 'updated_at').first()
+            if bucket is not None:
+                return refill(bucket, capacity, refill_rate, now)[1]
+            try:
+                with transaction.atomic():
+                    ThrottleBucketModel.objects.create(
+                        key=key, tokens=capacity - 1, updated_at=now)
+                return 0
+            except IntegrityError:
+                # 同時に作られたバケットから取り出し直す
+                continue
+
+    def put_back(self, key, capacity, refill_rate, now):
+        ThrottleBucketModel.objects.filter(key=key).update(
+            tokens=Least(Value(float(capacity)), F('tokens') + 1))
+
+
+class CacheBucketStore:
+    """
+    Djangoのキャッシュに置くバケット。add/incr/decrだけで数えるので、
+    CACHE_URLがredisなどの共有キャッシュなら、worker間で同時に来たリクエストも多めに通さない。
+    トークンバケットを、満タンに戻るまでの秒数を期間としたスライディングウィンドウで近似する
+    （直前の期間の回数を経過時間の割合だけ減らして、今の期間の回数に足す）。
+    """
+    key_prefix = 'throttle:'
+
+    def get_window_key(self, key, window):
+        return f'{self.key_prefix}{key}:{window}'
+
+    def take(self, key, capacity, refill_rate, now):
+        period = capacity / refill_rate
+        window = int(now // period)
+        current_key = self.get_window_key(key, window)
+        # 次の期間で直前の期間として読むので、2期間分残す
+        cache.add(current_key, 0, int(period * 2) + 1)
+        count = cache.incr(current_key)
+        previous = cache.get(self.get_window_key(key, window - 1), 0)
+        used = previous * (window + 1 - now / period) + count
+        if used <= capacity:
+            return 0
+
+        # 拒否したリクエストは数えない
+        cache.decr(current_key)
+        wait = (window + 1) * period - now
+        if previous:
+            wait = min(wait, (used - capacity) * period / previous)
+        return wait
+
+    def put_back(self, key, capacity, refill_rate, now):
+        try:
+            cache.decr(self.get_window_key(key, int(now // (capacity / refill_rate))))
+        except ValueError:
+            # 期限切れで消えていれば、戻す分もない
+            pass
+
+
+def refill(bucket, capacity, refill_rate, now):
+    """
+    経過時間の分だけトークンを補充してから1つ取り出し、(残りのトークン, 待つ秒数)を返す。
+    トークンが足りなければ取り出さず、次のトークンまでの秒数を返す。
+    """
+    if bucket is None:
+        tokens = capacity
+    else:
+        tokens, updated_at = bucket
+        tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / refill_rate
+
+
+_stores = {}
+
+
+def get_bucket_store():
+    """
+    THROTTLE_STOREのバケットを返す。指定がなければ、キャッシュがworker間で共有されていれば
+    データベースに触れないCacheBucketStoreを、共有されない（locmem）ならDatabaseBucketStoreを使う。
+    """
+    path = settings.THROTTLE_STORE
+    if path is None:
+        path = (
+            'apiv1.throttling.CacheBucketStore' if is_shared_cache(cache)
+            else 'apiv1.throttling.DatabaseBucketStore'
+        )
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+def purge_full_buckets(now=None):
+    """
+    満タンに戻ったDatabaseBucketStoreのバケットを削除し、件数を返す。
+    どのレートでも、最も長い期間が過ぎれば満タンに戻っている。
+    """
+    now = now or time.time()
+    max_period = max(
+        capacity / refill_rate
+        for rates in settings.THROTTLE_RATES.values()
+        for capacity, refill_rate in map(parse_rate, rates.values())
+    )
+    deleted, _ = ThrottleBucketModel.objects.filter(updated_at__lt=now - max_period).delete()
+    return deleted
+
+
+def parse_rate(rate):
+    """'10/min'を(容量, 1秒あたりの補充量)にする"""
+    num, period = rate.split('/')
+    num = int(num)
+    duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return num, num / duration
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    ビューのthrottle_scopeごとに、IPアドレスとアカウントのバケットからトークンを取り出す。
+    アカウントはリクエストのthrottle_account_fieldの値（メールアドレスなど）で区別する。
+    認証やパスワードのハッシュ計算より前に判定するので、拒否したリクエストはほとんど負荷にならない。
+    IPアドレスはREST_FRAMEWORKのNUM_PROXIESに従い、プロキシが追加したX-Forwarded-Forの値を使う。
+    """
+
+    def allow_request(self, request, view):
+        rates = settings.THROTTLE_RATES[view.throttle_scope]
+        keys = {'ip': self.get_ident(request)}
+        account = self.get_account(request, view)
+        if account:
+            keys['account'] = hashlib.sha256(account.encode('utf-8')).hexdigest()
+
+        now = time.time()
+        store = get_bucket_store()
+        self.wait_seconds = 0
+        taken = []
+        for kind, ident in keys.items():
+            if kind not in rates:
+                continue
+            bucket = (f'{view.throttle_scope}:{kind}:{ident}', *parse_rate(rates[kind]), now)
+            wait = store.take(*bucket)
+            if wait:
+                # 拒否したリクエストでは、先に取り出したバケットのトークンも使わない
+                for taken_bucket in taken:
+                    store.put_back(*taken_bucket)
+                self.wait_seconds = wait
+                return False
+            taken.append(bucket)
+        return True
+
+    def get_account(self, request, view):
+        field = getattr(view, 'throttle_account_field', None)
+        if field is None:
+            return None
+        data = request.data
+        value = data.get(field) if hasattr(data, 'get') else None
+        if not isinstance(value, str):
+            return None
+        return value.strip().lower()
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,206 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+from accounts.models import Follow, Profile
+from posts.models import PostModel, ShareModel, TimelineModel
+from .pagination import get_feed_cursor_filter
+
+
+def get_follower_ids(user_id):
+    return Follow.objects.filter(
+        profile__user=user_id).values_list('user_id', flat=True)
+
+
+def is_high_follower_user(user_id):
+    """フォロワーが多すぎて、書き込み時にタイムラインへ展開しないユーザーか"""
+    return Profile.objects.filter(
+        user=user_id, count_follower__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS).exists()
+
+
+def get_high_follower_user_ids(user):
+    """
+    userがフォローしているユーザーのうち、フォロワーが多すぎて書き込み時に展開しないユーザー
+    """
+    return Profile.objects.filter(
+        followers=user, count_follower__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    ).values_list('user', flat=True)
+
+
+def fan_out_post(post):
+    """投稿を投稿者のフォロワー全員のタイムラインに書き込む"""
+    # フォロワーが多いユーザーは、読み込み時に取得する
+    if is_high_follower_user(post.posted_by_id):
+        return
+    follower_ids = get_follower_ids(post.posted_by_id)
+
+    TimelineModel.objects.bulk_create([
+        TimelineModel(owner_id=follower_id, post=post,
+                      created_at=post.created_at)
+        for follower_id in follower_ids.iterator()
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+def fan_out_share(share):
+    """
+    シェアをシェアした人のフォロワー全員のタイムラインに書き込む。
+    すでにタイムラインにある投稿は、シェアした日時に移動して1件にまとめる。
+    """
+    # フォロワーが多いユーザーのシェアは展開しない
+    if is_high_follower_user(share.shared_by_id):
+        return
+    follower_ids = get_follower_ids(share.shared_by_id)
+
+    TimelineModel.objects.filter(owner__in=follower_ids, post=share.post_id).update(
+        shared_by=share.shared_by_id, created_at=share.created_at)
+    TimelineModel.objects.bulk_create([
+        TimelineModel(owner_id=follower_id, post_id=share.post_id,
+                      shared_by_id=share.shared_by_id, created_at=share.created_at)
+        for follower_id in follower_ids.iterator()
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+def remove_share(share):
+    """シェアを取り消したとき、シェアで展開した分をタイムラインから取り除く"""
+    entries = TimelineModel.objects.filter(
+        post=share.post_id, shared_by=share.shared_by_id)
+    # 投稿者をフォローしている人のタイムラインには、元の投稿として残す
+    entries.exclude(owner__in=get_follower_ids(share.post.posted_by_id)).delete()
+    entries.update(shared_by=None, created_at=share.post.created_at)
+
+
+def backfill_timeline(user, followee):
+    """フォローしたユーザーの最近の投稿とシェアをタイムラインに追加する"""
+    backfill_timelines(user, [followee.id])
+
+
+def backfill_timelines(user, followee_ids):
+    """まとめてフォローしたユーザーの最近の投稿とシェアを、1回でタイムラインに追加する"""
+    high_follower_user_ids = set(Profile.objects.filter(
+        user__in=followee_ids, count_follower__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    ).values_list('user', flat=True))
+    followee_ids = [i for i in followee_ids if i not in high_follower_user_ids]
+    if not followee_ids:
+        return
+
+    posts = PostModel.objects.filter(posted_by__in=followee_ids).values_list(
+        'id', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    shares = ShareModel.objects.filter(shared_by__in=followee_ids).values_list(
+        'post', 'shared_by', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    TimelineModel.objects.bulk_create([
+        TimelineModel(owner_id=user.id, post_id=post_id, created_at=created_at)
+        for post_id, created_at in posts
+    ] + [
+        TimelineModel(owner_id=user.id, post_id=post_id, shared_by_id=shared_by_id,
+                      created_at=created_at)
+        for post_id, shared_by_id, created_at in shares
+    ], batch_size=1000, ignore_conflicts=True)
+    trim_timeline(user.id)
+
+
+def remove_from_timeline(user, followee):
+    """フォローを外したユーザーの投稿とシェアをタイムラインから取り除く"""
+    entries = TimelineModel.objects.filter(owner=user)
+    entries.filter(post__posted_by=followee, shared_by__isnull=True).delete()
+
+    shared = entries.filter(shared_by=followee)
+    # まだフォローしている人の投稿は、元の投稿として残す
+    following = Profile.objects.filter(followers=user).values('user')
+    shared.exclude(post__posted_by__in=following).delete()
+    shared.update(shared_by=None)
+
+
+def trim_timeline(owner_id):
+    """タイムラインをTIMELINE_MAX_LENGTH件に切り詰める"""
+    cutoff = TimelineModel.objects.filter(owner_id=owner_id).values_list(
+        'created_at', flat=True)[settings.TIMELINE_MAX_LENGTH:settings.TIMELINE_MAX_LENGTH + 1]
+    cutoff = list(cutoff)
+    if cutoff:
+        TimelineModel.objects.filter(
+            owner_id=owner_id, created_at__lte=cutoff[0]).delete()
+
+
+def get_home_timeline(user, cursor=None, limit=None):
+    """
+    カーソルより後のホームタイムラインをlimit件返す。
+    展開済みのタイムラインを(owner, -created_at)の索引から読み、
+    フォロワーの多いユーザーの投稿とシェアは、それぞれまとめて新しい順にlimit件までを1回で読んで合わせる。
+    同じ投稿が複数あれば、新しい1件にまとめる。
+    投稿のfeed_atはタイムライン上の日時、shared_by_idはシェアした人。
+    """
+    entries = TimelineModel.objects.filter(owner=user)
+    if cursor is not None:
+        entries = entries.filter(get_feed_cursor_filter('created_at', 'post', cursor))
+    rows = list(entries.order_by('-created_at', '-post').values_list(
+        'created_at', 'post', 'shared_by')[:limit])
+
+    # 展開済みのエントリーがある投稿（シェアされたもの）は、タイムラインの日時で並べる
+    high_follower_user_ids = get_high_follower_user_ids(user)
+    not_in_timeline = ~Exists(TimelineModel.objects.filter(owner=user, post=OuterRef('pk')))
+    posts = PostModel.objects.filter(not_in_timeline, posted_by__in=high_follower_user_ids)
+    shares = ShareModel.objects.filter(
+        ~Exists(TimelineModel.objects.filter(owner=user, post=OuterRef('post'))),
+        shared_by__in=high_follower_user_ids)
+    if cursor is not None:
+        posts = posts.filter(get_feed_cursor_filter('created_at', 'id', cursor))
+        shares = shares.filter(get_feed_cursor_filter('created_at', 'post', cursor))
+    rows += [
+        (created_at, post_id, None) for created_at, post_id in
+        posts.order_by('-created_at', '-id').values_list('created_at', 'id')[:limit]
+    ] + [
+        (created_at, post_id, shared_by_id) for created_at, post_id, shared_by_id in
+        shares.order_by('-created_at', '-post').values_list(
+            'created_at', 'post', 'shared_by')[:limit]
+    ]
+
+    return get_feed_posts(get_latest_rows(rows), limit)
+
+
+def get_latest_rows(rows):
+    """同じ投稿の行を、最も新しい1行にまとめる（展開時にシェアした日時へ移動するのと同じ）"""
+    latest = {}
+    for row in rows:
+        if row[1] not in latest or row[0] > latest[row[1]][0]:
+            latest[row[1]] = row
+    return list(latest.values())
+
+
+def get_user_feed(user_id, cursor=None, limit=None):
+    """
+    ユーザーの投稿とシェアを新しい順にlimit件返す。
+    投稿は(posted_by, -created_at, -id)、シェアは(shared_by, -created_at)の索引からそれぞれlimit件読んで合わせる。
+    自分の投稿のシェアは、投稿として1件だけ表示する。
+    """
+    posts = PostModel.objects.filter(posted_by=user_id)
+    shares = ShareModel.objects.filter(shared_by=user_id).exclude(post__posted_by=user_id)
+    if cursor is not None:
+        posts = posts.filter(get_feed_cursor_filter('created_at', 'id', cursor))
+        shares = shares.filter(get_feed_cursor_filter('created_at', 'post', cursor))
+
+    rows = [
+        (created_at, post_id, None) for created_at, post_id in
+        posts.order_by('-created_at', '-id').values_list('created_at', 'id')[:limit]
+    ] + [
+        (created_at, post_id, user_id) for created_at, post_id in
+        shares.order_by('-created_at', '-post').values_list('created_at', 'post')[:limit]
+    ]
+    return get_feed_posts(rows, limit)
+
+
+def get_feed_posts(rows, limit):
+    """
+    (日時, 投稿のid, シェアした人)を新しい順にlimit件選び、投稿をまとめて読んで返す。
+    投稿にはfeed_atとshared_by_idを付ける。
+    """
+    rows = sorted(rows, key=lambda row: (row[0], row[1]), reverse=True)[:limit]
+    posts = PostModel.objects.for_feed().in_bulk([row[1] for row in rows])
+
+    feed = []
+    for feed_at, post_id, shared_by_id in rows:
+        post = posts.get(post_id)
+        # 読む間に削除された投稿は飛ばす
+        if post is None:
+            continue
+        post.feed_at = feed_at
+        post.shared_by_id = shared_by_id
+        feed.append(post)
+    return feed
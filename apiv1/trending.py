@@ -0,0 +1,57 @@
+import math
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from posts.models import TagTrendModel
+
+
+def get_time_score(now):
+    """時刻nowでの1回分の使用を、スコアの対数の単位で表したもの（now/τ）"""
+    tau = settings.TRENDING_TAGS_HALF_LIFE.total_seconds() / math.log(2)
+    return now.timestamp() / tau
+
+
+def record_tag_usage(tags, now=None):
+    """
+    ハッシュタグが使われたことをスコアに加える。
+    log(exp(a) + exp(b)) = max(a, b) + log(1 + exp(-|a - b|)) として、
+    オーバーフローさせずにUPDATE文1つで加算する。
+    """
+    tag_ids = [tag.pk for tag in tags]
+    if not tag_ids:
+        return
+
+    now = now or timezone.now()
+    time_score = get_time_score(now)
+
+    existing = set(TagTrendModel.objects.filter(
+        tag__in=tag_ids).values_list('tag', flat=True))
+    TagTrendModel.objects.bulk_create([
+        TagTrendModel(tag_id=tag_id, score=time_score, last_used_at=now)
+        for tag_id in tag_ids if tag_id not in existing
+    ], ignore_conflicts=True)
+
+    if existing:
+        b = Value(time_score)
+        TagTrendModel.objects.filter(tag__in=existing).update(
+            score=Greatest(F('score'), b) +
+            Ln(Value(1.0) + Exp(Value(-1.0) * Abs(F('score') - b))),
+            last_used_at=now,
+        )
+
+
+def get_trending_tags(limit, now=None):
+    """スコアの索引を上から読み、直近に使われた上位limit件を返す"""
+    now = now or timezone.now()
+    trends = list(TagTrendModel.objects.select_related('tag').filter(
+        last_used_at__gte=now - settings.TRENDING_TAGS_WINDOW
+    ).order_by('-score')[:limit])
+
+    time_score = get_time_score(now)
+    for trend in trends:
+        # 現在時点の減衰後の使用回数
+        trend.current_score = math.exp(trend.score - time_score)
+    return trends
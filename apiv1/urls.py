@@ -37,6 +37,7 @@ urlpatterns = [
          accounts_views.UpdateUserAPIView.as_view(), name="updare-user"),
     path('delete-account/<uuid:pk>/',
          accounts_views.DeleteUserAPIView.as_view(), name="delete-user"),
+    path('export/', accounts_views.export_data, name='export-data'),
     # profile
     path('myprofile/', accounts_views.MyProfileListView.as_view(), name='myprofile'),
     path('following/<uuid:id>/',
@@ -44,6 +45,11 @@ urlpatterns = [
     path('followers/<uuid:id>/', accounts_views.get_followers,
          name='get-followers-profile'),
     path('follow/<uuid:id>/', accounts_views.follow_user, name="follow-user"),
+    path('follow/suggestions/', accounts_views.follow_suggestions,
+         name="follow-suggestions"),
+    path('follow/bulk/', accounts_views.bulk_follow, name="bulk-follow"),
+    path('user/<uuid:id>/follow/', accounts_views.follow, name="follow"),
+    path('profile/<uuid:id>/stats/', accounts_views.profile_stats, name="profile-stats"),
     # post
     path('post/share/<uuid:post_id>/', posts_views.share_post, name='post-share'),
     path('post/unshare/<uuid:post_id>/',
@@ -54,10 +60,13 @@ urlpatterns = [
     path('post/favorite/<uuid:id>/',
          posts_views.get_favorite_post, name="favorite-post"),
     path('post/like/<uuid:id>/', posts_views.like_post, name="like-post"),
+    path('post/<uuid:id>/like/', posts_views.like, name="like"),
+    path('post/like/state/', posts_views.like_state, name="like-state"),
     path('post/<uuid:id>/likes/', posts_views.get_profiles_like_post,
          name='get-profiles-like-post'),
     path('post/search/<str:id>/', posts_views.post_search, name="search-post"),
     path('post/hashtag/<uuid:id>/', posts_views.post_hashtag, name="post-hashtag"),
+    path('tag/trending/', posts_views.trending_tags, name="trending-tags"),
     path('post/<uuid:id>/comment/', posts_views.comments, name="post-comments"),
     # roadmap
     path('roadmap/user/<uuid:id>/',
@@ -67,6 +76,7 @@ urlpatterns = [
     path('roadmap/search/<str:id>/',
          roadmaps_views.roadmap_search, name="search-roadmap"),
     path('step/roadmap/<uuid:id>/', roadmaps_views.steps, name='step-roadmap'),
+    path('step/<uuid:id>/move/', roadmaps_views.move_step, name='step-move'),
     path('step/change-order', roadmaps_views.change_step_order,
          name='change-step-order'),
     path('lookback/step/<uuid:id>/', roadmaps_views.lookbacks, name='lookback-step')
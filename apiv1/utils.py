@@ -1,10 +1,10 @@
-from django.core.mail import EmailMessage
+from .outbox import enqueue_email
 
 
 class Util:
     # インスタンス化せずに呼び出せる関数（第一引数にselfを受け取らない）
     @staticmethod
     def send_email(data):
-        email = EmailMessage(
-            subject=data['email_subject'], body=data['email_body'], to=[data['to_email']])
-        email.send()
+        # リクエストの中ではSMTPに接続せず、送信待ちにするだけにする
+        enqueue_email(
+            to_email=data['to_email'], subject=data['email_subject'], body=data['email_body'])
@@ -1,46 +1,63 @@
-import datetime
+from collections import OrderedDict
 from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
 from django.urls import reverse
 from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils import timezone
 import jwt
 import random
+import uuid
 from rest_framework import generics, status, views, viewsets, exceptions, mixins
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
-from rest_framework.authentication import get_authorization_header
 from rest_framework.permissions import AllowAny, IsAuthenticated
 import string
 
 from accounts.models import (
-    UserToken,
     Reset,
-    Profile
+    Profile,
+    Follow,
+    FollowSuggestion
 )
 from ..authentication import (
     create_access_token,
     decode_access_token,
-    decode_refresh_token,
     JWTAuthentication
 )
+from ..export import iter_ndjson, iter_zip
+from ..follows import add_follow, add_follows, remove_follow
+from ..fragments import invalidate_author_fragments
+from ..pagination import KeysetPagination
 from ..permissions import (
     InOwnOrReadOnly,
     IsOwnProfileOrReadOnly
 )
+from ..refresh_tokens import revoke_refresh_token, rotate_refresh_token
 from ..serializers.accounts_serializers import (
     UserSerializer,
     GetUserSerializer,
     LoginSerializer,
     ProfileSerializer,
-    ProfilesSerializer
+    FollowProfileSerializer,
+    FollowSuggestionSerializer
 )
+from ..throttling import TokenBucketThrottle
+from ..timeline import backfill_timelines, remove_from_timeline
 from ..utils import Util
 
 
 class RegisterAPIView(generics.GenericAPIView):
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
+    # 認証より前にレート制限する
+    authentication_classes = []
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'register'
+    throttle_account_field = 'email'
 
     def post(self, request):
         data = request.data
@@ -100,21 +117,19 @@ class VerifyEmail(views.APIView):
 
 class LoginAPIView(generics.GenericAPIView):
     serializer_class = LoginSerializer
+    # Basic認証などでパスワードを検証する前にレート制限する
+    authentication_classes = []
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'login'
+    throttle_account_field = 'email'
 
     def post(self, request):
         serializers = self.serializer_class(data=request.data)
-        serializers.is_valid()
+        serializers.is_valid(raise_exception=True)
 
-        user = get_user_model().objects.get(email=request.data['email'])
         # print(serializers.data)
         # print(serializers.validated_data)
 
-        UserToken.objects.create(
-            user_id=str(user.id),
-            token=serializers.data["tokens"]["refresh_token"],
-            expired_at=datetime.datetime.utcnow() + datetime.timedelta(days=7)
-        )
-
         # response = Response()
         # # httponly cookie
         # response.set_cookie(
@@ -134,6 +149,11 @@ class LoginAPIView(generics.GenericAPIView):
 
 
 class RefreshAPIView(views.APIView):
+    authentication_classes = []
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'refresh'
+    throttle_account_field = 'refresh'
+
     def post(self, request):
         # refresh_token = request.COOKIES.get('refresh_token')
         # id = decode_refresh_token(str(refresh_token))
@@ -144,21 +164,13 @@ class RefreshAPIView(views.APIView):
         # ))
 
         refresh_token = request.data['refresh']
-        id = decode_refresh_token(str(refresh_token))
-
-        if not UserToken.objects.filter(
-                user_id=id,
-                token=refresh_token,
-                expired_at__gt=datetime.datetime.now(tz=datetime.timezone.utc)
-                # expired_at__gt=datetime.datetime.now(
-                #     tz=datetime.timezone(datetime.timedelta(hours=+9), 'JST')
-                # )
-        ).exists():
-            raise exceptions.AuthenticationFailed('unauthenticated')
+        # 使ったリフレッシュトークンは無効になるので、新しいトークンを返す
+        id, new_refresh_token = rotate_refresh_token(str(refresh_token))
 
         access_token = create_access_token(str(id))
         return Response({
-            'token': access_token
+            'token': access_token,
+            'refresh': new_refresh_token
         })
 
 
@@ -166,7 +178,7 @@ class LogoutAPIView(views.APIView):
     def post(self, request):
         # refresh_token = request.COOKIES.get('refresh_token')
         refresh_token = request.data['refresh']
-        UserToken.objects.filter(token=refresh_token).delete()
+        revoke_refresh_token(str(refresh_token))
 
         response = Response()
         # response.delete_cookie(key='refresh_token')
@@ -178,6 +190,11 @@ class LogoutAPIView(views.APIView):
 
 
 class ForgotAPIView(views.APIView):
+    authentication_classes = []
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'forgot'
+    throttle_account_field = 'email'
+
     def post(self, request):
         email = request.data['email']
         token = ''.join(random.choice(string.ascii_lowercase +
@@ -207,7 +224,10 @@ class ResetAPIView(views.APIView):
         if data['password'] != data['password_confirm']:
             raise exceptions.APIException('Passwords do not match!')
 
-        reset_password = Reset.objects.filter(token=data['token']).first()
+        reset_password = Reset.objects.filter(
+            token=data['token'],
+            created_at__gt=timezone.now() - settings.RESET_TOKEN_LIFETIME
+        ).first()
 
         if not reset_password:
             raise exceptions.APIException('Invalid link!')
@@ -232,16 +252,9 @@ class UserAPIView(views.APIView):
     authentication_classes = [JWTAuthentication]
 
     def get(self, request):
-        auth = get_authorization_header(request).split()
-        if auth and len(auth) == 2:
-            token = auth[1].decode('utf-8')
-            id = decode_access_token(token)
-            user = get_user_model().objects.get(id=id)
-            if user:
-                serializer = GetUserSerializer(user)
-                return Response(serializer.data)
-
-        raise exceptions.AuthenticationFailed('unauthenticated')
+        # JWTAuthenticationで認証済みのユーザー
+        serializer = GetUserSerializer(request.user)
+        return Response(serializer.data)
 
 
 class UpdateUserAPIView(generics.UpdateAPIView):
@@ -250,6 +263,11 @@ class UpdateUserAPIView(generics.UpdateAPIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = (InOwnOrReadOnly, IsAuthenticated)
 
+    def perform_update(self, serializer):
+        user = serializer.save()
+        # 投稿の表示にユーザー名を含むので作り直す
+        invalidate_author_fragments(user.id)
+
 
 class DeleteUserAPIView(generics.DestroyAPIView):
     queryset = get_user_model().objects.all()
@@ -258,24 +276,50 @@ class DeleteUserAPIView(generics.DestroyAPIView):
     permission_classes = (InOwnOrReadOnly, IsAuthenticated)
 
 
+def follow_list_response(request, follows, get_profile, total):
+    """
+    フォローの関係（Follow）を、フォローした日時の新しい順にページングして返す。
+    followsにはis_followed（閲覧者がフォローしているか）をannotateしておく。
+    """
+    paginator = KeysetPagination()
+    profiles = []
+    for follow in paginator.paginate_queryset(follows, request):
+        profile = get_profile(follow)
+        profile.is_followed = follow.is_followed
+        profiles.append(profile)
+    serializer = FollowProfileSerializer(profiles, many=True)
+    return Response(OrderedDict([
+        ('next', paginator.get_next_link()),
+        ('total', total),
+        ('results', serializer.data)
+    ]))
+
+
 @api_view(['GET'])
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def get_following(request, id):
-    following = Profile.objects.filter(followers=id)
-    serializers = ProfilesSerializer(following, many=True)
-    return Response(serializers.data)
+    """ユーザー（id）がフォローしている人"""
+    follows = Follow.objects.filter(user=id).select_related('profile__user').annotate(
+        is_followed=Exists(Follow.objects.filter(
+            profile=OuterRef('profile_id'), user=request.user.id)))
+    total = Profile.objects.filter(user=id).values_list(
+        'count_following', flat=True).first() or 0
+    return follow_list_response(request, follows, lambda follow: follow.profile, total)
 
 
 @api_view(['GET'])
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def get_followers(request, id):
-    user_id_list = Profile.objects.filter(
-        id=id).first().followers.all().values_list('id', flat=True)
-    followers = Profile.objects.filter(user_id__in=user_id_list)
-    serializers = ProfilesSerializer(followers, many=True)
-    return Response(serializers.data)
+    """プロフィール（id）をフォローしている人。プロフィールのない人は除く"""
+    follows = Follow.objects.filter(profile=id, user__profile__isnull=False).select_related(
+        'user__profile').annotate(
+        is_followed=Exists(Follow.objects.filter(
+            profile__user=OuterRef('user_id'), user=request.user.id)))
+    total = Profile.objects.filter(id=id).values_list(
+        'count_follower', flat=True).first() or 0
+    return follow_list_response(request, follows, lambda follow: follow.user.profile, total)
 
 
 @api_view(['PUT'])
@@ -284,28 +328,110 @@ def get_followers(request, id):
 def follow_user(request, id):
     # followする側のUser
     user = request.user
+    if user.id == id:
+        return Response({'result': 'You can not follow yourself'})
     try:
-        # followされる側のUser
-        user_to_follow = get_user_model().objects.get(id=id)
-        # followされる側のUserのプロフィール（one to one の逆参照）
-        user_to_follow_profile = user_to_follow.profile
-
-        if user == user_to_follow:
-            return Response({'result': 'You can not follow yourself'})
-
-        if user in user_to_follow_profile.followers.all():
-            user_to_follow_profile.followers.remove(user)
-            user_to_follow_profile.save()
-            return Response({'result': 'unfollow', 'unfollower': user.id, 'unfollowing': user_to_follow.id})
-        else:
-            user_to_follow_profile.followers.add(user)
-            user_to_follow_profile.save()
-            return Response({'result': 'follow', 'follower': user.id, 'following': user_to_follow.id})
+        if remove_follow(user.id, id):
+            remove_from_timeline(user, id)
+            return Response({'result': 'unfollow', 'unfollower': user.id, 'unfollowing': id})
+        add_follow(user.id, id)
+        backfill_timelines(user, [id])
+        return Response({'result': 'follow', 'follower': user.id, 'following': id})
     except Exception as e:
         message = {'detail': f'{e}'}
         return Response(message, status=status.HTTP_204_NO_CONTENT)
 
 
+@api_view(['PUT', 'DELETE'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def follow(request, id):
+    """何度呼んでも結果が同じフォロー（PUT）・フォロー解除（DELETE）"""
+    if request.user.id == id:
+        return Response({'detail': 'You can not follow yourself'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.method == 'PUT':
+        try:
+            if add_follow(request.user.id, id):
+                backfill_timelines(request.user, [id])
+        except Profile.DoesNotExist:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'user': id, 'is_followed': True})
+
+    if remove_follow(request.user.id, id):
+        remove_from_timeline(request.user, id)
+    return Response({'user': id, 'is_followed': False})
+
+
+@api_view(['POST'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def bulk_follow(request):
+    """{"ids": [<id>, ...]} のユーザーをまとめてフォローし、新しくフォローしたユーザーのidを返す"""
+    ids = request.data.get('ids')
+    if not isinstance(ids, list):
+        return Response({'detail': 'ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(ids) > settings.BULK_FOLLOW_MAX_IDS:
+        return Response({'detail': f'ids must be at most {settings.BULK_FOLLOW_MAX_IDS}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        user_ids = [uuid.UUID(str(i)) for i in ids]
+    except ValueError:
+        return Response({'detail': 'ids must be UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        followed = add_follows(request.user.id, user_ids)
+    except IntegrityError:
+        # 同時に同じユーザーをフォローした場合は、全体を取り消す
+        return Response({'detail': 'Conflict.'}, status=status.HTTP_409_CONFLICT)
+    backfill_timelines(request.user, followed)
+    return Response({'followed': followed})
+
+
+@api_view(['GET'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def export_data(request):
+    """
+    自分の投稿・コメント・ロードマップ・ステップ・振り返りをNDJSONで返す。
+    ?archive=zip ならzipに圧縮して返す。どちらも読みながら送るので、データ量によらずメモリは一定。
+    """
+    if request.query_params.get('archive') == 'zip':
+        response = StreamingHttpResponse(
+            iter_zip(request.user), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="export.zip"'
+    else:
+        response = StreamingHttpResponse(
+            iter_ndjson(request.user), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="export.ndjson"'
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def follow_suggestions(request):
+    """計算済みのおすすめユーザーを返す。計算後にフォローした人は除く"""
+    suggestions = FollowSuggestion.objects.filter(user=request.user).exclude(
+        suggested__profile__followers=request.user
+    ).select_related('suggested__profile')
+    serializer = FollowSuggestionSerializer(suggestions, many=True)
+    return Response(serializer.data)
+
+
+@api_view(['GET'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def profile_stats(request, id):
+    """集計済みのフォロワー・フォロー・投稿・ロードマップ・いいねされた数を1行で返す"""
+    stats = Profile.objects.filter(user=id).values(
+        'count_follower', 'count_following', 'count_posts',
+        'count_roadmaps', 'count_likes_received').first()
+    if stats is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(stats)
+
+
 class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
@@ -316,6 +442,11 @@ class ProfileViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_update(self, serializer):
+        profile = serializer.save()
+        # 投稿の表示にニックネームと画像を含むので作り直す
+        invalidate_author_fragments(profile.user_id)
+
 
 class MyProfileListView(generics.ListAPIView):
     serializer_class = ProfileSerializer
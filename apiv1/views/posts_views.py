@@ -1,26 +1,43 @@
-from django.contrib.auth import get_user_model
-from django.db.models import Q
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from rest_framework import generics, status, viewsets, mixins
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import PageNumberPagination
 
 from accounts.models import Profile
 from posts.models import (
     PostModel,
-    CommentModel
+    CommentModel,
+    ShareModel
 )
 from ..authentication import (
     JWTAuthentication
 )
+from ..conditional import ConditionalListMixin, ConditionalRetrieveMixin, get_post_etag_parts
+from ..counters import update_profile_counters
+from ..fragments import invalidate_post_fragments
+from ..likes import add_like, get_liked_post_ids, remove_like
+from ..pagination import FeedPagination, KeysetPagination
 from ..serializers.accounts_serializers import ProfilesSerializer
 from ..serializers.posts_serializers import (
     CreateUpdateDeletePostSerializer,
     GetPostSerializer,
-    CommentSerializer
+    CommentSerializer,
+    TrendingTagSerializer
 )
 from ..permissions import IsOwnPostOrReadOnly
+from ..search import index_post, search_posts
+from ..timeline import (
+    fan_out_post,
+    fan_out_share,
+    get_home_timeline,
+    get_user_feed,
+    remove_share
+)
+from ..trending import get_trending_tags
 
 
 class CreateUpdateDeletePostView(mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
@@ -30,25 +47,47 @@ class CreateUpdateDeletePostView(mixins.CreateModelMixin, mixins.UpdateModelMixi
     permission_classes = (IsOwnPostOrReadOnly, IsAuthenticated)
 
     def perform_create(self, serializer):
-        serializer.save(posted_by=self.request.user)
-
-
-class GetPostView(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
-    queryset = PostModel.objects.all()
+        with transaction.atomic():
+            post = serializer.save(posted_by=self.request.user)
+            update_profile_counters(post.posted_by_id, count_posts=1)
+        index_post(post)
+        fan_out_post(post)
+
+    def perform_update(self, serializer):
+        post = serializer.save()
+        index_post(post)
+        invalidate_post_fragments(post.id)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        update_profile_counters(
+            instance.posted_by_id, count_posts=-1,
+            count_likes_received=-instance.count_likes)
+
+
+class GetPostView(ConditionalRetrieveMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = PostModel.objects.with_details()
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated,)
     # queryset = PostModel.objects.filter(is_public="public")
     serializer_class = GetPostSerializer
     # permission_classes = (IsOwnPostOrReadOnly,)
 
+    def get_etag_parts(self, instances):
+        return get_post_etag_parts(instances)
+
 
-class GetPostListView(mixins.ListModelMixin, viewsets.GenericViewSet):
-    queryset = PostModel.objects.filter(parent=None)
+class GetPostListView(ConditionalListMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    queryset = PostModel.objects.for_feed().filter(parent=None)
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated,)
     # queryset = PostModel.objects.filter(is_public="public")
     serializer_class = GetPostSerializer
     # permission_classes = (IsOwnPostOrReadOnly,)
+
+    def get_etag_parts(self, instances):
+        return get_post_etag_parts(instances)
     # def get_queryset(self):
     #     if self.request.user.is_authenticated:
     #         return PostModel.objects.filter(Q(is_public="public") | Q(posted_by=self.request.user))
@@ -59,10 +98,20 @@ class GetPostListView(mixins.ListModelMixin, viewsets.GenericViewSet):
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def share_post(request, post_id):
-    parent_obj = PostModel.objects.filter(id=post_id).first()
-    new_post = PostModel.objects.create(
-        posted_by=request.user, parent=parent_obj)
-    serializer = GetPostSerializer(new_post, context={'request': request})
+    post = PostModel.objects.with_details().filter(id=post_id).first()
+    if post is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    with transaction.atomic():
+        share, created = ShareModel.objects.get_or_create(
+            shared_by=request.user, post=post)
+        if created:
+            PostModel.objects.filter(id=post.id).update(
+                count_shares=F('count_shares') + 1)
+    if created:
+        invalidate_post_fragments(post.id)
+        fan_out_share(share)
+    serializer = GetPostSerializer(post, context={'request': request})
     return Response(serializer.data, status=200)
 
 
@@ -70,9 +119,15 @@ def share_post(request, post_id):
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def unshare_post(request, post_id):
-    parent_obj = PostModel.objects.filter(id=post_id).first()
-    if parent_obj.posted_by == request.user:
-        parent_obj.delete()
+    share = ShareModel.objects.select_related('post').filter(
+        shared_by=request.user, post=post_id).first()
+    if share is not None:
+        with transaction.atomic():
+            share.delete()
+            PostModel.objects.filter(id=post_id).update(
+                count_shares=F('count_shares') - 1)
+        invalidate_post_fragments(post_id)
+        remove_share(share)
         return Response({'result': 'unshare', 'post_id': post_id}, status=200)
     return Response({'result': 'failed'})
 
@@ -85,11 +140,10 @@ def post_user(request, id):
     #     posts = get_user_model().objects.get(id=id).posted_by.all()
     # else:
     #     posts = get_user_model().objects.get(id=id).posted_by.filter(is_public="public")
-    posts = get_user_model().objects.get(id=id).posted_by.all()
-
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
-    result_page = paginator.paginate_queryset(posts, request)
+    # シェアした投稿は、シェアした日時で並べる
+    paginator = FeedPagination()
+    result_page = paginator.paginate_feed(
+        lambda cursor, limit: get_user_feed(id, cursor, limit), request)
     serializer = GetPostSerializer(
         result_page, many=True, context={'request': request})
     return paginator.get_paginated_response(serializer.data)
@@ -106,17 +160,19 @@ def post_user(request, id):
 #     return paginator.get_paginated_response(serializer.data)
 
 
-class GetFollowUserPost(generics.ListAPIView):
+class GetFollowUserPost(ConditionalListMixin, generics.ListAPIView):
     serializer_class = GetPostSerializer
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated, )
+    # シェアされた投稿はシェアされた日時で並べる
+    pagination_class = FeedPagination
+    queryset = PostModel.objects.none()
+
+    def get_feed_page(self, cursor, limit):
+        return get_home_timeline(self.request.user, cursor, limit)
 
-    def get_queryset(self):
-        # User = get_user_model().objects.get(id=self.request.user.id)
-        following = Profile.objects.filter(followers=self.request.user)
-        following_list = [str(i)
-                          for i in following.values_list("user", flat=True)]
-        return PostModel.objects.filter(posted_by__in=following_list)
+    def get_etag_parts(self, instances):
+        return get_post_etag_parts(instances)
 
 
 @api_view(['GET'])
@@ -128,11 +184,10 @@ def post_search(request, id):
     #         post__contains=id, posted_by=request.user))
     # except Exception as e:
     #     posts = PostModel.objects.filter(post__contains=id, is_public="public")
-    posts = PostModel.objects.filter(post__contains=id)
-
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
-    result_page = paginator.paginate_queryset(posts, request)
+    paginator = FeedPagination()
+    # 新しい順
+    result_page = paginator.paginate_feed(
+        lambda cursor, limit: search_posts(id, cursor, limit), request)
     serializer = GetPostSerializer(
         result_page, many=True, context={'request': request})
     return paginator.get_paginated_response(serializer.data)
@@ -142,16 +197,29 @@ def post_search(request, id):
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def post_hashtag(request, id):
-    posts = PostModel.objects.filter(tags=id)
+    posts = PostModel.objects.for_feed().filter(tags=id)
 
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
+    paginator = KeysetPagination()
     result_page = paginator.paginate_queryset(posts, request)
     serializer = GetPostSerializer(
         result_page, many=True, context={'request': request})
     return paginator.get_paginated_response(serializer.data)
 
 
+@api_view(['GET'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def trending_tags(request):
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, settings.TRENDING_TAGS_MAX_LIMIT))
+
+    serializer = TrendingTagSerializer(get_trending_tags(limit), many=True)
+    return Response(serializer.data)
+
+
 @api_view(['POST'])
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
@@ -159,23 +227,49 @@ def like_post(request, id):
     # いいねをするもしくは外すUser
     user = request.user
     try:
-        # いいねされるまたは外されるPost
-        post_to_like = PostModel.objects.get(id=id)
-
-        if user in post_to_like.liked.all():
-            post_to_like.liked.remove(user)
-            post_to_like.save()
-
-            return Response({'result': 'unlike', 'post': post_to_like.id, 'unliked_by': user.id})
-        else:
-            post_to_like.liked.add(user)
-            post_to_like.save()
-            return Response({'result': 'like', 'post': post_to_like.id, 'liked_by': user.id})
+        if remove_like(id, user.id):
+            return Response({'result': 'unlike', 'post': id, 'unliked_by': user.id})
+        add_like(id, user.id)
+        return Response({'result': 'like', 'post': id, 'liked_by': user.id})
     except Exception as e:
         message = {'detail': f'{e}'}
         return Response(message, status=status.HTTP_204_NO_CONTENT)
 
 
+@api_view(['PUT', 'DELETE'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def like(request, id):
+    """何度呼んでも結果が同じいいね（PUT）・いいね解除（DELETE）"""
+    if request.method == 'PUT':
+        try:
+            add_like(id, request.user.id)
+        except PostModel.DoesNotExist:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'post': id, 'is_liked': True})
+
+    remove_like(id, request.user.id)
+    return Response({'post': id, 'is_liked': False})
+
+
+@api_view(['GET'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def like_state(request):
+    """?ids=<id>,<id>,... の投稿のうち、いいねしている投稿のidを返す"""
+    ids = [i for i in request.query_params.get('ids', '').split(',') if i]
+    if len(ids) > settings.LIKE_STATE_MAX_IDS:
+        return Response({'detail': f'ids must be at most {settings.LIKE_STATE_MAX_IDS}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        post_ids = [uuid.UUID(i) for i in ids]
+    except ValueError:
+        return Response({'detail': 'ids must be UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+
+    liked_post_ids = get_liked_post_ids(request.user.id, post_ids)
+    return Response({'liked_post_ids': [i for i in post_ids if i in liked_post_ids]})
+
+
 @api_view(['GET'])
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
@@ -192,9 +286,8 @@ def get_profiles_like_post(request, id):
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def get_favorite_post(request, id):
-    posts = PostModel.objects.filter(liked=id)
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
+    posts = PostModel.objects.for_feed().filter(liked=id)
+    paginator = KeysetPagination()
     result_page = paginator.paginate_queryset(posts, request)
     serializer = GetPostSerializer(
         result_page, many=True, context={'request': request})
@@ -205,17 +298,57 @@ def get_favorite_post(request, id):
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def comments(request, id):
-    comments = CommentModel.objects.filter(post=id)
-    serializer = CommentSerializer(comments, many=True)
-    return Response(serializer.data)
+    # コメントした人とプロフィールはJOINでまとめて取得する
+    comments = CommentModel.objects.select_related(
+        'commented_by__profile').filter(post=id)
+
+    # ?preview=N なら、最新N件とコメント数だけを返す（投稿カードへの埋め込み用）
+    preview = request.query_params.get('preview')
+    if preview is not None:
+        try:
+            preview = max(0, min(int(preview), KeysetPagination.page_size))
+        except ValueError:
+            return Response({'detail': 'preview must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        count = PostModel.objects.filter(id=id).values_list(
+            'count_comments', flat=True).first() or 0
+        serializer = CommentSerializer(comments[:preview], many=True)
+        return Response({'count': count, 'results': serializer.data})
+
+    paginator = KeysetPagination()
+    paginator.ordering = ('-commented_at', '-id')
+    result_page = paginator.paginate_queryset(comments, request)
+    serializer = CommentSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 class CommentViewSet(viewsets.ModelViewSet):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated, )
-    queryset = CommentModel.objects.all()
+    queryset = CommentModel.objects.select_related('commented_by__profile')
     serializer_class = CommentSerializer
-    pagination_class = None
+    cursor_ordering = ('-commented_at', '-id')
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(commented_by=self.request.user)
+        comment = serializer.save(commented_by=self.request.user)
+        PostModel.objects.filter(id=comment.post_id).update(
+            count_comments=F('count_comments') + 1)
+        invalidate_post_fragments(comment.post_id)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        old_post_id = serializer.instance.post_id
+        comment = serializer.save()
+        if comment.post_id != old_post_id:
+            PostModel.objects.filter(id=old_post_id).update(
+                count_comments=F('count_comments') - 1)
+            PostModel.objects.filter(id=comment.post_id).update(
+                count_comments=F('count_comments') + 1)
+            invalidate_post_fragments(old_post_id, comment.post_id)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        PostModel.objects.filter(id=instance.post_id).update(
+            count_comments=F('count_comments') - 1)
+        invalidate_post_fragments(instance.post_id)
@@ -1,10 +1,11 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q
 from rest_framework import generics, status, viewsets
 from rest_framework import permissions
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import PageNumberPagination
 from accounts.models import Profile
 from roadmaps.models import (
     RoadMapModel,
@@ -14,6 +15,24 @@ from roadmaps.models import (
 from ..authentication import (
     JWTAuthentication
 )
+from ..conditional import (
+    ConditionalGetMixin,
+    ConditionalListMixin,
+    conditional_response,
+    get_etag,
+    get_roadmap_etag_parts,
+    get_step_etag_parts
+)
+from ..counters import update_profile_counters
+from ..pagination import KeysetPagination
+from ..ranks import (
+    is_rank_too_long,
+    next_step_rank,
+    rank_between,
+    rebalance_step_ranks,
+    reorder_ranks,
+    with_step_order
+)
 from ..serializers.roadmaps_serializers import (
     RoadMapSerializer,
     StepSerializer,
@@ -26,20 +45,30 @@ from ..permissions import (
 )
 
 
-class RoadMapViewSet(viewsets.ModelViewSet):
+class RoadMapViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = RoadMapModel.objects.all()
     serializer_class = RoadMapSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated, IsOwnRoadmapOrReadOnly)
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(challenger=self.request.user)
+        update_profile_counters(self.request.user.id, count_roadmaps=1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        update_profile_counters(instance.challenger_id, count_roadmaps=-1)
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
             return RoadMapModel.objects.filter(Q(is_public="public") | Q(challenger=self.request.user))
         return RoadMapModel.objects.filter(is_public="public")
 
+    def get_etag_parts(self, instances):
+        return get_roadmap_etag_parts(instances)
+
 
 @api_view(['GET'])
 @authentication_classes((JWTAuthentication,))
@@ -50,8 +79,7 @@ def roadmap_user(request, id):
     else:
         roadmaps = RoadMapModel.objects.filter(
             challenger=id, is_public="public")
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
+    paginator = KeysetPagination()
     result_page = paginator.paginate_queryset(roadmaps, request)
     serializer = RoadMapSerializer(result_page, many=True)
     return paginator.get_paginated_response(serializer.data)
@@ -68,7 +96,7 @@ def roadmap_user(request, id):
 #     serializer = RoadMapSerializer(result_page, many=True)
 #     return paginator.get_paginated_response(serializer.data)
 
-class GetFollowUserRoadmap(generics.ListAPIView):
+class GetFollowUserRoadmap(ConditionalListMixin, generics.ListAPIView):
     serializer_class = RoadMapSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated, )
@@ -80,6 +108,9 @@ class GetFollowUserRoadmap(generics.ListAPIView):
                           for i in following.values_list("user", flat=True)]
         return RoadMapModel.objects.filter(challenger__in=following_list)
 
+    def get_etag_parts(self, instances):
+        return get_roadmap_etag_parts(instances)
+
 
 @api_view(['GET'])
 @authentication_classes((JWTAuthentication,))
@@ -92,31 +123,39 @@ def roadmap_search(request, id):
     except Exception as e:
         roadmaps = RoadMapModel.objects.filter(
             post__contains=id, is_public="public")
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
+    paginator = KeysetPagination()
     result_page = paginator.paginate_queryset(roadmaps, request)
     serializer = RoadMapSerializer(result_page, many=True)
     return paginator.get_paginated_response(serializer.data)
 
 
-class StepViewSet(viewsets.ModelViewSet):
+class StepViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = StepModel.objects.all()
     serializer_class = StepSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated, IsOwnStepOrReadOnly,)
+    cursor_ordering = ('rank', 'id')
 
     def perform_create(self, serializer):
-        roadmap = RoadMapModel.objects.get(id=self.request.data["roadmap"])
-        steps = roadmap.step.all()
-        order_list = [step.order for step in steps]
-        max_order = max(order_list, default=0)
-        serializer.save(
-            roadmap=roadmap, order=(max_order+1))
+        with transaction.atomic():
+            # 同じロードマップへの追加を順番に行い、同じキーを付けないようにする
+            roadmap = RoadMapModel.objects.select_for_update().get(
+                id=self.request.data["roadmap"])
+            rank = next_step_rank(roadmap.id)
+            if is_rank_too_long(rank):
+                rebalance_step_ranks(roadmap.id)
+                rank = next_step_rank(roadmap.id)
+            serializer.save(roadmap=roadmap, rank=rank)
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return StepModel.objects.filter(Q(roadmap__is_public="public") | Q(roadmap__challenger__id=self.request.user.id))
-        return StepModel.objects.filter(roadmap__is_public="public")
+            steps = StepModel.objects.filter(Q(roadmap__is_public="public") | Q(roadmap__challenger__id=self.request.user.id))
+        else:
+            steps = StepModel.objects.filter(roadmap__is_public="public")
+        return with_step_order(steps)
+
+    def get_etag_parts(self, instances):
+        return get_step_etag_parts(instances)
 
 
 @api_view(['GET'])
@@ -125,41 +164,165 @@ class StepViewSet(viewsets.ModelViewSet):
 def steps(request, id):
     steps = StepModel.objects.filter(Q(roadmap__is_public="public") | Q(
         roadmap__challenger__id=request.user.id), roadmap__id=id)
-    serializer = StepSerializer(steps, many=True)
-    return Response(serializer.data)
+    steps = list(steps)
+    # ロードマップの全件をrankの順に読んでいるので、位置は並びのまま
+    for order, step in enumerate(steps):
+        step.order = order
+    etag = get_etag(request, get_step_etag_parts(steps))
+    return conditional_response(
+        request, etag, lambda: Response(StepSerializer(steps, many=True).data))
+
+
+@api_view(['POST'])
+@authentication_classes((JWTAuthentication,))
+@permission_classes((IsAuthenticated,))
+def move_step(request, id):
+    """
+    ステップをafterのステップの直後に移動する（afterがnullなら先頭）。
+    前後のステップのキーの間のキーを付けるので、書き換えるのは移動したステップだけ。
+    """
+    with transaction.atomic():
+        try:
+            step = StepModel.objects.select_related('roadmap').get(id=id)
+        except StepModel.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if request.user.id != step.roadmap.challenger_id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        # 同じロードマップの並べ替えを順番に行う
+        RoadMapModel.objects.select_for_update().filter(id=step.roadmap_id).exists()
+
+        after_id = request.data.get("after")
+        rank = get_move_rank(step, after_id)
+        if rank is None:
+            return Response({'after': 'Invalid step'}, status=status.HTTP_400_BAD_REQUEST)
+        if is_rank_too_long(rank):
+            rebalance_step_ranks(step.roadmap_id)
+            rank = get_move_rank(step, after_id)
+        step.rank = rank
+        step.save(update_fields=['rank', 'updated_at'])
+    return Response(StepSerializer(step).data)
+
+
+def get_move_rank(step, after_id):
+    """stepをafter_idの直後に置くときのキー。after_idが同じロードマップになければNone"""
+    others = StepModel.objects.filter(roadmap=step.roadmap_id).exclude(id=step.id)
+    before = None
+    if after_id is not None:
+        try:
+            before = others.values_list('rank', flat=True).get(id=after_id)
+        except (StepModel.DoesNotExist, ValidationError):
+            return None
+        others = others.filter(rank__gt=before)
+    after = others.order_by('rank', 'id').values_list('rank', flat=True).first()
+    return rank_between(before, after)
 
 
 @api_view(['POST'])
 @authentication_classes((JWTAuthentication,))
 @permission_classes((IsAuthenticated,))
 def change_step_order(request):
-    roadmap = RoadMapModel.objects.get(id=request.data[0]["roadmap"])
-
-    if request.user == roadmap.challenger:
-        serializer = StepSerializer(data=request.data, many=True)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        old_steps = StepModel.objects.filter(
-            roadmap__id=request.data[0]["roadmap"])
-        new_steps = request.data
-        update_list = []
-        for i in range(len(old_steps)):
-            new_step = list(filter(lambda x: x["id"] ==
-                                   str(old_steps[i].id), new_steps))[0]
-            if old_steps[i].order != new_step["order"]:
-                old_steps[i].order = new_step["order"]
-                update_list.append(old_steps[i])
-
-        StepModel.objects.bulk_update(update_list, fields=["order"])
-        return Response(serializer.data)
-    return Response(status=status.HTTP_403_FORBIDDEN)
-
-
-class LookBackViewSet(viewsets.ModelViewSet):
+    """
+    ロードマップのステップを並べ替える。次のどちらかを受け付ける。
+      {"roadmap": id, "order": [ステップのidを並べたもの（全件）]}
+      {"roadmap": id, "moves": [{"step": id, "after": id（nullなら先頭）}, ...]}
+    （以前の、orderを付けたステップの一覧も受け付ける）
+    キーが変わったステップだけを1回のbulk_updateで書き込み、新しい順序を返す。
+    """
+    data = request.data
+    if isinstance(data, list):
+        # 以前の形式。orderの順に並べたものを全件の順序とする
+        try:
+            data = {
+                'roadmap': data[0]['roadmap'],
+                'order': [step['id'] for step in sorted(data, key=lambda x: x['order'])],
+            }
+        except (IndexError, KeyError, TypeError):
+            return Response({'order': 'Invalid steps'}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        # 権限の確認と、同じロードマップの並べ替えを順番に行うためのロックを1回で
+        try:
+            roadmap = RoadMapModel.objects.select_for_update().get(
+                id=data.get('roadmap'), challenger=request.user)
+        except (RoadMapModel.DoesNotExist, ValidationError):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        steps = list(StepModel.objects.filter(roadmap=roadmap).order_by('rank', 'id'))
+        steps_by_id = {str(step.id): step for step in steps}
+        if 'order' in data:
+            new_ids = get_ordered_ids(steps_by_id, data['order'])
+        else:
+            new_ids = apply_moves(steps_by_id, data.get('moves'))
+        if new_ids is None:
+            return Response({'order': 'Invalid steps'}, status=status.HTTP_400_BAD_REQUEST)
+
+        steps = [steps_by_id[id] for id in new_ids]
+        StepModel.objects.bulk_update(reorder_ranks(steps), fields=['rank'])
+
+    for order, step in enumerate(steps):
+        # challengerの取得で、ロードマップを読み直さない
+        step.roadmap = roadmap
+        step.order = order
+    return Response(StepSerializer(steps, many=True).data)
+
+
+def get_ordered_ids(steps_by_id, order):
+    """全件の順序として正しければ、idの一覧を返す"""
+    if not isinstance(order, list):
+        return None
+    ids = [str(id) for id in order]
+    if len(ids) != len(steps_by_id) or set(ids) != steps_by_id.keys():
+        return None
+    return ids
+
+
+def apply_moves(steps_by_id, moves):
+    """
+    現在の順序に移動を順に適用したidの一覧を返す。不正な移動があればNone。
+    前後のidを指す辞書をつなぎ替えるので、移動は1件ずつ定数時間で、最後に1回だけ並べる。
+    """
+    if not isinstance(moves, list):
+        return None
+    # Noneは先頭の前（番兵）
+    ids = [None, *steps_by_id, None]
+    next_ids = dict(zip(ids[:-1], ids[1:]))
+    previous_ids = {id: previous_id for previous_id, id in zip(ids[:-2], ids[1:-1])}
+    for move in moves:
+        if not isinstance(move, dict):
+            return None
+        step_id = str(move.get('step'))
+        after_id = move.get('after')
+        after_id = None if after_id is None else str(after_id)
+        if step_id not in steps_by_id or step_id == after_id or (
+                after_id is not None and after_id not in steps_by_id):
+            return None
+        # 今の位置から外す
+        previous_id, next_id = previous_ids[step_id], next_ids[step_id]
+        next_ids[previous_id] = next_id
+        if next_id is not None:
+            previous_ids[next_id] = previous_id
+        # after_idの直後につなぐ
+        next_id = next_ids[after_id]
+        next_ids[after_id] = step_id
+        previous_ids[step_id] = after_id
+        next_ids[step_id] = next_id
+        if next_id is not None:
+            previous_ids[next_id] = step_id
+
+    ordered = []
+    id = next_ids[None]
+    while id is not None:
+        ordered.append(id)
+        id = next_ids[id]
+    return ordered
+
+
+class LookBackViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = LookBackModel.objects.all()
     serializer_class = LookBackSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = (IsAuthenticated, IsOwnLookBackOrReadOnly,)
+    cursor_ordering = ('created_at', 'id')
 
     def perform_create(self, serializer):
         step = StepModel.objects.get(
@@ -108,6 +108,13 @@ DATABASES = {
     'default': env.db(),
 }
 
+# Cache
+# 本番ではCACHE_URLにredisなどworker間で共有するキャッシュを指定する。
+# 既定のlocmemはworkerごとに別なので、無効化が届かない断片や認証済みユーザーは短い時間だけ保存する
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -151,6 +158,15 @@ STATICFILES_DIRS = (
 
 MEDIA_ROOT = BASE_DIR / 'media/'
 MEDIA_URL = '/media/'
+# 画像のURLの先頭（CDNなど）
+MEDIA_BASE_URL = env('MEDIA_BASE_URL', default='http://127.0.0.1:8000')
+
+# プロフィール画像のサムネイルの大きさ（正方形の一辺のピクセル数）
+AVATAR_SIZES = {
+    'small': 64,
+    'medium': 256,
+    'large': 1024,
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -182,9 +198,77 @@ REST_FRAMEWORK = {
         'djangorestframework_camel_case.parser.CamelCaseJSONParser',
         # Any other parsers
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'DEFAULT_PAGINATION_CLASS': 'apiv1.pagination.KeysetPagination',
+    'PAGE_SIZE': 10,
+    # レート制限でIPアドレスを区別するときに信頼するプロキシの数。
+    # HerokuのルーターはX-Forwarded-Forの最後にクライアントのIPアドレスを追加するので1にする。
+    # プロキシを通さずに動かす場合は0にする（クライアントが送ったX-Forwarded-Forを使わない）
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=1),
 }
+
+# ログイン・登録・パスワードリセット・リフレッシュのレート制限（トークンバケット）
+# 'N/期間'で、N回まで続けて受け付け、期間あたりN回のペースで回復する
+# 既定（None）では、CACHE_URLがredisなどの共有キャッシュならCacheBucketStoreを使い、
+# 拒否するまでにデータベースには触れない。locmemではworker間で数えられないので、
+# DatabaseBucketStore（1リクエストにつき1回のUPDATE）を使う
+THROTTLE_STORE = env('THROTTLE_STORE', default=None)
+THROTTLE_RATES = {
+    'login': {'ip': '30/min', 'account': '10/min'},
+    'register': {'ip': '10/hour', 'account': '5/hour'},
+    'forgot': {'ip': '10/hour', 'account': '3/hour'},
+    'refresh': {'ip': '60/min', 'account': '20/min'},
+}
+
+# ステップの並び順のキーがこれより長くなったら、ロードマップのキーを振り直す
+STEP_RANK_MAX_LENGTH = 32
+
+# 投稿の検索
+# 1ページを返すまでに読む索引の件数の上限。超えたら、続きはnextのページで読む
+SEARCH_MAX_SCANNED = 5000
+SEARCH_SCAN_BATCH_SIZE = 500
+
+# ホームタイムライン
+# 1ユーザーあたりに保持する件数
+TIMELINE_MAX_LENGTH = 800
+# フォロワーがこれより多いユーザーの投稿は書き込み時に展開せず、読み込み時に取得する
+TIMELINE_FANOUT_MAX_FOLLOWERS = 5000
+
+# トレンドのハッシュタグ
+# スコアが半分になるまでの時間
+TRENDING_TAGS_HALF_LIFE = timedelta(hours=6)
+# この期間に使われていないタグはトレンドに含めない
+TRENDING_TAGS_WINDOW = timedelta(days=7)
+TRENDING_TAGS_MAX_LIMIT = 50
+
+# 1回の問い合わせでいいね状態を確認できる投稿の数
+LIKE_STATE_MAX_IDS = 100
+
+# 閲覧者によらない投稿の表示内容をキャッシュする秒数
+POST_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# キャッシュがworker間で共有されない（locmem）場合は、他のworkerで無効にできないので短くする
+POST_FRAGMENT_LOCAL_CACHE_TIMEOUT = 30
+
+# データのエクスポートで1回に読む行数
+EXPORT_CHUNK_SIZE = 2000
+
+# ユーザーごとに保存するおすすめユーザーの数
+FOLLOW_SUGGESTIONS_LIMIT = 20
+
+# 1回でまとめてフォローできるユーザーの数
+BULK_FOLLOW_MAX_IDS = 50
+
+# 認証でデコード済みのトークンを覚えておく件数と秒数（プロセスごと）
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 60
+# 認証したユーザーをキャッシュする秒数。変更・削除されたときは無効にする
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+# キャッシュがworker間で共有されない（locmem）場合の秒数。アクセストークンの有効期限（30秒）と同じにする
+AUTH_USER_LOCAL_CACHE_TIMEOUT = 30
+# リフレッシュトークンとパスワードリセットのトークンの有効期限。期限切れはpurge_expired_tokensで削除する
+REFRESH_TOKEN_LIFETIME = timedelta(days=7)
+RESET_TOKEN_LIFETIME = timedelta(days=1)
+# 無効にしたリフレッシュトークンを、プロセス内で覚えておく件数
+REFRESH_REVOCATION_CACHE_SIZE = 10000
 # CORS
 CORS_ALLOW_ALL_ORIGINS = False
 CORS_ORIGIN_WHITELIST = [env('CORS_ORIGIN_WHITELIST')]
@@ -208,6 +292,17 @@ EMAIL_PORT = 587
 
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+
+# メールはEmailOutboxModelに保存し、send_queued_emailsでまとめて送信する
+# Trueなら、保存したトランザクションのコミット時にその場で送信する（開発用）
+EMAIL_OUTBOX_EAGER = env.bool('EMAIL_OUTBOX_EAGER', default=False)
+# 1つのSMTP接続で送信する件数
+EMAIL_OUTBOX_BATCH_SIZE = 100
+# 送信に失敗したときは、再送の間隔を倍にしていく
+EMAIL_OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+EMAIL_OUTBOX_MAX_RETRY_DELAY = timedelta(hours=1)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
 
 
 if DEBUG == False:
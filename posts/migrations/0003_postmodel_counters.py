@@ -0,0 +1,54 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    PostModel = apps.get_model('posts', 'PostModel')
+    CommentModel = apps.get_model('posts', 'CommentModel')
+
+    def count(queryset, field):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+            .annotate(count=Count('pk')).values('count')
+        ), 0)
+
+    PostModel.objects.update(
+        count_likes=count(PostModel.liked.through.objects.all(), 'postmodel_id'),
+        count_comments=count(CommentModel.objects.all(), 'post_id'),
+        count_shares=count(PostModel.objects.all(), 'parent_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_alter_postmodel_parent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmodel',
+            name='count_comments',
+            field=models.IntegerField(default=0, verbose_name='コメント数'),
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='count_likes',
+            field=models.IntegerField(default=0, verbose_name='いいね数'),
+        ),
+        migrations.AddField(
+            model_name='postmodel',
+            name='count_shares',
+            field=models.IntegerField(default=0, verbose_name='シェア数'),
+        ),
+        migrations.AlterField(
+            model_name='postmodel',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='posts.postmodel'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
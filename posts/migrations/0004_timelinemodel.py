@@ -0,0 +1,36 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0003_postmodel_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='登録日時')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='posts.postmodel')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelinemodel',
+            index=models.Index(fields=['owner', '-created_at'], name='posts_timel_owner_i_fc38cb_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelinemodel',
+            constraint=models.UniqueConstraint(fields=('owner', 'post'), name='unique_timeline_post'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_timelinemodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(fields=['-created_at', '-id'], name='posts_postm_created_697d09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postmodel',
+            index=models.Index(fields=['posted_by', '-created_at', '-id'], name='posts_postm_posted__694d06_idx'),
+        ),
+    ]
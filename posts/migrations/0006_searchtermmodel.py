@@ -0,0 +1,32 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTermModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=2, verbose_name='語')),
+                ('count', models.IntegerField(verbose_name='出現回数')),
+                ('created_at', models.DateTimeField(verbose_name='登録日時')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='posts.postmodel')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtermmodel',
+            index=models.Index(fields=['term', '-created_at'], name='posts_searc_term_a7500c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchtermmodel',
+            constraint=models.UniqueConstraint(fields=('term', 'post'), name='unique_search_term_post'),
+        ),
+    ]
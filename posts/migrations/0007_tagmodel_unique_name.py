@@ -0,0 +1,42 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:43
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    TagModel = apps.get_model('posts', 'TagModel')
+    PostTag = apps.get_model('posts', 'PostModel').tags.through
+
+    names = TagModel.objects.values('name').annotate(
+        count=Count('id')).filter(count__gt=1).values_list('name', flat=True)
+    for name in names:
+        keep, *duplicates = TagModel.objects.filter(name=name).order_by('id')
+        tagged = set(PostTag.objects.filter(
+            tagmodel=keep).values_list('postmodel_id', flat=True))
+        for post_tag in PostTag.objects.filter(tagmodel__in=duplicates):
+            if post_tag.postmodel_id in tagged:
+                post_tag.delete()
+            else:
+                post_tag.tagmodel = keep
+                post_tag.save()
+                tagged.add(post_tag.postmodel_id)
+        TagModel.objects.filter(id__in=[tag.id for tag in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+    # 重複の統合を先にコミットしてから制約を追加する
+    atomic = False
+
+    dependencies = [
+        ('posts', '0006_searchtermmodel'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tagmodel',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
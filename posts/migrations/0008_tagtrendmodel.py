@@ -0,0 +1,22 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_tagmodel_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagTrendModel',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='posts.tagmodel')),
+                ('score', models.FloatField(db_index=True, verbose_name='スコア')),
+                ('last_used_at', models.DateTimeField(verbose_name='最終使用日時')),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def convert_shared_posts(apps, schema_editor):
+    # parentを持つPostModel（シェア）をShareModelに置き換える
+    PostModel = apps.get_model('posts', 'PostModel')
+    ShareModel = apps.get_model('posts', 'ShareModel')
+
+    shared_posts = PostModel.objects.filter(parent__isnull=False).order_by('created_at')
+    shares = {}
+    for post in shared_posts.iterator():
+        shares[(post.posted_by_id, post.parent_id)] = post.created_at
+    ShareModel.objects.bulk_create([
+        ShareModel(shared_by_id=shared_by_id, post_id=post_id)
+        for shared_by_id, post_id in shares
+    ], batch_size=1000)
+    # auto_now_addを上書きする
+    for (shared_by_id, post_id), created_at in shares.items():
+        ShareModel.objects.filter(
+            shared_by_id=shared_by_id, post_id=post_id).update(created_at=created_at)
+    shared_posts.delete()
+
+    # 重複していたシェアをまとめたので、シェア数を数え直す
+    PostModel.objects.update(count_shares=Coalesce(Subquery(
+        ShareModel.objects.filter(post=OuterRef('pk')).order_by().values('post')
+        .annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0008_tagtrendmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelinemodel',
+            name='shared_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='ShareModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='posts.postmodel')),
+                ('shared_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='sharemodel',
+            index=models.Index(fields=['shared_by', '-created_at'], name='posts_share_shared__39da19_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sharemodel',
+            constraint=models.UniqueConstraint(fields=('shared_by', 'post'), name='unique_share'),
+        ),
+        migrations.RunPython(convert_shared_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_sharemodel'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commentmodel',
+            index=models.Index(fields=['post', '-commented_at', '-id'], name='posts_comme_post_id_9bbf48_idx'),
+        ),
+    ]
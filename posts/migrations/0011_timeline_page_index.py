@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_commentmodel_post_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timelinemodel',
+            name='posts_timel_owner_i_fc38cb_idx',
+        ),
+        migrations.AddIndex(
+            model_name='timelinemodel',
+            index=models.Index(fields=['owner', '-created_at', '-post'], name='posts_timel_owner_i_3252de_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_timeline_page_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='searchtermmodel',
+            name='posts_searc_term_a7500c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='searchtermmodel',
+            index=models.Index(fields=['term', '-created_at', '-post'], name='posts_searc_term_eb83e7_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_search_term_scan_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='searchtermmodel',
+            name='count',
+        ),
+    ]
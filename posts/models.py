@@ -8,12 +8,33 @@ from django.contrib.auth import get_user_model
 
 class TagModel(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
 
     def __str__(self):
         return self.name
 
 
+class PostQuerySet(models.QuerySet):
+
+    def for_feed(self):
+        """
+        フィードの1ページ分を選ぶためのqueryset。並べ替えと表示の組み立て、ETagに必要な列だけを読み、
+        本文やタグなどはフラグメントキャッシュ、なければwith_details()でまとめて取得する。
+        """
+        return self.only('id', 'posted_by', 'parent', 'created_at', 'updated_at',
+                         'count_likes', 'count_comments', 'count_shares')
+
+    def with_details(self):
+        """
+        表示用のqueryset。投稿者・プロフィール・シェア元をJOINで、
+        タグをprefetchでまとめて取得し、件数によらず固定回数のクエリで返せるようにする。
+        """
+        return self.select_related(
+            'posted_by__profile',
+            'parent__posted_by__profile',
+        ).prefetch_related('tags', 'parent__tags')
+
+
 class PostModel(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     parent = models.ForeignKey(
@@ -27,9 +48,20 @@ class PostModel(models.Model):
     tags = models.ManyToManyField(TagModel, blank=True, related_name='tags')
     liked = models.ManyToManyField(
         get_user_model(), blank=True, related_name='like')
+    # 読み込みのたびにCOUNTしないよう、いいね・コメント・シェアの数を保持する
+    count_likes = models.IntegerField('いいね数', default=0)
+    count_comments = models.IntegerField('コメント数', default=0)
+    count_shares = models.IntegerField('シェア数', default=0)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at', ]
+        # カーソルページング用
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['posted_by', '-created_at', '-id']),
+        ]
 
     # def __str__(self):
     #     return self.post
@@ -37,7 +69,8 @@ class PostModel(models.Model):
     @property
     def is_shared(self):
         # retweet
-        return self.parent != None
+        # parentを取得せずにFKの値だけで判定する
+        return self.parent_id is not None
 
 
 class CommentModel(models.Model):
@@ -53,6 +86,87 @@ class CommentModel(models.Model):
 
     class Meta:
         ordering = ['-commented_at', ]
+        indexes = [
+            models.Index(fields=['post', '-commented_at', '-id']),
+        ]
 
     def __str__(self):
         return self.comment
+
+
+class ShareModel(models.Model):
+    """投稿のシェア。シェアした人と投稿と日時だけを持つ"""
+    shared_by = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='shares')
+    post = models.ForeignKey(
+        PostModel, on_delete=models.CASCADE, related_name='shares')
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at', ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['shared_by', 'post'], name='unique_share'),
+        ]
+        indexes = [
+            models.Index(fields=['shared_by', '-created_at']),
+        ]
+
+
+class TimelineModel(models.Model):
+    """
+    ホームタイムライン。フォローしているユーザーの投稿とシェアを、書き込み時にフォロワーごとに展開しておく。
+    created_atは投稿日時、シェアの場合はシェアした日時。
+    """
+    owner = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(
+        PostModel, on_delete=models.CASCADE, related_name='timeline')
+    # シェアで展開された場合のシェアした人。複数人にシェアされても1件にまとめ、最後にシェアした人を持つ
+    shared_by = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+    created_at = models.DateTimeField('登録日時')
+
+    class Meta:
+        ordering = ['-created_at', ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'post'], name='unique_timeline_post'),
+        ]
+        # ホームタイムラインの1ページを索引の順に読む
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post']),
+        ]
+
+
+class SearchTermModel(models.Model):
+    """
+    投稿の全文検索用の転置インデックス。本文を1文字・2文字ずつに区切った語を持つ。
+    """
+    term = models.CharField('語', max_length=2)
+    post = models.ForeignKey(
+        PostModel, on_delete=models.CASCADE, related_name='search_terms')
+    # 新しい投稿から探せるよう、投稿の登録日時を複製しておく
+    created_at = models.DateTimeField('登録日時')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['term', 'post'], name='unique_search_term_post'),
+        ]
+        # 語ごとに新しい順に読む
+        indexes = [
+            models.Index(fields=['term', '-created_at', '-post']),
+        ]
+
+
+class TagTrendModel(models.Model):
+    """
+    ハッシュタグの使用回数を時間で減衰させたスコア。
+    scoreは、使用時刻をtとしたexp(t/τ)の和の対数で、全タグの減衰を一律に表せるため
+    そのまま並べ替えに使える（現在のスコアはexp(score - now/τ)）。
+    """
+    tag = models.OneToOneField(
+        TagModel, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    score = models.FloatField('スコア', db_index=True)
+    last_used_at = models.DateTimeField('最終使用日時')
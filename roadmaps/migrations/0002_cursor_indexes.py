@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadmaps', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='roadmapmodel',
+            index=models.Index(fields=['-created_at', '-id'], name='roadmaps_ro_created_546284_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roadmapmodel',
+            index=models.Index(fields=['challenger', '-created_at', '-id'], name='roadmaps_ro_challen_a50e0d_idx'),
+        ),
+    ]
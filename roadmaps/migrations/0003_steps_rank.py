@@ -0,0 +1,67 @@
+# Generated by Django 4.0.3 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def spread_ranks(count):
+    # apiv1.ranks.spread_ranksの、このマイグレーションを作った時点での写し
+    width = 1
+    while len(DIGITS) ** width < 4 * (count + 1):
+        width += 1
+    gap = len(DIGITS) ** width // (2 * (count + 1))
+
+    ranks = []
+    for i in range(1, count + 1):
+        value = i * gap
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, len(DIGITS))
+            digits.append(DIGITS[digit])
+        ranks.append(''.join(reversed(digits)).rstrip('0'))
+    return ranks
+
+
+def fill_ranks(apps, schema_editor):
+    StepModel = apps.get_model('roadmaps', 'StepModel')
+    roadmap_ids = StepModel.objects.values_list('roadmap', flat=True).distinct()
+    for roadmap_id in roadmap_ids.iterator():
+        steps = list(StepModel.objects.filter(roadmap=roadmap_id).order_by(
+            'order', 'created_at').only('id'))
+        for step, rank in zip(steps, spread_ranks(len(steps))):
+            step.rank = rank
+        StepModel.objects.bulk_update(steps, ['rank'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roadmaps', '0002_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stepmodel',
+            name='rank',
+            field=models.CharField(max_length=64, null=True, verbose_name='順番'),
+        ),
+        migrations.RunPython(fill_ranks, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='stepmodel',
+            options={'ordering': ['rank', 'id']},
+        ),
+        migrations.RemoveField(
+            model_name='stepmodel',
+            name='order',
+        ),
+        migrations.AlterField(
+            model_name='stepmodel',
+            name='rank',
+            field=models.CharField(max_length=64, verbose_name='順番'),
+        ),
+        migrations.AddIndex(
+            model_name='stepmodel',
+            index=models.Index(fields=['roadmap', 'rank', 'id'], name='roadmaps_st_roadmap_787d8b_idx'),
+        ),
+    ]
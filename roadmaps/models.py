@@ -20,6 +20,11 @@ class RoadMapModel(models.Model):
 
     class Meta:
         ordering = ['-created_at', ]
+        # カーソルページング用
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['challenger', '-created_at', '-id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -31,12 +36,17 @@ class StepModel(models.Model):
         RoadMapModel, on_delete=models.CASCADE, related_name='step')
     to_learn = models.TextField('やること', max_length=100, blank=True, null=True)
     is_completed = models.CharField('進捗', max_length=50, choices=PROGRESS)
-    order = models.IntegerField('順番')
+    # 辞書順で並べるキー。間に挿入・移動するときは、その行のキーだけを変える
+    rank = models.CharField('順番', max_length=64)
     created_at = models.DateTimeField('登録日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
     class Meta:
-        ordering = ['order', ]
+        ordering = ['rank', 'id']
+        # 末尾のキーの取得と、ロードマップごとの並べ替え用
+        indexes = [
+            models.Index(fields=['roadmap', 'rank', 'id']),
+        ]
 
     def __str__(self):
         return self.to_learn